@@ -1,3 +1,21 @@
 #!/usr/bin/python
 
-from . import bash, fish, man, markdown, printf, shell, utils, zsh
+# Submodules are imported on first access (PEP 562), so a single invocation
+# only pays for the backends it actually uses.
+# `utils` is always imported, it provides `argparse.Action.complete()`.
+
+from . import utils
+
+_submodules = (
+    'bash', 'bulk', 'cache', 'daemon', 'fish', 'formats', 'forkserver', 'index', 'loader', 'man', 'markdown',
+    'options', 'printf', 'runtime', 'serialize', 'shell', 'static', 'stubs', 'utils', 'zsh'
+)
+
+def __getattr__(name):
+    if name in _submodules:
+        __import__(__name__ + '.' + name)
+        return globals()[name]
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules))
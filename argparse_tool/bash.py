@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
-from . import shell, utils
+import os
+from . import shell, utils, writer
 
 # $split && return
 #_filedir '@(?(d)patch|dif?(f))'
@@ -26,6 +27,92 @@ class BashCompletion:
         return 'COMPREPLY%s=(%s)' % (('+' if append else ''), self.values)
 
 
+# Defined only once if multiple programs use it.
+# `_argparse_tool_cached_1 NAME TTL COMMAND...` adds the candidates matching
+# $cur to COMPREPLY. COMMAND is run with an empty $cur to set COMPREPLY to all
+# candidates, which are kept in the array _argparse_tool_cache_1_NAME for TTL
+# seconds. The time is read using printf, which does not fork.
+CACHE_RUNTIME = r"""declare -F _argparse_tool_cached_1 >/dev/null || {
+declare -gA _argparse_tool_cache_time_1
+
+_argparse_tool_cache_update_1() {
+  local name=$1 COMPREPLY=() cur=
+  shift
+  "$@"
+  declare -ga "_argparse_tool_cache_1_$name"
+  local -n _cache=_argparse_tool_cache_1_$name
+  _cache=("${COMPREPLY[@]}")
+}
+
+_argparse_tool_cached_1() {
+  local name=$1 ttl=$2 now time w
+  shift 2
+  printf -v now '%(%s)T' -1
+  time=${_argparse_tool_cache_time_1[$name]:-0}
+  if (( now - time >= ttl || now < time )); then
+    _argparse_tool_cache_update_1 "$name" "$@"
+    _argparse_tool_cache_time_1[$name]=$now
+  fi
+  local -n _cache=_argparse_tool_cache_1_$name
+  for w in "${_cache[@]}"; do
+    [[ $w == "$cur"* ]] && COMPREPLY+=("$w")
+  done
+}
+}
+"""
+
+# Defined only once if multiple programs use it.
+# `_argparse_tool_look_1 FILE` adds the lines of the sorted FILE starting
+# with $cur to COMPREPLY, using a binary search by look(1) if available.
+LOOK_RUNTIME = r"""declare -F _argparse_tool_look_1 >/dev/null || {
+_argparse_tool_look_1() {
+  if [[ -z $cur ]]; then
+    mapfile -t -O ${#COMPREPLY[@]} COMPREPLY < "$1"
+  elif type -P look >/dev/null; then
+    mapfile -t -O ${#COMPREPLY[@]} COMPREPLY < <(LC_ALL=C look -- "$cur" "$1")
+  else
+    mapfile -t -O ${#COMPREPLY[@]} COMPREPLY < <(awk -v p="$cur" 'index($0, p) == 1' "$1")
+  fi
+}
+}
+"""
+
+# Defined only once if multiple programs use it.
+# `_argparse_tool_python_1 FUNCTION ARGS` adds the candidates that the
+# completion daemon (see daemon.py) returns for $cur to COMPREPLY. If the
+# daemon is not running it is started in the background, nothing is
+# completed then. socat or nc is used for connecting to the socket if
+# available, `argparse-tool query` otherwise.
+PYTHON_RUNTIME = r"""declare -F _argparse_tool_python_1 >/dev/null || {
+_argparse_tool_python_1() {
+  local socket=${ARGPARSE_TOOL_SOCKET:-${XDG_RUNTIME_DIR:-/tmp/argparse-tool-$UID}/argparse-tool.sock}
+  if [[ ! -S $socket ]]; then
+    type -P argparse-tool >/dev/null && (argparse-tool daemon --socket "$socket" </dev/null &>/dev/null &)
+    return
+  fi
+
+  local request client=(argparse-tool query "$socket")
+  if type -P socat >/dev/null; then
+    client=(socat -t 2 - "UNIX-CONNECT:$socket")
+  elif type -P nc >/dev/null; then
+    client=(nc -U "$socket")
+  fi
+  printf -v request 'complete\t%s\t%s\t%s' "$1" "$2" "$cur"
+  mapfile -t -O ${#COMPREPLY[@]} COMPREPLY < <("${client[@]}" <<< "$request" 2>/dev/null)
+}
+}
+"""
+
+def write_source_directory(out, variable, name):
+    # Set `variable` to the absolute path of `name`, which is located
+    # relative to the script being sourced
+    out.write('if [[ ${BASH_SOURCE[0]} == */* ]]; then\n')
+    out.write('  %s=${BASH_SOURCE[0]%%/*}/%s\n' % (variable, shell.escape(name)))
+    out.write('else\n')
+    out.write('  %s=%s\n' % (variable, shell.escape(name)))
+    out.write('fi\n')
+    out.write('[[ $%s == /* ]] || %s=$PWD/$%s\n\n' % (variable, variable, variable))
+
 def compgen(args, word='"$cur"'):
     return BashCompletion('$(compgen %s -- %s)' % (args, word))
 
@@ -33,11 +120,30 @@ def compreply(values):
     return BashCompletion(values)
 
 class BashCompleter(shell.ShellCompleter):
+    # If `files` (utils.ChoiceFiles) is given, large choice sets are written
+    # to files in the directory named by the shell variable `directory`
+
+    def __init__(self, files=None, directory=None):
+        self.files = files
+        self.choices_dir = directory
+
     def none(self):
         return BashCompletionCommand('')
 
+    def cached(self, ttl, completion, *a):
+        code = self.complete(completion, *a).to_shell()
+        return BashCompletionCommand('_argparse_tool_cached_1 %s %d eval %s' % (
+            shell.cache_key(completion, *a), ttl, shell.escape(code)))
+
     def choices(self, choices):
-        return compgen('-W '+ shell.escape(' '.join(shell.escape(str(c)) for c in choices)))
+        if self.files is None:
+            return compgen('-W '+ shell.escape(' '.join(shell.escape(str(c)) for c in utils.take_choices(choices))))
+
+        items = utils.get_choice_items(choices, utils.MAX_FILE_CHOICES)
+        if len(items) <= utils.MAX_SCRIPT_CHOICES:
+            return compgen('-W '+ shell.escape(' '.join(shell.escape(value) for value, _ in items)))
+        name = self.files.add(value for value, _ in items)
+        return BashCompletionCommand('_argparse_tool_look_1 "$%s"/%s' % (self.choices_dir, shell.escape(name)))
 
     def command(self):
         return compgen('-A command')
@@ -67,10 +173,13 @@ class BashCompleter(shell.ShellCompleter):
         return BashCompletionCommand('_pnames')
 
     def range(self, range):
+        if not range:
+            return self.none()
+        range = utils.take_range(range)
         if range.step == 1:
-            return compgen(f"-W '{{{range.start}..{range.stop}}}'")
+            return compgen(f"-W '{{{range.start}..{range[-1]}}}'")
         else:
-            return compgen(f"-W '{{{range.start}..{range.stop}..{range.step}}}'")
+            return compgen(f"-W '{{{range.start}..{range[-1]}..{abs(range.step)}}}'")
 
     def service(self):
         return compgen('-A service')
@@ -81,10 +190,16 @@ class BashCompleter(shell.ShellCompleter):
     def variable(self):
         return compgen('-A variable')
 
+    def python(self, function, *args):
+        request = shell.python_request(function, args)
+        if request is None:
+            return self.fallback('python', 'none')
+        return BashCompletionCommand('_argparse_tool_python_1 %s %s' % tuple(shell.escape(s) for s in request))
+
 
 complete = BashCompleter().complete
 
-def complete_action(action, append=True):
+def complete_action(action, append=True, complete=complete):
     r = complete(*action.complete)
     return r.to_shell(append)
 
@@ -98,112 +213,470 @@ def make_switch_case_pattern(option_strings):
 
     return '|'.join(r)
 
-def make_optstring_test_pattern(option_strings):
-    # Return the smallest pattern for matching option_strings
-
-    option_strings = list(sorted(option_strings))
-
-    if len(option_strings) == 0:
-        return ''
-
-    if len(option_strings) == 1:
-        return option_strings[0]
-
-    if len(option_strings) <= 3:
-        return '@(%s)' % '|'.join(option_strings)
-
-    short_opts, long_opts = [], []
-    for o in option_strings:
-        if   o.startswith('--'):  long_opts.append(o[2:])
-        elif o.startswith('-'):   short_opts.append(o[1:])
-
-    if not len(short_opts):
-        return '--@(%s)' % '|'.join(sorted(long_opts))
-
-    if not len(long_opts):
-        return '-@([%s])' % ''.join(sorted(short_opts))
-
-    return "-@([%s]|-@(%s))" % (''.join(sorted(short_opts)), '|'.join(sorted(long_opts)))
-
-def complete_parser(parser, funcname):
+def make_positional_pattern(option):
+    # Return the case pattern matching the argument numbers of a positional
+    num, count = option.get_positional_num(), option.get_positional_count()
+    if count is None:
+        return '*'
+    return '|'.join(str(i) for i in range(num, num + count))
+
+class Tables:
+    ''' Lookup tables used by the word scanner, written as associative arrays.
+
+    Keys are prefixed by the name of the function of a parser, so one table
+    holds the entries of all parsers.
+    '''
+    def __init__(self, prefix):
+        self.option_args         = prefix + '_option_args'    # 'func -o'   -> 1
+        self.subcommands         = prefix + '_subcommands'    # 'func name' -> subcommand function
+        self.subcommand_position = prefix + '_subcommand_pos' # 'func'      -> argument number of the subcommand
+        self.entries = {self.option_args: [], self.subcommands: [], self.subcommand_position: []}
+
+    def add(self, table, key, value):
+        self.entries[table].append((key, value))
+
+    def write(self, out, append=False):
+        # If `append` is True, the entries are added to the existing tables
+        for table, entries in self.entries.items():
+            if append and not entries:
+                continue
+            out.write(('%s+=(\n' if append else 'declare -gA %s=(\n') % table)
+            for key, value in entries:
+                out.write('  [%s]=%s\n' % (shell.escape(key), shell.escape(value)))
+            out.write(')\n')
+        out.write('\n')
+
+def write_scanner(funcname, tables, out, directory=None):
+    # Walk the words before the current word once. This sets `$cmd` to the
+    # function of the innermost subcommand and `$args` to the number of the
+    # current positional argument. Options that take an argument skip the
+    # following word, a short option is looked up by its last character
+    # (for `-abc` the argument belongs to `-c`).
+    # If `directory` is given, it names the variable holding the directory of
+    # the subcommand files, the file of a subcommand is sourced when it is found.
+    load = ''
+    if directory:
+        load = f'\n             declare -F "$cmd" >/dev/null || source "${directory}/$cmd.bash"'
+
+    out.write(f'''  local args=1 cmd={funcname} i w
+  for (( i=1; i < cword; i++ )); do
+    w=${{words[i]}}
+    case "$w" in
+      --*) [[ -n "${{{tables.option_args}[$cmd $w]}}" ]] && (( i++ ));;
+      -?*) [[ -n "${{{tables.option_args}[$cmd -${{w: -1}}]}}" ]] && (( i++ ));;
+      *)   if (( args == ${{{tables.subcommand_position}[$cmd]:-0}} )) && [[ -n "${{{tables.subcommands}[$cmd $w]}}" ]]; then
+             cmd=${{{tables.subcommands}[$cmd $w]}}{load}
+           fi
+           (( args++ ));;
+    esac
+  done
+
+  if [[ $cmd != {funcname} ]]; then
+    $cmd
+    return
+  fi
+
+''')
+
+def write_function(parser, funcname, out, tables, functions, directory=None, complete=complete):
+    # Write the completion function of `parser` and return the subcommands
+    # that still need a function as a list of (Options, funcname).
     # The completion function returns 0 (success) if there was a completion match.
-    # This return code is used when dealing with subparsers.
+    # `functions` maps the id of an already generated parser to its function name,
+    # a parser shared by multiple subcommands (or aliases) gets only one function.
 
     funcname    = shell.make_identifier(funcname)
     options     = parser.get_options()
     positionals = parser.get_positionals()
     subparsers  = parser.get_subparsers_option()
 
-    r  = f'{funcname}() {{\n'
+    out.write(f'{funcname}() {{\n')
 
     if parser.parent is None:
-        # The root parser makes those variables local and sets up the completion.
-        # Calls to subparser functions modify these variables.
-        r += '  local cur prev words cword split args w\n'
-        r += '  _init_completion -s || return\n'
-        r += '\n'
-
-        if len(positionals) or subparsers:
-            # The call to _count_args allows us to complete positionals later using $args.
-            # TODO: count args for subparsers.
-            option_strings = parser.get_option_strings(only_with_arguments=True)
-            r += '  _count_args "" "%s"\n' % make_optstring_test_pattern(option_strings)
-
-    if len(options):
-        s = ''
-        for action in parser.get_options(only_with_arguments=True):
-            s += '    %s)\n' % make_switch_case_pattern(action.option_strings)
-            code = complete_action(action, False)
+        # The root parser makes those variables local, sets up the completion
+        # and calls the function of the subcommand that is completed.
+        out.write('  local cur prev words cword split\n')
+        out.write('  _init_completion -s || return\n')
+        out.write('\n')
+        write_scanner(funcname, tables, out, directory)
+
+    options_with_args = parser.get_options(only_with_arguments=True)
+    for action in options_with_args:
+        for option_string in action.option_strings:
+            tables.add(tables.option_args, '%s %s' % (funcname, option_string), '1')
+
+    if len(options) and len(options_with_args):
+        out.write('  case "$prev" in\n')
+        for action in options_with_args:
+            out.write('    %s)\n' % make_switch_case_pattern(action.option_strings))
+            code = complete_action(action, False, complete)
             if code:
-                s += '       %s\n' % code
-            s += '       return 0;;\n'
-
-        if s:
-            r += '  case "$prev" in\n'
-            r += s
-            r += '  esac\n'
-            r += '\n'
+                out.write('       %s\n' % code)
+            out.write('       return 0;;\n')
+        out.write('  esac\n')
+        out.write('\n')
 
-    r += '  [[ "$cur" = -* ]] && %s\n' % complete('choices', parser.get_all_optstrings()).to_shell(True)
-    r += '\n'
+    out.write('  [[ "$cur" = -* ]] && %s\n' % complete('choices', parser.get_all_optstrings()).to_shell(True))
+    out.write('\n')
 
     if len(positionals) or subparsers:
-        r += '  case $args in\n' # $args is the number of args
-        for action in positionals:
-            r += '    %d) %s\n' % (action.get_positional_num(), complete_action(action))
-            r += '       return 0;;\n'
+        out.write('  case $args in\n') # $args is the number of the current argument
         if subparsers:
-            r += '    %d) %s\n' % (subparsers.get_positional_num(), complete_action(subparsers))
-            r += '       return 0;;\n'
-        r += '  esac\n'
-        r += '\n'
-
+            positionals.append(subparsers)
+        # Positionals taking unlimited arguments match all remaining numbers
+        for action in sorted(positionals, key=lambda o: o.get_positional_count() is None):
+            out.write('    %s) %s\n' % (make_positional_pattern(action), complete_action(action, True, complete)))
+            out.write('       return 0;;\n')
+        out.write('  esac\n')
+        out.write('\n')
+
+    out.write('  return 1\n')
+    out.write('}\n\n')
+
+    subfunctions = []
     if subparsers:
-        r += '  for w in "${COMP_WORDS[@]}"; do\n'
-        r += '    case "$w" in\n'
-        for name in subparsers.subcommands.keys():
-            f = shell.make_identifier('_%s_%s' % (parser.prog, name))
-            r += '      %s) %s && return 0;;\n' % (shell.escape(name), f)
-        r += '    esac\n'
-        r += '  done\n'
-        r += '\n'
-
-    r += '  return 1\n'
-    r += '}\n\n'
+        tables.add(tables.subcommand_position, funcname, str(subparsers.get_positional_num()))
 
-    if subparsers:
         for name, sub in subparsers.subcommands.items():
-            funcname = shell.make_identifier('_%s_%s' % (parser.prog, name))
-            r += complete_parser(sub, funcname)
+            f = functions.get(id(sub))
+            if f is None:
+                f = functions[id(sub)] = shell.make_identifier('%s_%s' % (funcname, name))
+                subfunctions.append((sub, f))
+            for n in subparsers.get_names(name):
+                tables.add(tables.subcommands, '%s %s' % (funcname, n), f)
+
+    return subfunctions
+
+def complete_parser(parser, funcname, out, tables, functions=None, complete=complete):
+    # Write the completion functions of `parser` and all of its subcommands
+    if functions is None:
+        functions = {}
+
+    for sub, f in write_function(parser, funcname, out, tables, functions, complete=complete):
+        complete_parser(sub, f, out, tables, functions, complete)
+
+def generate_completion(options, program_name=None, fh=None, choice_files=False):
+    ''' Return the bash completion script, write it to `fh` if given.
+
+    If `choice_files` is True, large choice sets are written to files next
+    to the script (see utils.get_choice_files).
+    '''
+    if program_name is None:
+        program_name = options.prog
+
+    out = writer.Writer(fh)
+    if shell.uses_completion(options, {'cached'}):
+        out.write(CACHE_RUNTIME + '\n')
+    if shell.uses_completion(options, {'python'}):
+        out.write(PYTHON_RUNTIME + '\n')
+    funcname = shell.make_identifier('_' + program_name)
+    tables = Tables(funcname)
+    files = utils.get_choice_files(fh, program_name, 'bash', choice_files)
+    complete_parser(options, funcname, out, tables, complete=BashCompleter(files, funcname + '_choices').complete)
+    tables.write(out)
+    if files and files.files:
+        write_source_directory(out, funcname + '_choices', program_name + '.choices')
+        out.write(LOOK_RUNTIME + '\n')
+    out.write('complete -F %s %s' % (funcname, program_name))
+    return out.getvalue()
+
+def generate_completion_files(options, program_name=None, outdir='.', choice_files=False):
+    ''' Write the completion as a small root script and one file per subcommand.
+
+    The root script `prog.bash` is written to `outdir`, the function of each
+    subcommand to `outdir/prog.d/FUNCTION.bash`. The root function sources
+    the file of a subcommand the first time the subcommand is completed, so
+    only the parts of the tree that are used are loaded. If `choice_files`
+    is True, large choice sets are written to files in `prog.d`.
+    Returns the list of written files.
+    '''
+    if program_name is None:
+        program_name = options.prog
+
+    funcname  = shell.make_identifier('_' + program_name)
+    directory = funcname + '_dir'
+    subdir    = program_name + '.d'
+    os.makedirs(os.path.join(outdir, subdir), exist_ok=True)
+
+    # Large choice sets are written to the directory of the subcommand files
+    choices = utils.ChoiceFiles(os.path.join(outdir, subdir), 'bash') if choice_files else None
+    complete = BashCompleter(choices, directory).complete
+
+    files = [os.path.join(outdir, program_name + '.bash')]
+    with open(files[0], 'w') as fh:
+        out = writer.Writer(fh)
+        # The subcommand files are located relative to the root script
+        write_source_directory(out, directory, subdir)
+        if shell.uses_completion(options, {'cached'}):
+            out.write(CACHE_RUNTIME + '\n')
+        if shell.uses_completion(options, {'python'}):
+            out.write(PYTHON_RUNTIME + '\n')
+
+        tables = Tables(funcname)
+        functions = {}
+        todo = write_function(options, funcname, out, tables, functions, directory, complete)
+        tables.write(out)
+        if choices and choices.files:
+            out.write(LOOK_RUNTIME + '\n')
+        out.write('complete -F %s %s\n' % (funcname, program_name))
+
+    while todo:
+        sub, f = todo.pop(0)
+        files.append(os.path.join(outdir, subdir, f + '.bash'))
+        with open(files[-1], 'w') as fh:
+            out = writer.Writer(fh)
+            tables = Tables(funcname)
+            count = len(choices.files) if choices else 0
+            todo.extend(write_function(sub, f, out, tables, functions, complete=complete))
+            tables.write(out, append=True)
+            if choices and len(choices.files) > count:
+                out.write(LOOK_RUNTIME)
+
+    return files
+
+# =============================================================================
+# Table driven completion
+#
+# The completion is done by a generic function that reads the data of the
+# program from arrays. The code does not grow with the number of options.
+# =============================================================================
+
+class BashSpecCompleter(shell.ShellCompleter):
+    # Returns the completion as a spec string 'KIND ARGUMENT' that is
+    # interpreted by `_argparse_tool_spec_1` (see TABLE_RUNTIME).
+    # If `files` (utils.ChoiceFiles) is given, large choice sets are written to files.
+
+    def __init__(self, files=None):
+        self.files = files
+
+    def none(self):
+        return 'n'
 
-    return r
+    def cached(self, ttl, completion, *a):
+        return 'C %s %d %s' % (shell.cache_key(completion, *a), ttl, self.complete(completion, *a))
 
-def generate_completion(options, program_name=None):
+    def choices(self, choices):
+        if self.files is None:
+            return 'w ' + ' '.join(shell.escape(str(c)) for c in utils.take_choices(choices))
+
+        items = utils.get_choice_items(choices, utils.MAX_FILE_CHOICES)
+        if len(items) <= utils.MAX_SCRIPT_CHOICES:
+            return 'w ' + ' '.join(shell.escape(value) for value, _ in items)
+        return 'l ' + self.files.add(value for value, _ in items)
+
+    def command(self):
+        return 'a command'
+
+    def directory(self, glob_pattern=None):
+        if not glob_pattern:
+            return 'd'
+        else:
+            return 'g ' + glob_pattern
+
+    def file(self, glob_pattern=None):
+        if not glob_pattern:
+            return 'f'
+        else:
+            return 'g ' + glob_pattern
+
+    def group(self):
+        return 'a group'
+
+    def hostname(self):
+        return 'a hostname'
+
+    def pid(self):
+        return 'c _pids'
+
+    def process(self):
+        return 'c _pnames'
+
+    def range(self, range):
+        if not range:
+            return self.none()
+        range = utils.take_range(range)
+        return f'w {{{range.start}..{range[-1]}..{abs(range.step)}}}'
+
+    def service(self):
+        return 'a service'
+
+    def user(self):
+        return 'a user'
+
+    def variable(self):
+        return 'a variable'
+
+    def python(self, function, *args):
+        request = shell.python_request(function, args)
+        if request is None:
+            return self.fallback('python', 'none')
+        return 'p %s %s' % request
+
+complete_spec = BashSpecCompleter().complete
+
+# The completion engine, it is defined only once if multiple programs use it.
+# Tables of a program with prefix P (parsers are numbered, the root is 0):
+#   P_spec[i]         completion spec number i
+#   P_opts[n]         spec number of the option strings of parser n
+#   P_optarg[n opt]   spec number of an option taking an argument
+#   P_pos[n k]        spec number of positional argument number k
+#   P_rest[n]         'k i' - arguments from number k on are completed by spec i
+#   P_sub[n name]     parser number of subcommand `name`
+#   P_subpos[n]       argument number of the subcommand
+#   P_choices         directory of the choice files (spec 'l FILE')
+# The spec 'p FUNCTION ARGS' is completed by the completion daemon.
+TABLE_RUNTIME = r"""declare -F _argparse_tool_complete_1 >/dev/null || {
+_argparse_tool_spec_1() {
+  case "${1:0:1}" in
+    w) COMPREPLY+=($(compgen -W "${1:2}" -- "$cur"));;
+    f) COMPREPLY+=($(compgen -f -- "$cur"));;
+    d) COMPREPLY+=($(compgen -d -- "$cur"));;
+    g) COMPREPLY+=($(compgen -G "${1:2}" -- "$cur"));;
+    a) COMPREPLY+=($(compgen -A "${1:2}" -- "$cur"));;
+    c) ${1:2};;
+    l) _argparse_tool_look_1 "$_choices/${1:2}";;
+    p) local s=${1:2}
+       _argparse_tool_python_1 "${s%% *}" "${s#* }";;
+    C) local s=${1:2} name ttl
+       name=${s%% *}; s=${s#* }; ttl=${s%% *}
+       _argparse_tool_cached_1 "$name" "$ttl" _argparse_tool_spec_1 "${s#* }";;
+  esac
+}
+
+_argparse_tool_complete_1() {
+  local -n _spec=$1_spec _opts=$1_opts _optarg=$1_optarg _pos=$1_pos _rest=$1_rest _sub=$1_sub _subpos=$1_subpos
+  local -n _choices=$1_choices
+  local cur prev words cword split
+  _init_completion -s || return
+
+  local args=1 n=0 i w s
+  for (( i=1; i < cword; i++ )); do
+    w=${words[i]}
+    case "$w" in
+      --*) [[ -n "${_optarg[$n $w]}" ]] && (( i++ ));;
+      -?*) [[ -n "${_optarg[$n -${w: -1}]}" ]] && (( i++ ));;
+      *)   if (( args == ${_subpos[$n]:-0} )) && [[ -n "${_sub[$n $w]}" ]]; then
+             n=${_sub[$n $w]}
+           fi
+           (( args++ ));;
+    esac
+  done
+
+  case "$prev" in
+    --*) s=${_optarg[$n $prev]};;
+    -?*) s=${_optarg[$n -${prev: -1}]};;
+    *)   s=;;
+  esac
+  if [[ -n $s ]]; then
+    _argparse_tool_spec_1 "${_spec[s]}"
+    return 0
+  fi
+
+  [[ "$cur" = -* ]] && _argparse_tool_spec_1 "${_spec[${_opts[n]}]}"
+
+  s=${_pos[$n $args]}
+  if [[ -z $s && -n ${_rest[$n]} ]] && (( args >= ${_rest[$n]% *} )); then
+    s=${_rest[$n]#* }
+  fi
+  [[ -n $s ]] && _argparse_tool_spec_1 "${_spec[s]}"
+  return 0
+}
+}
+"""
+
+class SpecTables:
+    ''' Collects the tables of `generate_table_completion`, equal specs are stored once '''
+    def __init__(self, prefix, files=None):
+        self.prefix   = prefix
+        self.complete = BashSpecCompleter(files).complete
+        self.specs    = {} # spec -> number
+        self.opts     = [] # parser number -> spec number
+        self.optarg   = []
+        self.pos      = []
+        self.rest     = []
+        self.sub      = []
+        self.subpos   = []
+        self.parsers  = {} # id(Options) -> parser number
+
+    def spec(self, spec):
+        return self.specs.setdefault(spec, len(self.specs))
+
+    def add_parser(self, parser):
+        # Add `parser` and its subcommands, return its number
+        if id(parser) in self.parsers:
+            return self.parsers[id(parser)]
+
+        n = self.parsers[id(parser)] = len(self.opts)
+        self.opts.append(self.spec(self.complete('choices', parser.get_all_optstrings())))
+
+        for option in parser.get_options(only_with_arguments=True):
+            s = self.spec(self.complete(*option.complete))
+            for option_string in option.option_strings:
+                self.optarg.append(('%d %s' % (n, option_string), s))
+
+        positionals = parser.get_positionals()
+        subparsers  = parser.get_subparsers_option()
+        if subparsers:
+            positionals.append(subparsers)
+
+        for option in positionals:
+            s = self.spec(self.complete(*option.complete))
+            num, count = option.get_positional_num(), option.get_positional_count()
+            if count is None:
+                self.rest.append((n, '%d %d' % (num, s)))
+            else:
+                for k in range(num, num + count):
+                    self.pos.append(('%d %d' % (n, k), s))
+
+        if subparsers:
+            self.subpos.append((n, subparsers.get_positional_num()))
+            for name, sub in subparsers.subcommands.items():
+                m = self.add_parser(sub)
+                for alias in subparsers.get_names(name):
+                    self.sub.append(('%d %s' % (n, alias), m))
+
+        return n
+
+    def write(self, out):
+        def write_table(name, entries, kind='A'):
+            out.write('declare -g%s %s_%s=(\n' % (kind, self.prefix, name))
+            for key, value in entries:
+                out.write('  [%s]=%s\n' % (shell.escape(str(key)), shell.escape(str(value))))
+            out.write(')\n')
+
+        write_table('spec',   [(i, spec) for spec, i in self.specs.items()], 'a')
+        write_table('opts',   enumerate(self.opts), 'a')
+        write_table('optarg', self.optarg)
+        write_table('pos',    self.pos)
+        write_table('rest',   self.rest)
+        write_table('sub',    self.sub)
+        write_table('subpos', self.subpos)
+
+def generate_table_completion(options, program_name=None, fh=None, choice_files=False):
+    ''' Return the table driven bash completion script, write it to `fh` if given.
+
+    If `choice_files` is True, large choice sets are written to files next
+    to the script (see utils.get_choice_files).
+    '''
     if program_name is None:
         program_name = options.prog
 
+    out = writer.Writer(fh)
     funcname = shell.make_identifier('_' + program_name)
-    r  = complete_parser(options, funcname).rstrip()
-    r += '\n\n'
-    r += 'complete -F %s %s' % (funcname, program_name)
-    return r
+    files = utils.get_choice_files(fh, program_name, 'bash-table', choice_files)
+    tables = SpecTables(funcname, files)
+    tables.add_parser(options)
+    out.write(TABLE_RUNTIME)
+    out.write('\n')
+    if files and files.files:
+        out.write(LOOK_RUNTIME + '\n')
+        write_source_directory(out, funcname + '_choices', program_name + '.choices')
+    if shell.uses_completion(options, {'cached'}):
+        out.write(CACHE_RUNTIME + '\n')
+    if shell.uses_completion(options, {'python'}):
+        out.write(PYTHON_RUNTIME + '\n')
+    tables.write(out)
+    out.write('\n')
+    out.write('%s() {\n  _argparse_tool_complete_1 %s\n}\n\n' % (funcname, funcname))
+    out.write('complete -F %s %s' % (funcname, program_name))
+    return out.getvalue()
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+''' Generation of output files for many programs at once.
+
+Each program is loaded in its own worker process, so programs cannot
+interfere with each other.
+'''
+
+import sys, os, signal, concurrent.futures
+from . import utils, loader, formats
+
+class Job:
+    def __init__(self, program_file, parser_variable=None, program_name=None):
+        self.program_file = program_file
+        self.parser_variable = parser_variable
+        self.program_name = program_name
+
+    def __repr__(self):
+        return ':'.join(s for s in (self.program_file, self.parser_variable, self.program_name) if s)
+
+def parse_manifest(file):
+    ''' Parse a manifest file.
+
+    Each line has the form `program_file[:parser_variable[:program_name]]`,
+    empty lines and lines starting with '#' are ignored.
+    '''
+
+    jobs = []
+    with open(file, 'r') as fh:
+        for line in fh:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(':')
+            if len(fields) > 3:
+                raise Exception('Invalid manifest line: %r' % line)
+            fields += [None] * (3 - len(fields))
+            jobs.append(Job(*(f or None for f in fields)))
+    return jobs
+
+class Result:
+    def __init__(self, job, error=None, timings=None):
+        self.job = job
+        self.error = error
+        self.timings = timings or utils.Timings()
+
+class Timeout(BaseException):
+    # Not derived from Exception, so it isn't caught by the program or the loader
+    pass
+
+def _timeout_handler(signum, frame):
+    raise Timeout('Timeout exceeded')
+
+def run_job(job, selected_formats, outdir, timeout=None, use_static=False, cache_dir=None, stub_modules=None,
+            choice_files=False):
+    ''' Load a single program and write all selected formats '''
+
+    timings = utils.Timings()
+
+    if timeout:
+        signal.signal(signal.SIGALRM, _timeout_handler)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        tree = loader.load_options(job.program_file, job.parser_variable, job.program_name,
+            help_text=formats.needs_help_text(selected_formats),
+            use_static=use_static, cache_dir=cache_dir, timings=timings, stub_modules=stub_modules)
+
+        formats.write_all(selected_formats, tree, job.program_name or tree.prog, outdir, timings,
+            choice_files=choice_files)
+    except BaseException as e:
+        # SystemExit and KeyboardInterrupt raised by the program are errors, too
+        return Result(job, '%s: %s' % (type(e).__name__, e), timings)
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+    return Result(job, None, timings)
+
+def _make_executor(max_workers):
+    # A fresh worker process for each program, so state (sys.modules,
+    # patched modules, globals) does not leak between programs.
+    try:
+        return concurrent.futures.ProcessPoolExecutor(max_workers, max_tasks_per_child=1)
+    except TypeError: # Python < 3.11
+        return concurrent.futures.ProcessPoolExecutor(max_workers)
+
+def _run_pool(jobs, args, max_workers):
+    results, broken = {}, []
+
+    with _make_executor(max_workers) as executor:
+        futures = {executor.submit(run_job, job, *args): job for job in jobs}
+
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            try:
+                results[job] = future.result()
+                results[job].job = job
+            except concurrent.futures.process.BrokenProcessPool:
+                broken.append(job)
+
+    return results, broken
+
+def run(jobs, selected_formats, outdir, max_workers=None, timeout=None, use_static=False, cache_dir=None, stub_modules=None,
+        choice_files=False):
+    ''' Run `jobs` in a process pool, return a list of `Result` objects '''
+
+    args = (selected_formats, outdir, timeout, use_static, cache_dir, stub_modules, choice_files)
+    results, broken = _run_pool(jobs, args, max_workers)
+
+    # A worker process died (e.g. the program called os._exit()), which
+    # breaks the whole pool. Retry the affected jobs one by one.
+    for job in broken:
+        r, failed = _run_pool([job], args, 1)
+        results.update(r)
+        if failed:
+            results[job] = Result(job, 'Worker process terminated abruptly')
+
+    return [results[job] for job in jobs]
+
+def report(results, file=sys.stderr):
+    ''' Print a summary of `results` '''
+
+    failed = [r for r in results if r.error]
+
+    for r in results:
+        stages = ' '.join('%s=%.3fs' % stage for stage in r.timings.stages)
+        print('%-6s %8.3fs  %s  %s' % ('FAILED' if r.error else 'OK', r.timings.total(), r.job, stages), file=file)
+
+    if failed:
+        print('\nFailures:', file=file)
+        for r in failed:
+            print('  %s: %s' % (r.job, r.error), file=file)
+
+    print('\n%d programs, %d failed, %.3fs total' % (
+        len(results), len(failed), sum(r.timings.total() for r in results)), file=file)
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+''' On-disk cache for `Options` trees.
+
+Entries are keyed by the hash of the program file and all local python files
+it imports (transitively), so a cached entry gets invalid as soon as one of
+these files changes.
+'''
+
+import os, ast, hashlib
+from . import serialize
+
+def default_directory():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'argparse-tool')
+
+def _module_files(directory, module_name):
+    ''' Yield the files of `module_name` and its parent packages inside `directory` '''
+
+    path = directory
+    for part in module_name.split('.'):
+        path = os.path.join(path, part)
+        if os.path.isfile(path + '.py'):
+            yield path + '.py'
+            return
+        elif os.path.isfile(os.path.join(path, '__init__.py')):
+            yield os.path.join(path, '__init__.py')
+        else:
+            return
+
+def local_imports(file):
+    ''' Return the list of local files imported by `file` (transitively) '''
+
+    program = os.path.abspath(file)
+    root = os.path.dirname(program)
+    seen = set()
+    todo = [program]
+
+    while todo:
+        file = todo.pop()
+        if file in seen:
+            continue
+        seen.add(file)
+
+        try:
+            with open(file, 'r') as fh:
+                tree = ast.parse(fh.read(), file)
+        except (OSError, SyntaxError, ValueError):
+            continue
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    todo.extend(_module_files(root, alias.name))
+
+            elif isinstance(node, ast.ImportFrom):
+                directory = root
+                if node.level:
+                    directory = os.path.dirname(file)
+                    for i in range(node.level - 1):
+                        directory = os.path.dirname(directory)
+
+                module = node.module or ''
+                if module:
+                    todo.extend(_module_files(directory, module))
+                for alias in node.names:
+                    todo.extend(_module_files(directory, (module + '.' + alias.name).lstrip('.')))
+
+    seen.discard(program)
+    return sorted(seen)
+
+def key(file, *extra):
+    ''' Return the cache key for `file`.
+
+    `extra` are additional values that affect the generated Options tree
+    (e.g. the parser variable).
+    '''
+
+    h = hashlib.sha256()
+    h.update(repr((serialize.VERSION, extra)).encode('utf-8'))
+
+    for f in [file] + local_imports(file):
+        with open(f, 'rb') as fh:
+            h.update(hashlib.sha256(fh.read()).digest())
+
+    return h.hexdigest()
+
+def get(directory, key):
+    ''' Return the cached Options tree for `key` or None '''
+    try:
+        return serialize.load(os.path.join(directory, key + '.ir'))
+    except Exception:
+        return None
+
+def put(directory, key, options):
+    ''' Store the Options tree for `key` '''
+    os.makedirs(directory, exist_ok=True)
+    file = os.path.join(directory, key + '.ir')
+    temp = '%s.%d.tmp' % (file, os.getpid())
+    serialize.dump(options, temp, binary=True)
+    os.replace(temp, file)
@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+''' Completion daemon for `python` completions.
+
+The generated scripts connect to the Unix domain socket of the daemon
+(see `runtime.get_socket_path`) and send one line:
+
+    complete<TAB>MODULE:FUNCTION<TAB>ARGS<TAB>WORD
+
+ARGS are the arguments of the function as python literal (a tuple). The
+daemon answers with the candidates returned by `FUNCTION(WORD, *ARGS)`,
+one per line, and closes the connection. Imported modules are kept, so
+the functions are called without starting python. The daemon exits after
+it has been idle for `--idle-timeout` seconds.
+'''
+
+import os, sys, ast, fcntl, signal, socket, argparse
+from . import runtime
+
+# Seconds without a request after which the daemon exits
+IDLE_TIMEOUT = 600
+
+# Seconds a client may take to send its request
+REQUEST_TIMEOUT = 2
+
+# Maximum size of a request
+MAX_REQUEST = 65536
+
+def handle_request(line):
+    ''' Return the candidates requested by `line` '''
+    fields = line.split('\t')
+    if fields[0] == 'complete' and len(fields) == 4:
+        module, _, qualname = fields[1].partition(':')
+        return list(runtime.complete_python(fields[3], module, qualname, ast.literal_eval(fields[2])))
+    raise Exception('Invalid request: %r' % line)
+
+def handle_connection(conn):
+    conn.settimeout(REQUEST_TIMEOUT)
+    data = b''
+    while b'\n' not in data and len(data) < MAX_REQUEST:
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+
+    try:
+        candidates = handle_request(data.split(b'\n', 1)[0].decode())
+    except Exception as e:
+        print('Error: %s: %s' % (type(e).__name__, e), file=sys.stderr)
+        return
+
+    conn.sendall(''.join(c + '\n' for c in candidates if '\n' not in c).encode())
+
+def serve(path, idle_timeout=IDLE_TIMEOUT):
+    ''' Answer requests on the socket `path` until being idle for `idle_timeout` seconds.
+
+    Returns False if another daemon is already serving `path`.
+    '''
+    # The directory and the socket are only accessible by the user,
+    # requests name modules that are imported by the daemon
+    os.umask(0o077)
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    if os.stat(directory).st_uid != os.getuid():
+        raise Exception('%s: Directory of the socket is not owned by the user' % directory)
+
+    # The lock is held as long as the daemon is running
+    lock = open(path + '.lock', 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return False
+
+    # A socket left by a daemon that was killed
+    if os.path.exists(path):
+        os.unlink(path)
+
+    server = socket.socket(socket.AF_UNIX)
+    try:
+        server.bind(path)
+        server.listen(16)
+        server.settimeout(idle_timeout)
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+            with conn:
+                try:
+                    handle_connection(conn)
+                except OSError as e:
+                    print('Error:', e, file=sys.stderr)
+    finally:
+        os.unlink(path)
+        server.close()
+        lock.close()
+    return True
+
+def main(argv):
+    p = argparse.ArgumentParser('argparse-tool daemon', description='Serve `python` completions over a Unix domain socket')
+    p.add_argument('--socket', default=None, help='Socket path [default: %s]' % runtime.get_socket_path())
+    p.add_argument('--idle-timeout', default=IDLE_TIMEOUT, type=float,
+                   help='Exit after this many seconds without a request [default: %d]' % IDLE_TIMEOUT)
+    opts = p.parse_args(argv)
+
+    # Started in the background by a completion, it outlives the terminal
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *a: sys.exit(0))
+
+    if not serve(opts.socket or runtime.get_socket_path(), opts.idle_timeout):
+        print('argparse-tool daemon: Already running', file=sys.stderr)
+    return 0
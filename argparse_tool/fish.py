@@ -1,19 +1,133 @@
 #!/usr/bin/python3
 
-import sys
-from . import shell, utils
+import sys, re
+from . import shell, utils, writer
+
+# Ranges up to this length are expanded when the script is generated
+MAX_EXPANDED_RANGE = 256
+
+# Seconds the output of dynamic sources (users, groups, ...) is cached.
+# Can be changed at runtime by setting $argparse_tool_cache_ttl, 0 disables the cache.
+CACHE_TTL = 60
+
+# Completions whose candidates are cached by `__argparse_tool_cached_1`
+CACHED = {'command', 'group', 'hostname', 'process', 'service', 'user'}
+
+# Defined only once if multiple programs use it.
+# `__argparse_tool_cached_1 NAME COMMAND...` prints the output of COMMAND,
+# which is kept in the global variable __argparse_tool_cache_NAME.
+# The age of the cache is measured using `path mtime --relative` on a
+# directory that does not change, which does not fork (`date` is used on
+# fish versions lacking `path`).
+CACHE_RUNTIME = r"""if not functions -q __argparse_tool_cached_1
+    function __argparse_tool_cached_1 --argument-names name
+        set -l ttl %d
+        set -q argparse_tool_cache_ttl && set ttl $argparse_tool_cache_ttl
+        test $ttl -gt 0 || begin; $argv[2..-1]; return; end
+
+        set -l now
+        if contains path (builtin -n)
+            set now (path mtime --relative $__fish_data_dir)
+        else
+            set now (date +%%s)
+        end
+
+        set -l var __argparse_tool_cache_$name
+        set -l time __argparse_tool_cache_time_$name
+        if not set -q $time || test $now -lt $$time || test (math $now - $$time) -ge $ttl
+            set -g $var ($argv[2..-1])
+            set -g $time $now
+        end
+        string join \n -- $$var
+    end
+
+    function __argparse_tool_command_1
+        # Paths are completed by fish, not from the cache
+        string match -q -- '*/*' (commandline -ct) && __fish_complete_command && return
+        __argparse_tool_cached_1 command complete -C ''
+    end
+end
+""" % CACHE_TTL
+
+# Defined only once if multiple programs use it.
+# `__argparse_tool_look_1 FILE` prints the lines of the sorted FILE starting
+# with the current token, using a binary search by look(1) if available.
+LOOK_RUNTIME = r"""if not functions -q __argparse_tool_look_1
+    function __argparse_tool_look_1 --argument-names file
+        set -l cur (commandline -ct)
+        if test -n "$cur" && command -q look
+            env LC_ALL=C look -- $cur $file
+        else
+            string match -r -- '^'(string escape --style=regex -- $cur) < $file
+        end
+    end
+end
+"""
+
+# Defined only once if multiple programs use it.
+# `__argparse_tool_python_1 FUNCTION ARGS` prints the candidates that the
+# completion daemon (see daemon.py) returns for the current token. If the
+# daemon is not running it is started in the background, nothing is
+# printed then. socat or nc is used for connecting to the socket if
+# available, `argparse-tool query` otherwise.
+PYTHON_RUNTIME = r"""if not functions -q __argparse_tool_python_1
+    function __argparse_tool_python_1 --argument-names function args
+        set -l socket $ARGPARSE_TOOL_SOCKET
+        if not set -q socket[1]
+            if set -q XDG_RUNTIME_DIR[1]
+                set socket $XDG_RUNTIME_DIR/argparse-tool.sock
+            else
+                set socket /tmp/argparse-tool-(id -u)/argparse-tool.sock
+            end
+        end
+        if not test -S $socket
+            if command -q argparse-tool
+                command argparse-tool daemon --socket $socket </dev/null &>/dev/null &
+                disown
+            end
+            return
+        end
+
+        set -l client argparse-tool query $socket
+        if command -q socat
+            set client socat -t 2 - UNIX-CONNECT:$socket
+        else if command -q nc
+            set client nc -U $socket
+        end
+        # The value of `--option=value`
+        set -l cur (string replace -r -- '^-[^=]*=' '' (commandline -ct))
+        printf 'complete\t%s\t%s\t%s\n' $function $args "$cur" | command $client 2>/dev/null
+    end
+end
+"""
+
+def get_choice_lines(items):
+    # Return the lines of a choice file, descriptions are separated by a tab
+    return [value + '\t' + ' '.join(str(desc).split()) if desc else value for value, desc in items]
 
 class FishCompleter(shell.ShellCompleter):
     # Important: If the completion has '-f', it has to be specified *first*
+    # If `files` (utils.ChoiceFiles) is given, large choice sets are written
+    # to files in the directory named by the variable `directory`.
+
+    def __init__(self, files=None, directory=None):
+        self.files = files
+        self.choices_dir = directory
 
     def none(self):
         return []
 
     def choices(self, choices):
-        return ['-f', '-a', shell.escape(' '.join(shell.escape(str(c)) for c in choices))]
+        if self.files is not None:
+            items = utils.get_choice_items(choices, utils.MAX_FILE_CHOICES)
+            if len(items) > utils.MAX_SCRIPT_CHOICES:
+                name = self.files.add(get_choice_lines(items))
+                return ['-f', '-a', "'(__argparse_tool_look_1 $%s/%s)'" % (self.choices_dir, name)]
+            choices = [value for value, _ in items]
+        return ['-f', '-a', shell.escape(' '.join(shell.escape(str(c)) for c in utils.take_choices(choices)))]
 
     def command(self):
-        return ['-f', '-a', "'(__fish_complete_command)'"]
+        return ['-f', '-a', "'(__argparse_tool_command_1)'"]
 
     def directory(self, glob_pattern=None):
         if glob_pattern:
@@ -26,32 +140,43 @@ class FishCompleter(shell.ShellCompleter):
         return ['-F']
 
     def group(self):
-        return ['-f', '-a', "'(__fish_complete_groups)'"]
+        return ['-f', '-a', "'(__argparse_tool_cached_1 group __fish_complete_groups)'"]
 
     def hostname(self):
-        return ['-f', '-a', "'(__fish_print_hostnames)'"]
+        return ['-f', '-a', "'(__argparse_tool_cached_1 hostname __fish_print_hostnames)'"]
 
     def pid(self):
         return ['-f', '-a', "'(__fish_complete_pids)'"]
 
     def process(self):
-        return ['-f', '-a', "'(__fish_complete_proc)'"]
+        return ['-f', '-a', "'(__argparse_tool_cached_1 process __fish_complete_proc)'"]
 
     def range(self, range):
+        if not range:
+            return self.none()
+        if len(range) <= MAX_EXPANDED_RANGE:
+            return self.choices(list(range))
+        range = utils.take_range(range)
         if range.step == 1:
-            return ['-f', '-a', f"'(seq {range.start} {range.stop})'"]
+            return ['-f', '-a', f"'(seq {range.start} {range[-1]})'"]
         else:
-            return ['-f', '-a', f"'(seq {range.start} {range.step} {range.stop})'"]
+            return ['-f', '-a', f"'(seq {range.start} {range.step} {range[-1]})'"]
 
     def service(self):
-        return ['-f', '-a', "'(__fish_systemctl_services)'"]
+        return ['-f', '-a', "'(__argparse_tool_cached_1 service __fish_systemctl_services)'"]
 
     def user(self):
-        return ['-f', '-a', "'(__fish_complete_users)'"]
+        return ['-f', '-a', "'(__argparse_tool_cached_1 user __fish_complete_users)'"]
 
     def variable(self):
         return ['-f', '-a', "'(set -n)'"]
 
+    def python(self, function, *args):
+        request = shell.python_request(function, args)
+        if request is None:
+            return self.fallback('python', 'none')
+        return ['-f', '-a', escape('(__argparse_tool_python_1 %s %s)' % tuple(escape(s) for s in request))]
+
 
 def join_escaped(l, delimiter=' '):
     return delimiter.join(shell.escape(word) for word in l)
@@ -69,6 +194,7 @@ def make_complete(
       conflicting_options=[],  # Only show if these options are not given on commandline
       description=None,        # Description
       positional=None,         # Only show if current word number is `positional`
+      positional_count=1,      # ... up to `positional + positional_count - 1` (None: unlimited)
       requires_argument=False, # Option requires an argument
       no_files=False,          # Don't use file completion
       choices=[],              # Add those words for completion
@@ -92,7 +218,13 @@ def make_complete(
         conditions += ["not __fish_contains_opt %s" % ' '.join(o.lstrip('-') for o in sorted(conflicting_options))]
 
     if positional is not None:
-        conditions += ["test (__fish_number_of_cmd_args_wo_opts) = %d" % positional]
+        if positional_count is None:
+            conditions += ["test (__fish_number_of_cmd_args_wo_opts) -ge %d" % positional]
+        elif positional_count == 1:
+            conditions += ["test (__fish_number_of_cmd_args_wo_opts) = %d" % positional]
+        else:
+            conditions += ["contains -- (__fish_number_of_cmd_args_wo_opts) %s" % ' '.join(
+                str(i) for i in range(positional, positional + positional_count))]
 
     if len(conditions):
         r += " -n %s" % shell.escape(' && '.join(conditions))
@@ -118,8 +250,8 @@ def make_complete(
 
     return 'complete -c ' + shell.escape(program_name) + flags + r
 
-def complete_option(action, program_name, parent_commands=[]):
-    completer = FishCompleter()
+def complete_option(action, program_name, parent_commands=[], completer=None):
+    completer = completer or FishCompleter()
     completion_args = completer.complete(*action.complete)
 
     flags = set() # Drop '-f' and add it to flags
@@ -141,8 +273,8 @@ def complete_option(action, program_name, parent_commands=[]):
 
     return (r + ' ' + ' '.join(completion_args)).rstrip()
 
-def complete_positional(action, program_name, parent_commands=[]):
-    completer = FishCompleter()
+def complete_positional(action, program_name, parent_commands=[], completer=None):
+    completer = completer or FishCompleter()
     completion_args = completer.complete(*action.complete)
 
     flags = set() # Drop '-f' and add it to flags
@@ -156,52 +288,339 @@ def complete_positional(action, program_name, parent_commands=[]):
         description         = action.help,
         seen_words          = parent_commands,
         positional          = action.get_positional_num(),
+        positional_count    = action.get_positional_count(),
         flags               = flags
     )
 
     return (r + ' ' + ' '.join(completion_args)).rstrip()
 
-def complete_subparsers(action, program_name, parent_commands=[]):
-    r = ''
-
+def complete_subparsers(action, program_name, out, parent_commands=[], completer=None):
     for name, subparser in action.subcommands.items():
-        # Here we add the subcommand including its description
-        r += f'# command {name}\n'
-        r += make_complete(
+        # Here we add the subcommand and its aliases including its description
+        names = list(action.get_names(name))
+        out.write(f'# command {name}\n')
+        out.write(make_complete(
             program_name,
             no_files       = True,
             description    = subparser.help,
-            choices        = [name],
+            choices        = names,
             seen_words     = parent_commands,
             #not_seen_words = sorted(parser.get_subparsers().keys()),
             positional     = action.get_positional_num()
             # we only want to complete a subparsers `name` if it is not yet given on commandline
-        ) + '\n'
+        ) + '\n')
 
         # Recursive call to generate completion for a subcommand.
-        r += complete_parser(subparser, program_name, parent_commands + [name])
-
-    return r
+        # The completions of the subcommand are shown if any of its names is given.
+        complete_parser(subparser, program_name, out, parent_commands + names, completer)
 
-def complete_parser(parser, program_name, parent_commands=[]):
+def complete_parser(parser, program_name, out, parent_commands=[], completer=None):
     # `parent_commands` is used to ensure that options of a command only show up
     #  if the command is present on the commandline. (see `seen_words`)
 
-    r = ''
-
     for action in parser.get_options():
-        r += '%s\n' % complete_option(action, program_name, parent_commands)
+        out.write('%s\n' % complete_option(action, program_name, parent_commands, completer))
 
     for action in parser.get_positionals():
-        r += '%s\n' % complete_positional(action, program_name, parent_commands)
+        out.write('%s\n' % complete_positional(action, program_name, parent_commands, completer))
 
     if parser.get_subparsers_option():
-        r += complete_subparsers(parser.get_subparsers_option(), program_name, parent_commands)
+        complete_subparsers(parser.get_subparsers_option(), program_name, out, parent_commands, completer)
 
-    return r
+def generate_completion(parser, program_name=None, fh=None, choice_files=False):
+    ''' Return the fish completion script, write it to `fh` if given.
 
-def generate_completion(parser, program_name=None):
+    If `choice_files` is True, large choice sets are written to files next
+    to the script (see utils.get_choice_files).
+    '''
     if program_name is None:
         program_name = parser.prog
 
-    return complete_parser(parser, program_name)
+    out = writer.Writer(fh)
+    if shell.uses_completion(parser, CACHED):
+        out.write(CACHE_RUNTIME + '\n')
+    if shell.uses_completion(parser, {'python'}):
+        out.write(PYTHON_RUNTIME + '\n')
+    directory = '__%s_choices' % shell.make_identifier(program_name)
+    files = utils.get_choice_files(fh, program_name, 'fish', choice_files)
+    complete_parser(parser, program_name, out, completer=FishCompleter(files, directory))
+    if files and files.files:
+        write_choices_directory(out, directory, program_name)
+    return out.getvalue()
+
+def write_choices_directory(out, directory, program_name):
+    # The choice files are located relative to the completion script
+    out.write('\nset -g %s (status dirname)/%s\n' % (directory, escape(program_name + '.choices')))
+    out.write(LOOK_RUNTIME)
+
+# =============================================================================
+# Dispatcher: one function computes the candidates for the whole command line
+# =============================================================================
+
+def escape(s):
+    ''' Fish escape `s` (fish expands variables inside double quotes) '''
+    if re.fullmatch('[a-zA-Z0-9_,:-]+', s): return s
+    return "'%s'" % s.replace('\\', '\\\\').replace("'", "\\'")
+
+def escape_pattern(s):
+    ''' Escape `s` for use as a literal `case` pattern '''
+    return escape(s.replace('\\', '\\\\').replace('*', '\\*').replace('?', '\\?'))
+
+def print_candidates(items):
+    # Return a command printing `items` ((value, description) pairs) in the
+    # format expected by `complete -a`
+    if any(desc for value, desc in items):
+        return "printf '%%s\\t%%s\\n' %s" % ' '.join(
+            '%s %s' % (escape(str(value)), escape(' '.join(str(desc or '').split())))
+            for value, desc in items)
+    return "printf '%%s\\n' %s" % ' '.join(escape(str(value)) for value, _ in items)
+
+class FishDispatchCompleter(shell.ShellCompleter):
+    # Returns a fish command that prints the candidates, '' for no completion.
+    # If `files` (utils.ChoiceFiles) is given, large choice sets are written
+    # to files in the directory named by the variable `directory`.
+
+    def __init__(self, files=None, directory=None):
+        self.files = files
+        self.choices_dir = directory
+
+    def none(self):
+        return ''
+
+    def choices(self, choices):
+        choices = utils.resolve_choices(choices)
+        if self.files is not None:
+            items = utils.get_choice_items(choices, utils.MAX_FILE_CHOICES)
+            if len(items) > utils.MAX_SCRIPT_CHOICES:
+                return '__argparse_tool_look_1 $%s/%s' % (self.choices_dir, self.files.add(get_choice_lines(items)))
+        elif hasattr(choices, 'items'):
+            items = list(utils.take_choices(choices.items()))
+        else:
+            items = [(c, None) for c in utils.take_choices(choices)]
+        return print_candidates(items) if items else ''
+
+    def command(self):
+        return '__argparse_tool_command_1'
+
+    def directory(self, glob_pattern=None):
+        if glob_pattern:
+            print("Warning, glob_pattern `%s' ignored\n" % glob_pattern, file=sys.stderr)
+        return '__fish_complete_directories (commandline -ct)'
+
+    def file(self, glob_pattern=None):
+        if glob_pattern:
+            print("Warning, glob_pattern `%s' ignored\n" % glob_pattern, file=sys.stderr)
+        return '__fish_complete_path (commandline -ct)'
+
+    def group(self):
+        return '__argparse_tool_cached_1 group __fish_complete_groups'
+
+    def hostname(self):
+        return '__argparse_tool_cached_1 hostname __fish_print_hostnames'
+
+    def pid(self):
+        return '__fish_complete_pids'
+
+    def process(self):
+        return '__argparse_tool_cached_1 process __fish_complete_proc'
+
+    def range(self, range):
+        if not range:
+            return self.none()
+        if len(range) <= MAX_EXPANDED_RANGE:
+            return self.choices(list(range))
+        range = utils.take_range(range)
+        if range.step == 1:
+            return f'seq {range.start} {range[-1]}'
+        else:
+            return f'seq {range.start} {range.step} {range[-1]}'
+
+    def service(self):
+        return '__argparse_tool_cached_1 service __fish_systemctl_services'
+
+    def user(self):
+        return '__argparse_tool_cached_1 user __fish_complete_users'
+
+    def variable(self):
+        return 'set -n'
+
+    def python(self, function, *args):
+        request = shell.python_request(function, args)
+        if request is None:
+            return self.fallback('python', 'none')
+        return '__argparse_tool_python_1 %s %s' % tuple(escape(s) for s in request)
+
+
+class Cases:
+    ''' The cases of a `switch` statement, keys with equal code share one `case` '''
+    def __init__(self):
+        self.cases = {} # code -> list of keys
+
+    def add(self, key, code):
+        if code:
+            self.cases.setdefault(code, []).append(key)
+
+    def write(self, out, indent):
+        for code, keys in self.cases.items():
+            patterns = [escape_pattern(k) for k in keys]
+            lines = [' '.join(patterns[i:i+8]) for i in range(0, len(patterns), 8)]
+            out.write('%scase %s\n' % (indent, (' \\\n%s     ' % indent).join(lines)))
+            for line in code.split('\n'):
+                out.write('%s    %s\n' % (indent, line))
+
+class DispatchTables:
+    ''' Collects the `switch` cases of `generate_dispatch_completion` '''
+    def __init__(self, complete):
+        self.complete  = complete
+        self.takes_arg = Cases() # 'n opt'     -> option takes an argument
+        self.optarg    = Cases() # 'n opt'     -> candidates of the option argument
+        self.opts      = Cases() # 'n'         -> option strings of parser n
+        self.pos       = Cases() # 'n k'       -> candidates of positional argument k
+        self.rest      = Cases() # 'n'         -> candidates of the arguments from number k on
+        self.sub       = Cases() # 'n k name'  -> parser number of subcommand `name`
+        self.parsers   = {}      # id(Options) -> parser number
+
+    def add_parser(self, parser):
+        # Add `parser` and its subcommands, return its number
+        if id(parser) in self.parsers:
+            return self.parsers[id(parser)]
+
+        n = self.parsers[id(parser)] = len(self.parsers)
+
+        options, conflicting = [], []
+        for option in parser.get_options():
+            items = [(s, option.help) for s in option.option_strings]
+            conflicts = option.get_conflicting_options()
+            if conflicts:
+                # $argv holds the options given on the command line
+                conflicting.append(' && '.join(
+                    ['not contains -- %s $argv' % escape(c) for c in conflicts] + [print_candidates(items)]))
+            else:
+                options.extend(items)
+
+            if option.takes_args:
+                code = self.complete(*option.complete)
+                for option_string in option.option_strings:
+                    self.takes_arg.add('%d %s' % (n, option_string), 'return 0')
+                    self.optarg.add('%d %s' % (n, option_string), code)
+
+        if options:
+            conflicting.insert(0, print_candidates(options))
+        self.opts.add(str(n), '\n'.join(conflicting))
+
+        for option in parser.get_positionals():
+            code = self.complete(*option.complete)
+            num, count = option.get_positional_num(), option.get_positional_count()
+            if count is None:
+                self.rest.add(str(n), code and 'test $argv[2] -ge %d && %s' % (num, code))
+            else:
+                for k in range(num, num + count):
+                    self.pos.add('%d %d' % (n, k), code and code + '\nreturn')
+
+        subparsers = parser.get_subparsers_option()
+        if subparsers:
+            num, items = subparsers.get_positional_num(), []
+            for name, sub in subparsers.subcommands.items():
+                m = self.add_parser(sub)
+                for alias in subparsers.get_names(name):
+                    items.append((alias, sub.help))
+                    self.sub.add('%d %d %s' % (n, num, alias), 'echo %d' % m)
+            self.pos.add('%d %d' % (n, num), print_candidates(items) + '\nreturn')
+
+        return n
+
+# The dispatcher, `P_` is replaced by the prefix of the program.
+# The command line is scanned once, keeping track of the current parser
+# (numbered, the root is 0) and the number of the next positional argument.
+# The helper functions only consist of a `switch` on the parser number.
+DISPATCH_FUNCTION = r"""function P_complete
+    set -l tokens (commandline -opc)
+    set -l cur (commandline -ct)
+    set -e tokens[1]
+    set -l n 0
+    set -l args 1
+    set -l seen
+    set -l optarg
+    for w in $tokens
+        if set -q optarg[1]
+            set optarg
+            continue
+        end
+        if string match -q -- '--*' $w
+            set -a seen (string split -m 1 = -- $w)[1]
+            P_takes_arg $n $w && set optarg $w
+        else if string match -q -- '-?*' $w
+            set -a seen $w
+            set -l o -(string sub -s -1 -- $w)
+            P_takes_arg $n $o && set optarg $o
+        else
+            set -l sub (P_sub $n $args $w)
+            if set -q sub[1]
+                set n $sub
+                set seen
+            end
+            set args (math $args + 1)
+        end
+    end
+
+    if set -q optarg[1]
+        P_optarg $n $optarg
+        return
+    end
+    if string match -q -- '--*=*' $cur
+        set -l o (string split -m 1 = -- $cur)[1]
+        P_optarg $n $o | string replace -r -- '^' "$o="
+        return
+    end
+    if string match -q -- '-*' $cur
+        P_opts $n $seen
+    end
+    P_pos $n $args
+end
+"""
+
+def write_switch(out, funcname, subject, switches, end=''):
+    # Write a function consisting of `switch` statements
+    out.write(f'function {funcname}\n')
+    for cases in switches:
+        if cases.cases:
+            out.write(f'    switch {subject}\n')
+            cases.write(out, '        ')
+            out.write('    end\n')
+        subject = '$argv[1]'
+    out.write(end)
+    out.write('end\n\n')
+
+def generate_dispatch_completion(options, program_name=None, fh=None, choice_files=False):
+    ''' Return the fish completion script using a dispatcher function, write it to `fh` if given.
+
+    If `choice_files` is True, large choice sets are written to files next
+    to the script (see utils.get_choice_files).
+    '''
+    if program_name is None:
+        program_name = options.prog
+
+    out = writer.Writer(fh)
+    prefix = '__' + shell.make_identifier(program_name)
+    directory = prefix + '_choices'
+    files = utils.get_choice_files(fh, program_name, 'fish', choice_files)
+    tables = DispatchTables(FishDispatchCompleter(files, directory).complete)
+    tables.add_parser(options)
+
+    if shell.uses_completion(options, CACHED):
+        out.write(CACHE_RUNTIME + '\n')
+    if shell.uses_completion(options, {'python'}):
+        out.write(PYTHON_RUNTIME + '\n')
+
+    write_switch(out, f'{prefix}_takes_arg', '"$argv[1] $argv[2]"', [tables.takes_arg], '    return 1\n')
+    write_switch(out, f'{prefix}_optarg',    '"$argv[1] $argv[2]"', [tables.optarg])
+    write_switch(out, f'{prefix}_opts',      '$argv[1]',            [tables.opts])
+    write_switch(out, f'{prefix}_sub',       '"$argv[1] $argv[2] $argv[3]"', [tables.sub])
+    write_switch(out, f'{prefix}_pos',       '"$argv[1] $argv[2]"', [tables.pos, tables.rest])
+
+    out.write(DISPATCH_FUNCTION.replace('P_', prefix + '_'))
+    if files and files.files:
+        write_choices_directory(out, directory, program_name)
+    out.write('\ncomplete -c %s -e\n' % escape(program_name))
+    out.write("complete -c %s -f -a '(%s_complete)'\n" % (escape(program_name), prefix))
+    return out.getvalue()
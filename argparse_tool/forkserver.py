@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+
+''' Fork-server variant of `bulk.run`.
+
+The parent process imports argparse-tool and a list of "warm" modules once,
+then forks a child for each program. The children inherit the already
+imported modules (copy-on-write), so loading a program only costs the
+execution of its own module body.
+'''
+
+import sys, os, signal, pickle, selectors, time, importlib
+from . import bulk
+
+# Modules that are always preloaded
+_default_warm_modules = [
+    'argparse', 'argparse_tool.loader', 'argparse_tool.formats',
+    'argparse_tool.static', 'argparse_tool.serialize', 'argparse_tool.cache'
+]
+
+def warm(modules):
+    ''' Import `modules`, return the list of modules that could not be imported '''
+    failed = []
+    for module in _default_warm_modules + list(modules):
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            print("Warning: could not preload `%s`: %s" % (module, e), file=sys.stderr)
+            failed.append(module)
+    return failed
+
+def _child(job, args, fd):
+    try:
+        result = bulk.run_job(job, *args)
+        data = pickle.dumps(result)
+    except BaseException as e:
+        data = pickle.dumps(bulk.Result(job, '%s: %s' % (type(e).__name__, e)))
+
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(0)
+
+class _Child:
+    def __init__(self, job, pid, fd):
+        self.job = job
+        self.pid = pid
+        self.fd = fd
+        self.data = b''
+        self.start = time.monotonic()
+
+def run(jobs, selected_formats, outdir, max_workers=None, timeout=None, use_static=False, cache_dir=None,
+        stub_modules=None, choice_files=False, warm_modules=[]):
+    ''' Run `jobs` in forked children, return a list of `bulk.Result` objects '''
+
+    warm(warm_modules)
+
+    args = (selected_formats, outdir, timeout, use_static, cache_dir, stub_modules, choice_files)
+    max_workers = max_workers or os.cpu_count() or 1
+    results = {}
+    todo = list(reversed(jobs))
+    running = {}
+    selector = selectors.DefaultSelector()
+
+    def finish(child, error=None):
+        selector.unregister(child.fd)
+        os.close(child.fd)
+        del running[child.fd]
+        os.waitpid(child.pid, 0)
+
+        try:
+            result = pickle.loads(child.data)
+            result.job = child.job
+        except Exception:
+            result = bulk.Result(child.job, error or 'Child process terminated abruptly')
+        results[id(child.job)] = result
+
+    while todo or running:
+        while todo and len(running) < max_workers:
+            job = todo.pop()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            r, w = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(r)
+                _child(job, args, w)
+            os.close(w)
+            running[r] = _Child(job, pid, r)
+            selector.register(r, selectors.EVENT_READ, running[r])
+
+        for key, _ in selector.select(timeout=1):
+            child = key.data
+            data = os.read(child.fd, 65536)
+            if data:
+                child.data += data
+            else:
+                finish(child)
+
+        # The child enforces the timeout itself, this is a safeguard for
+        # programs that block or ignore SIGALRM.
+        if timeout:
+            now = time.monotonic()
+            for child in list(running.values()):
+                if now - child.start > timeout + 5:
+                    os.kill(child.pid, signal.SIGKILL)
+                    finish(child, 'Timeout exceeded, child killed')
+
+    return [results[id(job)] for job in jobs]
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+
+''' Registry of output formats.
+
+Backends are imported only when they are used.
+'''
+
+import os
+
+# Output formats: (module, generator function, filename template)
+formats = {
+    'bash':     ('bash',      'generate_completion',   '%s.bash'),
+    'bash-table': ('bash',    'generate_table_completion', '%s.table.bash'),
+    'fish':     ('fish',      'generate_completion',   '%s.fish'),
+    'fish-dispatch': ('fish', 'generate_dispatch_completion', '%s.dispatch.fish'),
+    'zsh':      ('zsh',       'generate_completion',   '%s.zsh'),
+    'man':      ('man',       'generate_man',          '%s.1'),
+    'printf':   ('printf',    'generate_printf_usage', '%s.h'),
+    'markdown': ('markdown',  'generate_markdown',     '%s.md'),
+    'json':     ('serialize', 'generate_json',         '%s.json'),
+    'index':    ('index',     'generate_index',        '%s.index'),
+}
+
+# Formats that can be split into one file per subcommand: (module, function, parallel)
+# The function is called as `function(tree, program_name, outdir)`, functions
+# that write the files in parallel additionally get `jobs=JOBS`.
+split_formats = {
+    'bash':     ('bash',      'generate_completion_files', False),
+    'man':      ('man',       'generate_man_pages',        True),
+    'zsh':      ('zsh',       'generate_completion_files', False),
+}
+
+# Formats that can write large choice sets to files next to the script,
+# their generators accept `choice_files=True` (see utils.get_choice_files)
+choice_file_formats = {'bash', 'bash-table', 'fish', 'fish-dispatch', 'zsh'}
+
+# Formats generated if no format is given
+default_formats = ['bash', 'fish', 'zsh', 'man', 'printf', 'markdown']
+
+def needs_help_text(selected_formats):
+    ''' Return True if the Options tree has to contain the formatted help '''
+    return 'printf' in selected_formats or 'json' in selected_formats
+
+def get_generator(format):
+    module, function, _ = formats[format]
+    return getattr(__import__('argparse_tool.' + module, fromlist=[function]), function)
+
+def _choice_files_argument(format, choice_files):
+    if choice_files and format in choice_file_formats:
+        return {'choice_files': True}
+    return {}
+
+def generate(format, tree, program_name, fh=None, choice_files=False):
+    ''' Return the output of `format`, if `fh` is given it is written to `fh` instead.
+
+    If `choice_files` is True, completion scripts written to a regular file
+    may write large choice sets to files next to it.
+    '''
+    return get_generator(format)(tree, program_name, fh=fh, **_choice_files_argument(format, choice_files))
+
+def write_split(format, tree, program_name, outdir, jobs=None, choice_files=False):
+    ''' Write `format` of `tree` as one file per subcommand to `outdir` '''
+    module, function, parallel = split_formats[format]
+    generator = getattr(__import__('argparse_tool.' + module, fromlist=[function]), function)
+    kwargs = _choice_files_argument(format, choice_files)
+    if parallel:
+        kwargs['jobs'] = jobs
+    return generator(tree, program_name, outdir, **kwargs)
+
+def write_all(selected_formats, tree, program_name, outdir, timings, split=False, jobs=None, choice_files=False):
+    ''' Write `selected_formats` of `tree` to `outdir`.
+
+    If `split` is True, formats listed in `split_formats` are written as one
+    file per subcommand.
+    '''
+    os.makedirs(outdir, exist_ok=True)
+    for format in selected_formats:
+        if split and format in split_formats:
+            timings.measure(format, write_split, format, tree, program_name, outdir, jobs, choice_files)
+            continue
+
+        with open(os.path.join(outdir, formats[format][2] % program_name), 'w') as fh:
+            timings.measure(format, generate, format, tree, program_name, fh, choice_files)
+            fh.write('\n')
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+
+''' Write the index read by `argparse-tool complete` (see runtime.py).
+
+The Options tree is reduced to what is needed for completing and stored
+using `marshal`, which loads much faster than JSON.
+'''
+
+import marshal
+from . import shell, utils, runtime
+
+class IndexCompleter(shell.ShellCompleter):
+    ''' Returns the completions as tuples understood by the runtime '''
+    def none(self):
+        return ('none',)
+
+    def choices(self, choices):
+        return ('choices', tuple(v for v, _ in utils.get_choice_items(choices, utils.MAX_FILE_CHOICES)))
+
+    def range(self, r):
+        return ('range', r.start, r.stop, r.step)
+
+    def file(self, glob_pattern=None):
+        return ('file', glob_pattern)
+
+    def directory(self, glob_pattern=None):
+        return ('directory', glob_pattern)
+
+    def command(self):
+        return ('command',)
+
+    def variable(self):
+        return ('variable',)
+
+    def hostname(self):
+        return ('hostname',)
+
+    def pid(self):
+        return ('pid',)
+
+    def process(self):
+        return ('process',)
+
+    def service(self):
+        return ('service',)
+
+    def user(self):
+        return ('user',)
+
+    def group(self):
+        return ('group',)
+
+    def python(self, function, *args):
+        name = utils.get_function_name(function)
+        if name is None:
+            return self.fallback('python', 'none')
+        return ('python',) + tuple(name.split(':', 1)) + (args,)
+
+class Index:
+    ''' Numbers the completions and parsers of an Options tree '''
+    def __init__(self):
+        self.completer   = IndexCompleter()
+        self.completions = {} # completion -> number
+        self.parsers     = [] # parser tuples, see runtime.py
+        self.numbers     = {} # id(Options) -> parser number
+
+    def add_completion(self, complete):
+        completion = self.completer.complete(*complete)
+        return self.completions.setdefault(completion, len(self.completions))
+
+    def add_parser(self, parser):
+        # Add `parser` and its subcommands, return its number
+        if id(parser) in self.numbers:
+            return self.numbers[id(parser)]
+
+        n = self.numbers[id(parser)] = len(self.parsers)
+        self.parsers.append(None)
+
+        optargs, options = {}, []
+        for option in parser.get_options():
+            conflicts = tuple(option.get_conflicting_options())
+            for option_string in option.option_strings:
+                options.append((option_string, conflicts))
+                if option.takes_args:
+                    optargs[option_string] = self.add_completion(option.complete)
+
+        positionals, rest = {}, None
+        for option in parser.get_positionals():
+            num, count = option.get_positional_num(), option.get_positional_count()
+            if count is None:
+                rest = (num, self.add_completion(option.complete))
+            else:
+                for k in range(num, num + count):
+                    positionals[k] = self.add_completion(option.complete)
+
+        subcommands, subpos = {}, 0
+        subparsers = parser.get_subparsers_option()
+        if subparsers:
+            subpos = subparsers.get_positional_num()
+            positionals[subpos] = self.add_completion(('choices', [
+                alias for name in subparsers.subcommands for alias in subparsers.get_names(name)]))
+            for name, sub in subparsers.subcommands.items():
+                m = self.add_parser(sub)
+                for alias in subparsers.get_names(name):
+                    subcommands[alias] = m
+
+        self.parsers[n] = (optargs, tuple(options), positionals, rest, subcommands, subpos)
+        return n
+
+    def dumps(self):
+        completions = sorted(self.completions, key=self.completions.get)
+        return marshal.dumps((runtime.MAGIC, runtime.VERSION, completions, self.parsers))
+
+def generate_index(options, program_name=None, fh=None):
+    ''' Return the index of `options`, if `fh` is given it is written to `fh` instead.
+
+    `fh` has to be a binary file or a text file with a `buffer` attribute.
+    '''
+    index = Index()
+    index.add_parser(options)
+    data = index.dumps()
+
+    if fh is None:
+        return data
+    fh.flush()
+    getattr(fh, 'buffer', fh).write(data)
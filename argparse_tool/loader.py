@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+
+''' Loading of ArgumentParser objects from python programs '''
+
+import sys, os, argparse, importlib, types, contextlib
+from . import utils, options
+
+def close_output_streams():
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+
+def restore_output_streams():
+    sys.stdout = sys.__stdout__
+    sys.stderr = sys.__stderr__
+
+def find_ArgumentParser(module):
+    found_parsers = []
+
+    for obj_name in dir(module):
+        obj = getattr(module, obj_name)
+        if isinstance(obj, argparse.ArgumentParser):
+            found_parsers.append(obj)
+
+    if len(found_parsers) == 1:
+        return found_parsers[0]
+    elif len(found_parsers) > 1:
+        # Find root parser
+        # TODO: this doesn't work well with multiple subcommands ("prog cmd1 cmd2")
+        for parser in found_parsers:
+            if parser._subparsers is not None:
+                return parser
+
+    return None
+
+def execute_file(file):
+    ''' Import file using exec '''
+
+    module = types.ModuleType('__main__')
+    module.__file__ = file
+
+    close_output_streams()
+
+    with open(file, 'r') as fh:
+        source = fh.read()
+        compiled = compile(source, file, 'exec')
+        try:   exec(compiled, module.__dict__)
+        except SystemExit: pass
+
+    restore_output_streams()
+
+    return module
+
+def import_file(file):
+    ''' Import file using importlib '''
+
+    directory, file = os.path.split(file)
+    if file.lower().endswith('.py'):
+        file = file[:-3]
+    else:
+        import tempfile
+        temp = tempfile.NamedTemporaryFile(mode='w', suffix='.py')
+        with open(os.path.join(directory, file), 'r') as fh:
+            temp.file.write(fh.read())
+            temp.flush()
+
+        directory, file = os.path.split(temp.name)
+        file = file[:-3]
+
+    if not directory:
+        directory = '.'
+
+    if directory not in sys.path:
+        sys.path.append(directory)
+
+    utils.program_modules.add(file)
+    return importlib.import_module(file)
+
+def load_parser(program_file, parser_variable=None, use_static=False, stub_modules=None):
+    ''' Return the ArgumentParser object of `program_file`.
+
+    Imports of `stub_modules` return placeholder modules while loading.
+    '''
+
+    if use_static:
+        from . import static
+        try:
+            return static.load_parser(program_file, parser_variable)
+        except static.StaticEvaluationError as e:
+            print("Warning: static extraction of `%s` failed (%s), falling back to import" % (program_file, e), file=sys.stderr)
+
+    if stub_modules:
+        from . import stubs
+        context = stubs.stub_modules(stub_modules)
+    else:
+        context = contextlib.nullcontext(set())
+
+    with context as touched:
+        try:
+            module = import_file(program_file)
+        except Exception as e:
+            print(e)
+            print("Warning: failed to load `%s` using importlib, falling back to `exec`" % program_file, file=sys.stderr)
+            module = execute_file(program_file)
+
+    if touched:
+        print("Warning: `%s` used stubbed modules: %s" % (program_file, ', '.join(sorted(touched))), file=sys.stderr)
+
+    if parser_variable:
+        parser = getattr(module, parser_variable)
+    else:
+        parser = find_ArgumentParser(module)
+
+    if parser is None:
+        raise Exception("Could not get ArgumentParser object from `%s`" % program_file)
+
+    return parser
+
+def load_options(program_file, parser_variable=None, program_name=None,
+                 help_text=False, use_static=False, cache_dir=None, timings=None, stub_modules=None):
+    ''' Return the Options tree of `program_file`.
+
+    `program_file` may also be a file containing serialized options.
+    If `cache_dir` is given, the tree is looked up in / stored to the cache.
+    The returned tree is frozen (see `Options.freeze()`).
+    '''
+
+    if timings is None:
+        timings = utils.Timings()
+
+    if program_file.endswith(('.json', '.ir')):
+        from . import serialize
+        return timings.measure('load', serialize.load, program_file).freeze()
+
+    if cache_dir:
+        from . import cache, serialize
+        cache_key = cache.key(program_file, parser_variable, program_name, help_text, use_static, sorted(stub_modules or []))
+        tree = timings.measure('cache', cache.get, cache_dir, cache_key)
+        if tree is not None:
+            return tree.freeze()
+
+    parser = timings.measure('load', load_parser, program_file, parser_variable, use_static, stub_modules)
+
+    tree = timings.measure('convert', options.ArgumentParser_to_Options,
+        parser, program_name, help_text=help_text)
+    tree.finalize()
+
+    if cache_dir and serialize.is_cacheable(tree):
+        cache.put(cache_dir, cache_key, tree)
+
+    return tree.freeze()
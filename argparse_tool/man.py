@@ -1,8 +1,8 @@
 #!/usr/bin/python3
 
 from collections import OrderedDict
-import datetime, sys, argparse
-from . import utils, shell
+import sys, os
+from . import utils
 
 # preferred order, taken from man-pages(7)
 _ordered_sections = OrderedDict([
@@ -25,49 +25,62 @@ _ordered_sections = OrderedDict([
     ('SEE ALSO',       None),
 ])
 
+def escape(s):
+    ''' Escape `s` for use in roff '''
+    s = s.replace('\\', '\\e').replace('-', '\\-')
+    s = '\n'.join(('\\&' + l if l.startswith(('.', "'")) else l) for l in s.split('\n'))
+    return s
+
 class ManWriter():
+    # The output is collected in a list of strings. `ensure_nl` only has to
+    # look at the last strings, which keeps writing a page linear in its size.
+
     def __init__(self):
-        self.s = ''
+        self.parts = []
 
     def ensure_nl(self):
-        if len(self.s):
-            self.s = self.s.rstrip()
-            self.s += '\n'
+        ''' Strip trailing whitespace and terminate the current line '''
+        if self.parts:
+            while self.parts and not self.parts[-1].rstrip():
+                self.parts.pop()
+            if self.parts:
+                self.parts[-1] = self.parts[-1].rstrip()
+            self.parts.append('\n')
         return self
 
     def title(self, title, section, date, source, manual):
         self.ensure_nl()
-        self.s += '.TH %s %s %s %s %s\n' % (
-            title.upper(), section, date, source, manual)
+        self.parts.append('.TH "%s" %s "%s" "%s" "%s"\n' % (
+            title.upper(), section, date, source, manual))
         return self
 
     def section(self, name):
         self.ensure_nl()
-        self.s += '.SH %s\n' % (name,)
+        self.parts.append('.SH %s\n' % (name,))
         return self
 
     def bold(self, text):
         self.ensure_nl()
-        self.s += '.B %s' % (text,)
+        self.parts.append('.B %s' % (text,))
         return self
 
     def italic(self, text):
         self.ensure_nl()
-        self.s += '.I %s' % (text,)
+        self.parts.append('.I %s' % (text,))
         return self
 
     def bold_roman(self, text):
         self.ensure_nl()
-        self.s += '.BR %s' % (text,)
+        self.parts.append('.BR %s' % (text,))
         return self
 
     def indented_paragraph(self, text):
         self.ensure_nl()
-        self.s += '.IP "%s"\n' % (text,)
+        self.parts.append('.IP "%s"\n' % (text,))
         return self
 
     def append(self, s):
-        self.s += str(s)
+        self.parts.append(str(s))
         return self
 
     def see_also(self, pages):
@@ -75,6 +88,9 @@ class ManWriter():
             self.bold_roman(p)
         return self
 
+    @property
+    def s(self):
+        return ''.join(self.parts)
 
     def __str__(self):
         return self.s
@@ -84,10 +100,18 @@ class ManPage():
         self.section  = 1
         self.name     = None
         self.package  = None
-        self.date     = str(datetime.date.today())
+        self.date     = self.get_date()
         #self.see_also = None
         self.sections = _ordered_sections.copy()
 
+    @staticmethod
+    def get_date():
+        import datetime
+        # Support reproducible builds
+        if 'SOURCE_DATE_EPOCH' in os.environ:
+            return str(datetime.datetime.fromtimestamp(int(os.environ['SOURCE_DATE_EPOCH']), datetime.timezone.utc).date())
+        return str(datetime.date.today())
+
     def write(self):
         writer = ManWriter()
         writer.title(
@@ -111,6 +135,7 @@ class ManPage():
             else:
                 writer.append(text)
 
+        writer.ensure_nl()
         return writer.s
 
 class NamedList:
@@ -129,85 +154,171 @@ class SeeAlso:
     def write(self, writer):
         pages = [(p.replace(')', '')+'(1').split('(') for p in self.pages]
         pages = sorted(pages, key=lambda p: p[0])
-        for p in pages:
-            writer.bold_roman("%s (%s)" % (p[0].strip(), p[1].strip()))
+        for i, p in enumerate(pages):
+            writer.bold_roman("%s (%s)%s" % (p[0].strip(), p[1].strip(), ',' if i + 1 < len(pages) else ''))
+
+def page_name(commands):
+    ''' Return the name of the man page for the command path `commands` '''
+    return '-'.join(commands)
 
 # TODO: .SS subsection on mutex/option groups
-class ManPageArgparse(ManPage):
-    def __init__(self, parser, prog=None):
+class ManPageOptions(ManPage):
+    ''' Man page for an `Options` object.
+
+    `commands` is the command path of the page, e.g. ['prog', 'sub'].
+    If `split` is True, subcommands are expected to have their own pages.
+    '''
+
+    def __init__(self, options, commands, split=False):
         super().__init__()
-        if not prog:
-            prog = parser.prog
-        self.parser  = parser
-        self.prog    = prog
-        self.name    = prog
-        self.package = prog
+        self.options  = options
+        self.commands = commands
+        self.split    = split
+        self.name     = page_name(commands)
+        self.package  = commands[0]
         self.sections['NAME']        = self._name
         self.sections['SYNOPSIS']    = self.synopsis
         self.sections['DESCRIPTION'] = self.description
-        self.sections['OPTIONS']     = self.options
-        self.sections['COMMANDS']    = self.commands
+        self.sections['OPTIONS']     = self.options_section
+        self.sections['COMMANDS']    = self.commands_section
+        self.sections['SEE ALSO']    = self.see_also
         self.sections['AUTHOR']      = self.author
         self.sections['COPYRIGHT']   = None
 
     def _name(self):
-        return '%s - %s\n' % (self.prog, parser.get_help())
+        if self.options.help:
+            return '%s \\- %s\n' % (escape(self.name), escape(self.options.help))
+        return '%s\n' % escape(self.name)
 
     def synopsis(self):
         writer = ManWriter()
-        writer.bold(self.prog).italic('[OPTIONS]')
-        for a in self.parser._actions:
-            if isinstance(a, argparse._SubParsersAction):
-                writer.bold('command') # TODO
+        writer.bold(escape(' '.join(self.commands))).italic('[OPTIONS]')
+        for o in self.options.get_positionals():
+            writer.italic(escape(o.metavar or o.option_strings[0]))
+        if self.options.get_subparsers_option():
+            writer.italic('COMMAND')
         return writer.s
 
     def description(self):
-        return ManWriter().append(parser.get_help()).s
+        if not self.options.help:
+            return None
+        return ManWriter().append(escape(self.options.help)).s
+
+    def options_section(self):
+        options = self.options.get_positionals() + self.options.get_options()
+        if not options:
+            return None
 
-    def options(self):
         writer = ManWriter()
-        for a in self.parser._actions:
-            self.option(writer, a)
+        for o in options:
+            self.option(writer, o)
         return writer.s
 
-    def option(self, writer, action):
-        if not action.option_strings:
-            return
-
-        writer.indented_paragraph(', '.join(action.option_strings))
-        if action.choices:
-            writer.append('[%s]' % ', '.join(map(str, utils.limit_choices(action.choices))))
-        elif action.metavar:
-            writer.append(' ' + action.metavar)
-        elif shell.action_takes_args(action) and action.type is not None and action.type is not str:
-            writer.append(utils.type2str(typ))
+    def option(self, writer, option):
+        if option.option_strings.is_option():
+            title = ', '.join(escape(o) for o in option.option_strings)
+            if option.takes_args and option.metavar:
+                title += ' ' + escape(option.metavar)
+        else:
+            title = escape(option.metavar or option.option_strings[0])
 
-        writer.append('\n     %s\n' % action.help)
+        writer.indented_paragraph(title)
+        if option.complete[0] in ('choices', 'range'):
+            writer.append('[%s]\n' % escape(', '.join(map(str, utils.limit_choices(option.complete[1])))))
+        writer.append('%s\n' % escape(option.help or ''))
 
+    def commands_section(self):
+        subparsers = self.options.get_subparsers_option()
+        if not subparsers:
+            return None
 
-    def commands(self):
         writer = ManWriter()
-        subparsers = self.parser.get_subparsers()
-        if len(subparsers):
-            writer.append('%s\n' % ', '.join(subparsers.keys()))
-            for name, sub in subparsers.items():
-               #sub.parser.prog = name
-               pass # TODO
+        for name, sub in subparsers.subcommands.items():
+            writer.indented_paragraph(', '.join(escape(n) for n in subparsers.get_names(name)))
+            writer.append('%s\n' % escape(sub.help or ''))
+            if self.split:
+                writer.append('See \\fB%s\\fR(%d).\n' % (escape(page_name(self.commands + [name])), self.section))
         return writer.s
 
+    def see_also(self):
+        pages = []
+        if self.split:
+            if len(self.commands) > 1:
+                pages.append(page_name(self.commands[:-1]))
+            subparsers = self.options.get_subparsers_option()
+            if subparsers:
+                pages.extend(page_name(self.commands + [name]) for name in subparsers.subcommands)
+        return [escape(p) for p in pages] or None
+
     def author(self):
         return None
 
 
-def generate_man(p, prog=None):
+def generate_man(p, prog=None, fh=None):
+    ''' Return a single man page for `p`, write it to `fh` if given.
+
+    Subcommands are only listed by name and help, use `generate_man_pages`
+    for a page per subcommand.
+    '''
     if prog is None:
         prog = p.prog
 
-    if hasattr(p.parser, 'man_page'):
-        manpage = p.man_page
-    else:
-        raise
-        manpage = ManPageArgparse(p, prog)
-
-    return manpage.write()
+    r = ManPageOptions(p, [prog]).write()
 
+    if fh is not None:
+        fh.write(r)
+        return None
+    return r
+
+# =============================================================================
+# One page per subcommand
+# =============================================================================
+
+# The Options tree used by the worker processes. It is set before the
+# worker processes are forked, so it does not have to be pickled.
+_tree = None
+
+def _get_subtree(options, path):
+    for name in path:
+        options = options.get_subparsers_option().subcommands[name]
+    return options
+
+def _write_page(program_name, path, outdir):
+    commands = [program_name] + list(path)
+    file = os.path.join(outdir, page_name(commands) + '.1')
+    with open(file, 'w') as fh:
+        fh.write(ManPageOptions(_get_subtree(_tree, path), commands, split=True).write())
+    return file
+
+def _get_paths(options, path=()):
+    yield path
+    subparsers = options.get_subparsers_option()
+    if subparsers:
+        for name, sub in subparsers.subcommands.items():
+            yield from _get_paths(sub, path + (name,))
+
+def generate_man_pages(options, program_name=None, outdir='.', jobs=None):
+    ''' Write one man page for each (sub)command to `outdir`.
+
+    Pages are named `prog.1`, `prog-sub.1`, ... For large command trees the
+    pages are generated by `jobs` worker processes.
+    Returns the list of written files.
+    '''
+    global _tree
+
+    if program_name is None:
+        program_name = options.prog
+
+    os.makedirs(outdir, exist_ok=True)
+    paths = list(_get_paths(options))
+    _tree = options
+
+    try:
+        if jobs == 1 or len(paths) < 64 or not hasattr(os, 'fork'):
+            return [_write_page(program_name, path, outdir) for path in paths]
+
+        import concurrent.futures, multiprocessing
+        with concurrent.futures.ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('fork')) as executor:
+            return list(executor.map(_write_page, [program_name] * len(paths), paths, [outdir] * len(paths), chunksize=16))
+    finally:
+        _tree = None
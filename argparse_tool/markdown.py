@@ -1,90 +1,89 @@
 #!/usr/bin/python3
 
-import argparse
-from . import utils
+from . import utils, writer
 
 def escape_underscore(s):
     return s.replace('_', '\\_')
 
-def generate_option(action):
+def generate_option(option):
     r = ''
 
-    if action.option_strings:
-        r += '_%s_' % ', '.join(escape_underscore(a) for a in action.option_strings)
+    if option.option_strings.is_option():
+        r += '_%s_' % ', '.join(escape_underscore(o) for o in option.option_strings)
 
-    metavar = action.get_metavar()
-    if metavar:
-        r += " **%s**" % escape_underscore(metavar)
+    if option.metavar:
+        r += " **%s**" % escape_underscore(option.metavar)
 
-    if action.choices:
-        r += ' [_%s_]' % ', '.join(escape_underscore(str(c)) for c in utils.limit_choices(action.choices))
+    if option.complete[0] in ('choices', 'range'):
+        r += ' [_%s_]' % ', '.join(escape_underscore(str(c)) for c in utils.limit_choices(option.complete[1]))
 
     return r
 
 def generate_usage(parser, program_name):
     r = ''
     r += f'**{program_name}** [_OPTIONS_]'
-    for a in parser.get_positionals():
-        if a.dest != argparse.SUPPRESS: # TODO?
-            r += ' **%s**' % a.dest
+    for o in parser.get_positionals():
+        r += ' **%s**' % o.option_strings[0]
+    if parser.get_subparsers_option():
+        r += ' **%s**' % parser.get_subparsers_option().option_strings[0]
     return r
 
 
 def heading(string, level):
     return ('#' * level) + ' ' + string + '\n'
 
-def generate_parser(parser, program_name, level=1):
-    subparsers = parser.get_subparsers()
-    r = ''
-
-    if hasattr(parser, 'markdown_prolog'):
-        r += parser.markdown_prolog
+def generate_parser(parser, program_name, out, level=1):
+    subparsers = parser.get_subparsers_option()
 
-    if parser.description:
-        r += heading('DESCRIPTION', level)
-        r += parser.description + '\n'
-    r += '\n'
+    if parser.markdown_prolog:
+        out.write(parser.markdown_prolog)
 
-    r += heading('SYNOPSIS', level)
+    if parser.help:
+        out.write(heading('DESCRIPTION', level))
+        out.write(parser.help + '\n')
+    out.write('\n')
 
+    out.write(heading('SYNOPSIS', level))
     if parser.usage:
-        r += parser.usage + '\n'
+        out.write(parser.usage + '\n')
     else:
-        r += generate_usage(parser, program_name) + '\n\n'
+        out.write(generate_usage(parser, program_name) + '\n\n')
 
-    if parser._actions:
-        r += heading('OPTIONS', level)
-        r += '\n'
+    if parser.get_options() or parser.get_positionals():
+        out.write(heading('OPTIONS', level))
+        out.write('\n')
 
     # Positionals first
-    for a in parser.get_positionals():
-        r += '  ' + generate_option(a) + '\n'
-        r += '    %s\n\n' % (a.help if a.help else '')
+    for o in parser.get_positionals():
+        out.write('  ' + generate_option(o) + '\n')
+        out.write('    %s\n\n' % (o.help if o.help else ''))
 
     # Options second
-    for a in parser.get_options():
-        r += '  ' + generate_option(a) + '\n'
-        r += '    %s\n\n' % (a.help if a.help else '')
-
-    if len(subparsers):
-        r += '\n' + heading('COMMANDS', level)
-        r += '\n'
-        r += '%s\n' % ', '.join(subparsers.keys())
-        for name, sub in subparsers.items():
-            r += '\n%s\n' % generate_parser(sub, name, level + 1)
+    for o in parser.get_options():
+        out.write('  ' + generate_option(o) + '\n')
+        out.write('    %s\n\n' % (o.help if o.help else ''))
+
+    if subparsers:
+        out.write('\n' + heading('COMMANDS', level))
+        out.write('\n')
+        out.write('%s\n' % ', '.join(subparsers.subcommands.keys()))
+        for name, sub in subparsers.subcommands.items():
+            out.write('\n')
+            generate_parser(sub, name, out, level + 1)
+            out.write('\n')
 
     if parser.epilog:
-        r += parser.epilog
+        out.write(parser.epilog)
 
-    if hasattr(parser, 'markdown_epilog'):
-        r += parser.markdown_epilog
-
-    return r
+    if parser.markdown_epilog:
+        out.write(parser.markdown_epilog)
 
 
-def generate_markdown(parser, program_name=None):
+def generate_markdown(parser, program_name=None, fh=None):
+    ''' Return the markdown documentation, write it to `fh` if given '''
     if program_name is None:
         program_name = parser.prog
 
-    return generate_parser(parser, program_name)
-
+    out = writer.Writer(fh)
+    generate_parser(parser, program_name, out)
+    return out.getvalue()
@@ -1,14 +1,16 @@
 #!/usr/bin/python3
 
-import sys
+import sys, copy
 from collections import OrderedDict
+from . import utils
 
-class OptionStrings(list):
-    def __init__(self, option_strings):
+class OptionStrings(tuple):
+    __slots__ = ()
+
+    def __new__(cls, option_strings):
         if isinstance(option_strings, str):
-            super().__init__(option_strings.split('|'))
-        else:
-            super().__init__(option_strings)
+            option_strings = option_strings.split('|')
+        self = super().__new__(cls, (sys.intern(o) for o in option_strings))
 
         num_options = 0
         num_positionals = 0
@@ -27,31 +29,88 @@ class OptionStrings(list):
         if num_positionals > 1:
             raise Exception('Can only store one positional argument: %r' % self)
 
+        return self
+
     def is_positional(self):
         return not self[0].startswith('-')
 
     def is_option(self):
         return self[0].startswith('-')
 
-class Options:
+# Interned OptionStrings objects, equal option strings share one object and
+# are validated only once
+_option_strings = {}
+
+def intern_option_strings(option_strings):
+    key = option_strings if isinstance(option_strings, str) else tuple(option_strings)
+    try:
+        return _option_strings[key]
+    except KeyError:
+        r = _option_strings[key] = OptionStrings(option_strings)
+        return r
+
+def _intern(s):
+    return sys.intern(s) if type(s) is str else s
+
+def _freeze_value(value):
+    # Lists become tuples, so the value can be shared
+    if isinstance(value, list):
+        return tuple(_freeze_value(v) for v in value)
+    if isinstance(value, tuple):
+        return tuple(_freeze_value(v) for v in value)
+    return _intern(value)
+
+class _Freezable:
+    ''' Base class of the model objects, they become read-only by `freeze()` '''
+    __slots__ = ('frozen',)
+
+    def __setattr__(self, name, value):
+        if getattr(self, 'frozen', False):
+            raise AttributeError("Cannot set %r, the options are frozen" % name)
+        object.__setattr__(self, name, value)
+
+# Placeholder for the program name in `Options.help_text`
+PROG_PLACEHOLDER = '$$$ PROG $$$'
+
+class Options(_Freezable):
+    __slots__ = ('prog', 'help', 'help_text', 'usage', 'epilog', 'markdown_prolog', 'markdown_epilog',
+                 'parent', 'options', 'positionals', 'subparsers', 'option_index')
+
     def __init__(self, program_name, help=None, parent=None):
+        self.frozen = False
         self.prog = program_name
         self.help = help
+        self.help_text = None
+        self.usage = None           # Custom usage of the parser
+        self.epilog = None
+        self.markdown_prolog = None # Set as attributes of the parser for the markdown output
+        self.markdown_epilog = None
         self.parent = parent
         self.options = []
         self.positionals = []
         self.subparsers = None
+        self.option_index = {} # option string -> Option
 
         assert isinstance(self.prog, str)
         assert isinstance(self.help, (str, None.__class__))
         assert isinstance(self.parent, (Options, None.__class__))
 
-    def add(self, option_strings, metavar='', help='', complete=None, takes_args=True):
-        option = Option(self, option_strings, metavar=metavar, help=help, complete=complete, takes_args=takes_args)
+    def add(self, option_strings, metavar='', help='', complete=None, takes_args=True, nargs=None):
+        option = Option(self, option_strings, metavar=metavar, help=help, complete=complete, takes_args=takes_args, nargs=nargs)
         if option.option_strings.is_option():
-            self.options.append(option)
+            self.add_option_object(option)
         else:
             self.positionals.append(option)
+        return option
+
+    def add_option_object(self, option):
+        self.options.append(option)
+        for option_string in option.option_strings:
+            self.option_index[option_string] = option
+
+    def get_option(self, option_string):
+        ''' Return the option having `option_string`, None if not found '''
+        return self.option_index.get(option_string)
 
     def add_mutually_exclusive_group(self):
         group = MutuallyExclusiveGroup(self)
@@ -88,18 +147,119 @@ class Options:
     def get_positionals(self):
         return list(self.positionals)
 
+    def finalize(self, offset=0, _offsets=None):
+        ''' Assign the positional numbers of this parser and its subparsers.
+
+        The positionals of a parser are numbered starting at `offset + 1`,
+        the subparsers option comes after the positionals. A positional
+        that takes multiple arguments occupies multiple numbers, one that
+        takes an unlimited number of arguments counts as one.
+
+        A subcommand that is shared by multiple parsers is numbered once.
+        If it is found again at a different offset, it is replaced by a copy.
+        '''
+        if _offsets is None:
+            _offsets = {}
+        _offsets[id(self)] = offset
+
+        num = offset + 1
+        positionals = list(self.positionals)
+        if self.subparsers:
+            positionals.append(self.subparsers)
+
+        for option in positionals:
+            option.positional_num = num
+            option.positional_count = get_nargs_count(option.nargs)
+            num += 1 if option.positional_count is None else option.positional_count
+
+        if self.subparsers:
+            offset = self.subparsers.positional_num
+            for name, sub in self.subparsers.subcommands.items():
+                if id(sub) not in _offsets:
+                    sub.finalize(offset, _offsets)
+                elif _offsets[id(sub)] != offset:
+                    sub = copy.deepcopy(sub, {id(sub.parent): self})
+                    self.subparsers.subcommands[name] = sub
+                    sub.finalize(offset, _offsets)
+
+        return self
+
+    def freeze(self, shared=None):
+        ''' Make this parser and its subparsers read-only.
+
+        Option lists become tuples and strings are interned. Options that
+        are identical in multiple parsers (e.g. inherited through `parents=`)
+        are replaced by a single shared object, its `parent` is the first
+        parser it was found in. Calling `freeze()` again does nothing.
+        '''
+        if self.frozen:
+            return self
+
+        if shared is None:
+            self.finalize()
+            shared = {}
+
+        options = []
+        for option in self.options:
+            option.freeze()
+            key = option.get_share_key()
+            if key is not None:
+                option = shared.setdefault(key, option)
+                for option_string in option.option_strings:
+                    self.option_index[option_string] = option
+            options.append(option)
+
+        for option in self.positionals:
+            option.freeze()
+
+        self.prog = _intern(self.prog)
+        self.help = _intern(self.help)
+        self.usage = _intern(self.usage)
+        self.epilog = _intern(self.epilog)
+        self.options = tuple(options)
+        self.positionals = tuple(self.positionals)
+
+        if self.subparsers:
+            for sub in self.subparsers.subcommands.values():
+                sub.freeze(shared)
+            self.subparsers.freeze()
+
+        self.frozen = True
+        return self
+
+    def get_root(self):
+        parser = self
+        while parser.parent is not None:
+            parser = parser.parent
+        return parser
+
     def __repr__(self):
         return '{\nprog: %r,\nhelp: %r,\noptions: %r,\npositionals: %r,\nsubparsers: %r}' % (
             self.prog, self.help, self.options, self.positionals, self.subparsers)
 
-class Option:
-    def __init__(self, parent, option_strings, metavar='', help='', complete=None, exclusive_group=None, takes_args=True):
+def get_nargs_count(nargs):
+    ''' Return the number of arguments consumed by `nargs`, None if unlimited '''
+    if nargs is None or nargs == '?':
+        return 1
+    if isinstance(nargs, int):
+        return nargs
+    return None # '*', '+', REMAINDER, PARSER
+
+class Option(_Freezable):
+    __slots__ = ('parent', 'option_strings', 'metavar', 'help', 'group', 'takes_args', 'nargs',
+                 'complete', 'positional_num', 'positional_count')
+
+    def __init__(self, parent, option_strings, metavar='', help='', complete=None, exclusive_group=None, takes_args=True, nargs=None):
+        self.frozen = False
         self.parent = parent
-        self.option_strings = OptionStrings(option_strings)
+        self.option_strings = intern_option_strings(option_strings)
         self.metavar = metavar
         self.help = help
         self.group = exclusive_group
         self.takes_args = takes_args
+        self.nargs = nargs
+        self.positional_num = None   # Set by `Options.finalize()`
+        self.positional_count = None # Set by `Options.finalize()`
         if complete:
             self.complete = complete
         else:
@@ -108,6 +268,27 @@ class Option:
     def get_options(self):
         return self.option_strings
 
+    def freeze(self):
+        if self.frozen:
+            return
+        self.metavar = _intern(self.metavar)
+        self.help = _intern(self.help)
+        self.complete = _freeze_value(self.complete)
+        if self.group is not None:
+            self.group.freeze()
+        self.frozen = True
+
+    def get_share_key(self):
+        ''' Return a key identifying equal options, None if the option cannot be shared '''
+        if self.group is not None:
+            return None
+        key = (self.option_strings, self.metavar, self.help, self.complete, self.takes_args, self.nargs)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
     def get_short_options(self):
         return sorted([o for o in self.option_strings if not o.startswith('--')])
 
@@ -117,29 +298,19 @@ class Option:
     def get_conflicting_options(self):
         if not self.group:
             return []
-        option_strings = self.group.get_all_options()
-        for option in self.option_strings:
-            option_strings.remove(option)
-        return option_strings
+        return self.group.get_conflicting_options(self)
 
     def get_positional_num(self):
-        # TODO: check logic
-        positionals = []
-
-        parser = self.parent
-        while parser is not None:
-            all_positionals = parser.get_positionals()
-            if parser.get_subparsers_option():
-                all_positionals.append(parser.get_subparsers_option())
-
-            for o in reversed(all_positionals):
-                positionals.append(o)
-
-            parser = parser.parent
-
-        positionals = list(reversed(positionals))
+        ''' Return the number of the first argument of this positional '''
+        if self.positional_num is None:
+            self.parent.get_root().finalize()
+        return self.positional_num
 
-        return positionals.index(self) + 1
+    def get_positional_count(self):
+        ''' Return the number of arguments of this positional, None if unlimited '''
+        if self.positional_num is None:
+            self.parent.get_root().finalize()
+        return self.positional_count
 
     def __repr__(self):
         # TODO
@@ -147,52 +318,107 @@ class Option:
             self.option_strings, self.metavar, self.help)
 
 class SubparsersOption(Option):
+    __slots__ = ('subcommands', 'aliases')
+
     def __init__(self, parent, name, help):
         # TODO
+        self.frozen = False
         self.parent = parent
-        self.subcommands = OrderedDict()
+        self.subcommands = OrderedDict() # name -> Options
+        self.aliases = {} # name -> tuple of alias names
         self.help  = ''
-        self.option_strings = OptionStrings([name])
+        self.option_strings = intern_option_strings([name])
         self.complete = ('choices', []) # TODO
-
-    def add_options_object(self, options):
-        options.parent = self.parent
-        self.subcommands[options.prog] = options
-        self.complete[1].append(options.prog)
-
-    def add_options(self, name, help=''):
+        self.group = None
+        self.nargs = None
+        self.positional_num = None
+        self.positional_count = None
+
+    def add_options_object(self, options, name=None, aliases=()):
+        ''' Add `options` as subcommand `name` (default: `options.prog`).
+
+        The same `Options` object may be added to multiple parsers, it keeps
+        the parent it was added to first.
+        '''
+        if name is None:
+            name = options.prog
+        if options.parent is None:
+            options.parent = self.parent
+        self.subcommands[name] = options
+        self.complete[1].append(name)
+        if aliases:
+            self.aliases[name] = tuple(aliases)
+            self.complete[1].extend(aliases)
+
+    def add_options(self, name, help='', aliases=()):
         options = Options(name, help=help, parent=self.parent)
-        self.subcommands[options.prog] = options
-        self.complete[1].append(options.prog)
+        self.add_options_object(options, aliases=aliases)
         return options
 
+    def get_aliases(self, name):
+        return self.aliases.get(name, ())
+
+    def get_names(self, name):
+        ''' Return the name and the aliases of subcommand `name` '''
+        return (name,) + self.aliases.get(name, ())
+
+    def freeze(self):
+        if not self.frozen:
+            self.complete = _freeze_value(self.complete)
+            self.aliases = dict((_intern(k), _freeze_value(v)) for k, v in self.aliases.items())
+            self.frozen = True
+
     def __repr__(self):
         return '{help: %r, subcommands %r}' % (
             self.help, self.subcommands)
 
-class MutuallyExclusiveGroup:
+class MutuallyExclusiveGroup(_Freezable):
+    __slots__ = ('parent', 'options', 'conflicts')
+
     def __init__(self, parent):
+        self.frozen = False
         self.parent = parent
         self.options = []
+        self.conflicts = None # Option -> list of conflicting option strings
 
-    def add(self, option_strings, metavar='', help='', complete=None, takes_args=True):
+    def add(self, option_strings, metavar='', help='', complete=None, takes_args=True, nargs=None):
         ''' Creates and adds a new option '''
         option = Option(self.parent, option_strings, exclusive_group=self,
-                        metavar=metavar, help=help, complete=complete, takes_args=takes_args)
+                        metavar=metavar, help=help, complete=complete, takes_args=takes_args, nargs=nargs)
         self.options.append(option)
-        self.parent.options.append(option)
+        self.parent.add_option_object(option)
+        self.conflicts = None
 
     def add_option(self, option):
         ''' Adds an option object '''
         self.options.append(option)
         option.parent = self.parent
         option.group = self
+        self.conflicts = None
 
     def get_all_options(self):
         r = []
         for option in self.options:
             r.extend(option.option_strings)
         return r
+
+    def get_conflicting_options(self, option):
+        ''' Return the option strings of the group that conflict with `option` '''
+        if self.conflicts is None:
+            # Computed once for all options of the group
+            all_options = self.get_all_options()
+            self.conflicts = {}
+            for o in self.options:
+                own = set(o.option_strings)
+                self.conflicts[o] = [s for s in all_options if s not in own]
+        return list(self.conflicts[option])
+
+    def freeze(self):
+        if not self.frozen:
+            if self.options:
+                self.get_conflicting_options(self.options[0])
+            self.options = tuple(self.options)
+            self.frozen = True
         
 import argparse
 
@@ -208,7 +434,18 @@ def Action_Get_Metavar(action):
     else:
         return action.dest.upper()
 
-def ArgumentParser_to_Options(parser, prog=None, description=None):
+def ArgumentParser_to_Options(parser, prog=None, description=None, help_text=False, _converted=None):
+    ''' Convert `parser` to an `Options` object.
+
+    If `help_text` is True, the formatted help of each parser is stored in
+    `Options.help_text` (with the program name replaced by PROG_PLACEHOLDER).
+
+    Each parser object is converted only once, subcommand aliases and
+    parsers used in multiple places share a single `Options` object.
+    '''
+
+    if _converted is None:
+        _converted = {} # id(parser) -> Options
 
     def get_option_strings(action):
         # parser.add_argument('foo') results in empty option_strings
@@ -224,6 +461,15 @@ def ArgumentParser_to_Options(parser, prog=None, description=None):
         prog = parser.prog
 
     options = Options(prog, description)
+    options.usage = parser.usage
+    options.epilog = parser.epilog
+    options.markdown_prolog = getattr(parser, 'markdown_prolog', None)
+    options.markdown_epilog = getattr(parser, 'markdown_epilog', None)
+
+    if help_text:
+        parser.prog, prog_old = PROG_PLACEHOLDER, parser.prog
+        options.help_text = parser.format_help()
+        parser.prog = prog_old
 
     for action in parser._actions:
         if isinstance(action, argparse._HelpAction):
@@ -264,12 +510,17 @@ def ArgumentParser_to_Options(parser, prog=None, description=None):
             else:
                 complete = None
 
+            if complete is not None and complete[0] == 'choices' and utils.is_iterator(complete[1]):
+                # Iterators can be consumed only once, keep the choices that will be used
+                complete = ('choices', tuple(utils.take_choices(complete[1], utils.MAX_FILE_CHOICES)))
+
             options.add(
                 get_option_strings(action),
                 metavar=Action_Get_Metavar(action),
                 complete=complete,
                 help=action.help,
-                takes_args=True
+                takes_args=True,
+                nargs=action.nargs
             )
 
         elif isinstance(action, argparse.BooleanOptionalAction):
@@ -277,9 +528,16 @@ def ArgumentParser_to_Options(parser, prog=None, description=None):
 
         elif isinstance(action, argparse._SubParsersAction):
             subparsers = OrderedDict()
+            primary_names = {} # id(parser) -> name
 
+            # Aliases map to the same parser object, argparse adds them after the name
             for name, subparser in action.choices.items():
-                subparsers[name] = {'parser': subparser}
+                if id(subparser) in primary_names:
+                    subparsers[primary_names[id(subparser)]]['aliases'].append(name)
+                else:
+                    primary_names[id(subparser)] = name
+                    # Subparsers created without `help` have no entry in _get_subactions()
+                    subparsers[name] = {'parser': subparser, 'help': None, 'aliases': []}
 
             for action in action._get_subactions():
                 subparsers[action.dest]['help'] = action.help
@@ -287,21 +545,28 @@ def ArgumentParser_to_Options(parser, prog=None, description=None):
             subp = options.add_subparsers(name='command', help='Subcommands')
 
             for name, data in subparsers.items():
-                suboptions = ArgumentParser_to_Options(data['parser'], name, data['help'])
-                subp.add_options_object(suboptions)
+                converted = _converted.get(id(data['parser']))
+                if converted is not None and converted.help == data['help']:
+                    suboptions = converted
+                else:
+                    suboptions = ArgumentParser_to_Options(data['parser'], name, data['help'], help_text, _converted)
+                    _converted[id(data['parser'])] = suboptions
+                subp.add_options_object(suboptions, name, data['aliases'])
 
         else:
             print('Unknown action type:', type(action), file=sys.stderr)
             raise
 
+    # This also covers groups inherited from parent parsers, argparse copies
+    # them together with their actions.
     for group in parser._mutually_exclusive_groups:
         exclusive_group = MutuallyExclusiveGroup(options)
         for action in group._group_actions:
-            for option in options.get_options():
-                for option_string in action.option_strings:
-                    if option_string in option.option_strings:
-                        exclusive_group.add_option(option)
-                        break
+            for option_string in action.option_strings:
+                option = options.get_option(option_string)
+                if option is not None:
+                    exclusive_group.add_option(option)
+                    break
 
     return options
 
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 import re
+from . import options, writer
 
 def make_identifier(s):
     ''' Make `s` a valid C identifier '''
@@ -22,29 +23,25 @@ def define_macro(name, value):
 def create_macro_name(parser_names):
     return make_identifier('%s_HELP_TEXT' % '_'.join(parser_names)).upper()
 
-def generate_printf_usage(p, prog='%s', macro=create_macro_name, parsers=[]):
-    if prog is None:
-        prog = p.prog
-
-    parsers = parsers.copy()
-    parsers.append(p.prog)
-
-    r = ''
+def write_printf_usage(p, prog, macro, parsers, out):
+    parsers = parsers + [p.prog]
 
-    macro_name = macro(parsers)
-
-    p.prog, prog_old = '$$$ PROG $$$', p.prog
-    help = p.format_help()
-    p.prog = prog_old
-
-    help = str_to_c(help)
+    help = str_to_c(p.help_text)
     help = help.replace('%', '%%')
-    help = help.replace('$$$ PROG $$$', prog)
-    r += '%s\n' % define_macro(macro_name, help)
+    help = help.replace(options.PROG_PLACEHOLDER, prog)
+    out.write('%s\n' % define_macro(macro(parsers), help))
 
-    for name, sub in p.get_subparsers().items():
-        sub.prog = name
-        r += '%s\n' % generate_printf_usage(sub, prog, macro, parsers)
+    if p.get_subparsers_option():
+        for name, sub in p.get_subparsers_option().subcommands.items():
+            write_printf_usage(sub, prog, macro, parsers, out)
+            out.write('\n')
 
-    return r
+def generate_printf_usage(p, prog='%s', macro=create_macro_name, parsers=[], fh=None):
+    ''' Return the help texts as C macros, write them to `fh` if given '''
+    # `p` has to be created using `ArgumentParser_to_Options(..., help_text=True)`
+    if prog is None:
+        prog = p.prog
 
+    out = writer.Writer(fh)
+    write_printf_usage(p, prog, macro, parsers, out)
+    return out.getvalue()
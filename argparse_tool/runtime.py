@@ -0,0 +1,335 @@
+#!/usr/bin/python3
+
+''' Completion runtime working on an index written by `argparse-tool index`.
+
+Invoked as `argparse-tool complete INDEX` on every TAB, for example by
+bash's `complete -C`. The command line is taken from COMP_LINE and
+COMP_POINT, the candidates are printed one per line.
+
+`argparse-tool query SOCKET` is the client of the completion daemon
+(see daemon.py) used by the shell scripts if neither socat nor nc is
+available.
+
+This module is loaded without importing the argparse_tool package (which
+imports argparse), it must only import modules that are cheap to load.
+'''
+
+import os, sys, marshal
+
+# Stored in the index, increment on incompatible changes
+MAGIC   = 'argparse-tool-index'
+VERSION = 1
+
+# Numbers of a range that are checked for matching the current word
+MAX_RANGE_SCAN = 100000
+
+# Seconds `query` waits for the daemon
+QUERY_TIMEOUT = 2
+
+# =============================================================================
+# Index
+#
+# (MAGIC, VERSION, completions, parsers)
+#
+# completions: list of completion tuples, e.g. ('choices', (value, ...)),
+#              ('range', start, stop, step), ('file', glob),
+#              ('python', module, qualname, args)
+# parsers:     list of parsers, the root is 0. Each parser is a tuple
+#   optargs:     {option_string: completion number} of options taking an argument
+#   options:     ((option_string, (conflicting option strings, ...)), ...)
+#   positionals: {argument number: completion number}
+#   rest:        (argument number, completion number) or None, for all
+#                arguments from that number on
+#   subcommands: {name: parser number}
+#   subpos:      argument number of the subcommand, 0 if there is none
+# =============================================================================
+
+def load(file):
+    ''' Return the index stored in `file` '''
+    with open(file, 'rb') as fh:
+        index = marshal.load(fh)
+    if index[0:2] != (MAGIC, VERSION):
+        raise Exception('%s: Not an index of version %d' % (file, VERSION))
+    return index
+
+# =============================================================================
+# Command line
+# =============================================================================
+
+def split_line(line):
+    ''' Split `line` into words (quotes and backslashes are removed).
+
+    The last word is the one being completed, it is empty if `line` ends
+    with a blank.
+    '''
+    words, word, quote, escape, in_word = [], '', None, False, False
+    for c in line:
+        if escape:
+            word, escape = word + c, False
+        elif c == '\\' and quote != "'":
+            escape = in_word = True
+        elif quote:
+            if c == quote:
+                quote = None
+            else:
+                word += c
+        elif c in '"\'':
+            quote, in_word = c, True
+        elif c in ' \t\n':
+            if in_word:
+                words.append(word)
+                word, in_word = '', False
+        else:
+            word, in_word = word + c, True
+    words.append(word)
+    return words
+
+def parse(parsers, words):
+    ''' Walk `words` (without the last one, which is being completed).
+
+    Returns (parser number, argument number of the current word, option
+    strings given to the current parser, option that takes the current
+    word as argument or None, True if the words follow `--`).
+    '''
+    n, args, seen, optarg, positional_only = 0, 1, set(), None, False
+    for w in words[1:-1]:
+        if optarg is not None:
+            optarg = None
+            continue
+
+        optargs = parsers[n][0]
+        if w == '--' and not positional_only:
+            positional_only = True
+        elif positional_only or not w.startswith('-') or w == '-':
+            subcommands, subpos = parsers[n][4], parsers[n][5]
+            if args == subpos and w in subcommands:
+                n, seen = subcommands[w], set()
+            args += 1
+        elif w.startswith('--') or w in optargs:
+            seen.add(w.split('=', 1)[0])
+            if w in optargs:
+                optarg = w
+        else:
+            # A cluster of short options (-vo), the first option taking an
+            # argument ends it. The rest of the word is its argument, if
+            # there is none it is the next word.
+            for i in range(1, len(w)):
+                option = '-' + w[i]
+                seen.add(option)
+                if option in optargs:
+                    if i == len(w) - 1:
+                        optarg = option
+                    break
+
+    return n, args, seen, optarg, positional_only
+
+# =============================================================================
+# Completions, each yields the candidates starting with `word`
+# =============================================================================
+
+def complete_none(word):
+    return ()
+
+def complete_choices(word, choices):
+    return (c for c in choices if c.startswith(word))
+
+def complete_range(word, start, stop, step):
+    r = range(start, stop, step)
+    for i in range(min(len(r), MAX_RANGE_SCAN)):
+        if str(r[i]).startswith(word):
+            yield str(r[i])
+
+def complete_file(word, glob_pattern=None, directories_only=False):
+    directory, base = os.path.split(word)
+    try:
+        entries = os.scandir(os.path.expanduser(directory) or '.')
+    except OSError:
+        return
+
+    with entries:
+        for entry in entries:
+            if not entry.name.startswith(base) or (entry.name[0] == '.' and base[0:1] != '.'):
+                continue
+            is_dir = entry.is_dir()
+            if directories_only and not is_dir:
+                continue
+            if glob_pattern and not is_dir:
+                import fnmatch
+                if not fnmatch.fnmatch(entry.name, glob_pattern):
+                    continue
+            yield os.path.join(directory, entry.name)
+
+def complete_directory(word, glob_pattern=None):
+    return complete_file(word, glob_pattern, True)
+
+def complete_command(word):
+    if '/' in word:
+        yield from complete_file(word)
+        return
+
+    seen = set()
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        try:
+            entries = os.scandir(directory or '.')
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith(word) and entry.name not in seen and os.access(entry.path, os.X_OK):
+                    seen.add(entry.name)
+                    yield entry.name
+
+def complete_user(word):
+    import pwd
+    return (p.pw_name for p in pwd.getpwall() if p.pw_name.startswith(word))
+
+def complete_group(word):
+    import grp
+    return (g.gr_name for g in grp.getgrall() if g.gr_name.startswith(word))
+
+def complete_hostname(word):
+    try:
+        with open('/etc/hosts') as fh:
+            for line in fh:
+                for name in line.split('#', 1)[0].split()[1:]:
+                    if name.startswith(word):
+                        yield name
+    except OSError:
+        pass
+
+def complete_variable(word):
+    return (v for v in os.environ if v.startswith(word))
+
+def complete_pid(word):
+    try:
+        return [p for p in os.listdir('/proc') if p.isdigit() and p.startswith(word)]
+    except OSError:
+        return ()
+
+def complete_process(word):
+    names = set()
+    for pid in complete_pid(''):
+        try:
+            with open('/proc/%s/comm' % pid) as fh:
+                name = fh.read().rstrip('\n')
+        except OSError:
+            continue
+        if name.startswith(word):
+            names.add(name)
+    return names
+
+def complete_service(word):
+    for directory in ('/etc/systemd/system', '/run/systemd/system', '/usr/lib/systemd/system', '/lib/systemd/system'):
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            if name.endswith('.service') and name.startswith(word):
+                yield name[:-len('.service')]
+
+def complete_python(word, module, qualname, args):
+    # Only the module of the function is imported, not the program.
+    # Errors give no candidates, there is no place to report them on TAB.
+    try:
+        function = __import__(module, fromlist=['_'])
+        for name in qualname.split('.'):
+            function = getattr(function, name)
+        return [str(c) for c in function(word, *args) if str(c).startswith(word)]
+    except (Exception, SystemExit):
+        return ()
+
+def complete(completion, word):
+    ''' Return the candidates of `completion` (a tuple as stored in the index) '''
+    function = globals().get('complete_' + completion[0], complete_none)
+    return function(word, *completion[1:])
+
+def get_candidates(index, words):
+    ''' Return the candidates for the last word of `words` '''
+    completions, parsers = index[2], index[3]
+    n, args, seen, optarg, positional_only = parse(parsers, words)
+    optargs, options, positionals, rest = parsers[n][0:4]
+    word = words[-1]
+
+    if optarg is not None:
+        return list(complete(completions[optargs[optarg]], word))
+
+    # After `--` the current word is a positional argument, too
+    if word.startswith('--') and '=' in word and not positional_only:
+        option, value = word.split('=', 1)
+        if option in optargs:
+            return list(complete(completions[optargs[option]], value))
+        return []
+
+    candidates = []
+    if word.startswith('-') and not positional_only:
+        for option_string, conflicts in options:
+            if option_string.startswith(word) and not seen.intersection(conflicts):
+                candidates.append(option_string)
+
+    if args in positionals:
+        candidates.extend(complete(completions[positionals[args]], word))
+    elif rest is not None and args >= rest[0]:
+        candidates.extend(complete(completions[rest[1]], word))
+    return candidates
+
+def complete_main(argv):
+    ''' Usage: complete INDEX [COMMAND WORD PREVIOUS-WORD]
+
+    The arguments passed by bash's `complete -C` after INDEX are ignored.
+    '''
+    if not argv:
+        print('Usage: argparse-tool complete INDEX', file=sys.stderr)
+        return 2
+
+    # Nothing is printed on errors (e.g. a missing or outdated index), the
+    # output would end up in the command line
+    try:
+        line  = os.environ.get('COMP_LINE', '')
+        point = int(os.environ.get('COMP_POINT', len(line)))
+        words = split_line(line[:point])
+        candidates = get_candidates(load(argv[0]), words)
+    except Exception:
+        return 1
+
+    # bash replaces only the part of the word after the last ':' (COMP_WORDBREAKS)
+    cur = words[-1].split('=', 1)[-1] if words[-1].startswith('--') else words[-1]
+    strip = cur.rfind(':') + 1
+    for candidate in candidates:
+        print(candidate[strip:])
+    return 0
+
+# =============================================================================
+# Completion daemon client
+# =============================================================================
+
+def get_socket_path():
+    ''' Return the path of the socket of the completion daemon of the user '''
+    if os.environ.get('ARGPARSE_TOOL_SOCKET'):
+        return os.environ['ARGPARSE_TOOL_SOCKET']
+    directory = os.environ.get('XDG_RUNTIME_DIR') or '/tmp/argparse-tool-%d' % os.getuid()
+    return os.path.join(directory, 'argparse-tool.sock')
+
+def query_main(argv):
+    ''' Usage: query [SOCKET]
+
+    Sends the request read from stdin to the daemon and prints its response.
+    '''
+    import socket
+    s = socket.socket(socket.AF_UNIX)
+    s.settimeout(QUERY_TIMEOUT)
+    try:
+        s.connect(argv[0] if argv else get_socket_path())
+        s.sendall(sys.stdin.buffer.readline())
+        s.shutdown(socket.SHUT_WR)
+        while True:
+            data = s.recv(65536)
+            if not data:
+                break
+            sys.stdout.buffer.write(data)
+    except Exception:
+        # No candidates, e.g. if the daemon is not running (yet)
+        return 1
+    finally:
+        s.close()
+    return 0
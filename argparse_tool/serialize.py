@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+
+''' Serialization of the `Options` tree.
+
+The tree is converted to plain python objects (dicts, lists, strings and
+numbers), which are then written either as JSON or in a compact binary form
+using `marshal`.
+
+A subcommand that is shared by multiple parsers is stored once, further
+occurrences refer to it by its number (in pre-order).
+'''
+
+import sys, json, marshal
+from . import utils
+from .options import Options, MutuallyExclusiveGroup
+
+# Increment on incompatible changes of the serialized format
+VERSION = 2
+
+BINARY_MAGIC = b'ATIR'
+
+def _encode_value(value):
+    if isinstance(value, range):
+        return {'range': [value.start, value.stop, value.step]}
+    if callable(value):
+        # Choices returned by a callable are stored
+        return [_encode_value(v) for v in utils.take_choices(value)]
+    if hasattr(value, 'items'):
+        return {'dict': [[_encode_value(k), _encode_value(v)] for k, v in value.items()]}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_encode_value(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def _encode_complete(complete):
+    if complete is None:
+        return None
+
+    if complete[0] == 'cached':
+        # ('cached', ttl, completion, ...)
+        return [complete[0], complete[1]] + _encode_complete(complete[2:])
+
+    # Functions of `python` completions are stored as 'module:function', the
+    # backends fall back to `none` for functions that cannot be imported by name
+    if complete[0] == 'python':
+        name = utils.get_function_name(complete[1])
+        if name is None:
+            print("Warning: serialize: Storing `python` completion of %r as `none`" % (complete[1],), file=sys.stderr)
+            return ['none']
+        complete = ('python', name) + tuple(complete[2:])
+
+    return _encode_value(complete)
+
+def _is_constant(value):
+    if callable(value):
+        return False
+    if hasattr(value, 'items'):
+        return all(_is_constant(k) and _is_constant(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return all(_is_constant(v) for v in value)
+    return True
+
+def is_cacheable(options):
+    ''' Return True if storing `options` does not change the generated output.
+
+    Callable choices are called each time a completion is generated and
+    functions of `python` completions that have no importable name can't be
+    stored, trees containing them are not cached.
+    '''
+    todo, seen = [options], set()
+    while todo:
+        options = todo.pop()
+        if id(options) in seen:
+            continue
+        seen.add(id(options))
+
+        for option in options.options + options.positionals:
+            complete = option.complete
+            while complete is not None and complete[0] == 'cached':
+                complete = complete[2:]
+            if complete is not None and complete[0] == 'python':
+                if utils.get_function_name(complete[1]) is None:
+                    return False
+                complete = complete[2:]
+            if not _is_constant(complete):
+                return False
+
+        subparsers = options.get_subparsers_option()
+        if subparsers is not None:
+            todo.extend(subparsers.subcommands.values())
+    return True
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'range' in value:
+            return range(*value['range'])
+        if 'dict' in value:
+            return dict((_decode_value(k), _decode_value(v)) for k, v in value['dict'])
+    if isinstance(value, list):
+        return tuple(_decode_value(v) for v in value)
+    return value
+
+def _option_to_dict(option, groups):
+    r = {
+        'option_strings': list(option.option_strings),
+        'metavar':        option.metavar,
+        'help':           option.help,
+        'complete':       _encode_complete(option.complete),
+        'takes_args':     option.takes_args,
+        'nargs':          option.nargs,
+    }
+
+    if option.group is not None:
+        # `groups` maps the id of a group to its number
+        r['group'] = groups.setdefault(id(option.group), len(groups))
+
+    return r
+
+def to_dict(options, _nodes=None):
+    ''' Convert an `Options` object to a dictionary '''
+
+    if _nodes is None:
+        _nodes = {} # id(Options) -> number
+    _nodes[id(options)] = len(_nodes)
+
+    groups = {}
+    option_dicts     = [_option_to_dict(o, groups) for o in options.options]
+    positional_dicts = [_option_to_dict(o, groups) for o in options.positionals]
+
+    r = {
+        'prog':        options.prog,
+        'help':        options.help,
+        'help_text':   options.help_text,
+        'usage':       options.usage,
+        'epilog':      options.epilog,
+        'markdown_prolog': options.markdown_prolog,
+        'markdown_epilog': options.markdown_epilog,
+        'options':     option_dicts,
+        'positionals': positional_dicts,
+        'groups':      len(groups),
+        'subparsers':  None,
+    }
+
+    subparsers = options.get_subparsers_option()
+    if subparsers is not None:
+        subcommands = []
+        for name, sub in subparsers.subcommands.items():
+            if id(sub) in _nodes:
+                subcommands.append({'names': list(subparsers.get_names(name)), 'ref': _nodes[id(sub)]})
+            else:
+                subcommands.append({'names': list(subparsers.get_names(name)), 'options': to_dict(sub, _nodes)})
+
+        r['subparsers'] = {
+            'name': subparsers.option_strings[0],
+            'help': subparsers.help,
+            'subcommands': subcommands,
+        }
+
+    return r
+
+def from_dict(d, parent=None, _nodes=None):
+    ''' Create an `Options` object from a dictionary created by `to_dict` '''
+
+    if _nodes is None:
+        _nodes = [] # Options objects in pre-order
+
+    options = Options(d['prog'], d['help'], parent)
+    _nodes.append(options)
+    options.help_text = d['help_text']
+    options.usage = d['usage']
+    options.epilog = d['epilog']
+    options.markdown_prolog = d['markdown_prolog']
+    options.markdown_epilog = d['markdown_epilog']
+    groups = [MutuallyExclusiveGroup(options) for i in range(d['groups'])]
+
+    for o in d['options'] + d['positionals']:
+        option = options.add(
+            o['option_strings'],
+            metavar=o['metavar'],
+            help=o['help'],
+            complete=_decode_value(o['complete']),
+            takes_args=o['takes_args'],
+            nargs=o.get('nargs'))
+
+        if 'group' in o:
+            groups[o['group']].add_option(option)
+
+    if d['subparsers'] is not None:
+        subp = options.add_subparsers(name=d['subparsers']['name'], help=d['subparsers']['help'])
+        for sub in d['subparsers']['subcommands']:
+            if 'ref' in sub:
+                suboptions = _nodes[sub['ref']]
+            else:
+                suboptions = from_dict(sub['options'], options, _nodes)
+            subp.add_options_object(suboptions, sub['names'][0], sub['names'][1:])
+
+    if parent is None:
+        options.finalize()
+
+    return options
+
+def dumps_json(options):
+    return json.dumps({'version': VERSION, 'options': to_dict(options)}, indent=1)
+
+def generate_json(options, program_name=None, fh=None):
+    if fh is not None:
+        json.dump({'version': VERSION, 'options': to_dict(options)}, fh, indent=1)
+        return None
+    return dumps_json(options)
+
+def loads_json(s):
+    d = json.loads(s)
+    if d.get('version') != VERSION:
+        raise Exception('Unsupported version of serialized options: %r' % d.get('version'))
+    return from_dict(d['options'])
+
+def dumps_binary(options):
+    return BINARY_MAGIC + bytes([VERSION]) + marshal.dumps(to_dict(options))
+
+def loads_binary(b):
+    if b[0:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise Exception('Not a serialized options file')
+    if b[len(BINARY_MAGIC)] != VERSION:
+        raise Exception('Unsupported version of serialized options: %r' % b[len(BINARY_MAGIC)])
+    return from_dict(marshal.loads(b[len(BINARY_MAGIC) + 1:]))
+
+def dump(options, file, binary=False):
+    ''' Write `options` to `file` '''
+    if binary:
+        with open(file, 'wb') as fh:
+            fh.write(dumps_binary(options))
+    else:
+        with open(file, 'w') as fh:
+            fh.write(dumps_json(options))
+
+def load(file):
+    ''' Read options from `file`, the format is detected automatically '''
+    with open(file, 'rb') as fh:
+        data = fh.read()
+
+    if data.startswith(BINARY_MAGIC):
+        return loads_binary(data)
+    return loads_json(data.decode('utf-8'))
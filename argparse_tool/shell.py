@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
-import sys, re, argparse, collections
+import sys, re, ast, zlib, argparse, collections
+from . import utils
 
 def make_identifier(s):
     ''' Make `s` a valid shell identifier '''
@@ -16,9 +17,47 @@ def escape(s, escape_empty_string=True):
     if not s and escape_empty_string is False: return ''
     if re.fullmatch('[a-zA-Z0-9_,:-]+', s): return s
     if "'" not in s: return "'%s'" % s
-    if '"' not in s: return '"%s"' % s.replace('\\', '\\\\').replace('"', '\\"')
+    if '"' not in s: return '"%s"' % s.replace('\\', '\\\\').replace('"', '\\"').replace('$', '\\$').replace('`', '\\`')
     return "'%s'" % s.replace("'", '\'"\'"\'')
 
+def cache_key(completion, *a):
+    ''' Return an identifier for the candidates of `completion` '''
+    if not a:
+        return make_identifier(completion)
+    return '%s_%08x' % (make_identifier(completion), zlib.crc32(repr(a).encode()))
+
+def python_request(function, args):
+    ''' Return the function name and the arguments of a `python` completion as
+    sent to the completion daemon (see daemon.py), None if the daemon cannot call it '''
+    name = utils.get_function_name(function)
+    args = repr(tuple(args))
+    try:
+        ast.literal_eval(args)
+    except (ValueError, SyntaxError):
+        return None
+    if name is None or '\t' in args or '\n' in args:
+        return None
+    return name, args
+
+def uses_completion(options, completions, _seen=None):
+    ''' Return True if an option of `options` or its subcommands is completed by one of `completions` '''
+    if _seen is None:
+        _seen = set()
+    _seen.add(id(options))
+
+    for option in options.options + options.positionals:
+        complete = option.complete
+        while complete[0] in completions or complete[0] == 'cached':
+            if complete[0] in completions:
+                return True
+            complete = complete[2:] # ('cached', ttl, completion, ...)
+
+    if options.subparsers:
+        for sub in options.subparsers.subcommands.values():
+            if id(sub) not in _seen and uses_completion(sub, completions, _seen):
+                return True
+    return False
+
 def make_subparser_identifier(s):
     return make_identifier(f'_{s}_subcommands')
 
@@ -45,10 +84,18 @@ class ShellCompleter:
     def complete(self, completion, *a, **kw):
         if not hasattr(self, completion):
             print("Warning: ShellCompleter: Falling back from `%s` to `none`" % (completion,), file=sys.stderr)
-            completion = 'none'
+            completion, a, kw = 'none', (), {}
+
+        # Ranges given as choices are completed without listing them
+        if completion == 'choices' and a and isinstance(a[0], range):
+            completion = 'range'
 
         return getattr(self, completion)(*a, **kw)
 
+    def cached(self, ttl, completion, *a):
+        ''' Complete by `completion`, its candidates may be cached for `ttl` seconds '''
+        return self.complete(completion, *a)
+
     def fallback(self, from_, to, *a, **kw):
         print("Warning: ShellCompleter: Falling back from `%s` to `%s`" % (from_, to), file=sys.stderr)
         return self.complete(to, *a, **kw)
@@ -93,12 +140,7 @@ class ShellCompleter:
         return self.complete('choices', signals)
 
     def range(self, _range):
-        l = list(_range)
-
-        if len(l) > 32:
-            l = l[0:16] + ['...'] + l[-32:]
-
-        return self.complete('choices', l)
+        return self.complete('choices', utils.limit_choices(_range, 48))
 
     def directory(self, glob_pattern=None):
         return self.fallback('directory', 'file', glob_pattern)
@@ -0,0 +1,466 @@
+#!/usr/bin/python3
+
+''' Extract an ArgumentParser from a python file without executing it.
+
+The source is parsed using `ast` and only the calls that build the parser
+(ArgumentParser(...), add_argument(), add_subparsers(), add_parser(),
+add_mutually_exclusive_group(), .complete(...), ...) are evaluated, using
+the real argparse classes. Everything else is skipped.
+
+If a call that builds the parser cannot be resolved, StaticEvaluationError
+is raised and the caller should fall back to importing the file.
+'''
+
+import ast, argparse, builtins
+from . import utils
+
+class StaticEvaluationError(Exception):
+    pass
+
+class _Unresolvable(Exception):
+    ''' Raised if an expression cannot be evaluated statically '''
+    pass
+
+class _Return(Exception):
+    def __init__(self, value):
+        self.value = value
+
+class _Unknown:
+    ''' Value of a name that could not be evaluated '''
+    def __repr__(self):
+        return '<unknown>'
+
+UNKNOWN = _Unknown()
+
+# Methods that build the parser. Their arguments must be resolvable.
+_building_methods = {
+    'add_argument', 'add_subparsers', 'add_parser', 'add_mutually_exclusive_group',
+    'add_argument_group', 'complete'
+}
+
+# Keyword arguments that don't matter for generating completions/documentation.
+# If they cannot be resolved they are dropped instead of failing.
+_lenient_keywords = {
+    'type', 'default', 'const', 'required', 'prog', 'formatter_class', 'argument_default',
+    'conflict_handler', 'fromfile_prefix_chars', 'allow_abbrev', 'exit_on_error'
+}
+
+# Builtins that are safe to call
+_builtins = {name: getattr(builtins, name) for name in (
+    'range', 'str', 'int', 'float', 'bool', 'list', 'tuple', 'dict', 'set', 'frozenset',
+    'sorted', 'reversed', 'len', 'min', 'max', 'zip', 'enumerate'
+)}
+
+# Methods of `str` that are safe to call
+_str_methods = {
+    'join', 'format', 'upper', 'lower', 'capitalize', 'title', 'strip', 'lstrip', 'rstrip',
+    'replace', 'split'
+}
+
+# Attributes of a parser that may be assigned, e.g. `parser.markdown_prolog = '...'`
+_parser_attributes = {'usage', 'epilog', 'description', 'markdown_prolog', 'markdown_epilog'}
+
+_max_call_depth = 16
+
+def _contains_building_call(node):
+    for n in ast.walk(node):
+        if isinstance(n, ast.Call) and isinstance(n.func, ast.Attribute) and n.func.attr in _building_methods:
+            return True
+    return False
+
+class _Function:
+    def __init__(self, node, scope):
+        self.node = node
+        self.scope = scope
+
+class _Evaluator:
+    def __init__(self, file):
+        self.file = file
+        self.parsers = []      # All ArgumentParser objects created, in order
+        self.subparsers = []   # ArgumentParser objects created by add_parser()
+        self.depth = 0
+        self.globals = {'__file__': file, '__name__': '__main__'}
+
+    # =========================================================================
+    # Statements
+    # =========================================================================
+
+    def exec_body(self, body, scope):
+        for stmt in body:
+            self.exec_stmt(stmt, scope)
+
+    def exec_stmt(self, stmt, scope):
+        try:
+            self._exec_stmt(stmt, scope)
+        except _Unresolvable:
+            # The statement does not contribute to the parser
+            for target in getattr(stmt, 'targets', [getattr(stmt, 'target', None)]):
+                self.assign(target, UNKNOWN, scope)
+
+    def _exec_stmt(self, stmt, scope):
+        if isinstance(stmt, ast.Import):
+            for alias in stmt.names:
+                name = alias.asname or alias.name.split('.')[0]
+                if alias.name == 'argparse':
+                    scope[name] = argparse
+                else:
+                    scope[name] = UNKNOWN
+
+        elif isinstance(stmt, ast.ImportFrom):
+            for alias in stmt.names:
+                name = alias.asname or alias.name
+                if stmt.module == 'argparse' and hasattr(argparse, alias.name):
+                    scope[name] = getattr(argparse, alias.name)
+                else:
+                    scope[name] = UNKNOWN
+
+        elif isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            scope[stmt.name] = _Function(stmt, scope)
+
+        elif isinstance(stmt, ast.ClassDef):
+            scope[stmt.name] = UNKNOWN
+
+        elif isinstance(stmt, ast.Assign):
+            value = self.eval(stmt.value, scope)
+            for target in stmt.targets:
+                self.assign(target, value, scope)
+
+        elif isinstance(stmt, ast.AnnAssign) and stmt.value is not None:
+            self.assign(stmt.target, self.eval(stmt.value, scope), scope)
+
+        elif isinstance(stmt, (ast.AnnAssign, ast.AugAssign)):
+            self.assign(stmt.target, UNKNOWN, scope)
+
+        elif isinstance(stmt, ast.Expr):
+            self.eval(stmt.value, scope)
+
+        elif isinstance(stmt, ast.Return):
+            try:    value = self.eval(stmt.value, scope) if stmt.value else None
+            except _Unresolvable: value = UNKNOWN
+            raise _Return(value)
+
+        elif isinstance(stmt, ast.If):
+            try:
+                test = self.eval(stmt.test, scope)
+                if test is UNKNOWN:
+                    raise _Unresolvable()
+            except _Unresolvable:
+                if _contains_building_call(stmt):
+                    raise StaticEvaluationError('Cannot resolve condition in line %d' % stmt.lineno)
+                return
+
+            self.exec_body(stmt.body if test else stmt.orelse, scope)
+
+        elif isinstance(stmt, ast.For):
+            try:
+                iterable = self.eval(stmt.iter, scope)
+                if not isinstance(iterable, (list, tuple, dict, set, frozenset, str, range, zip, enumerate, reversed)):
+                    raise _Unresolvable()
+            except _Unresolvable:
+                if _contains_building_call(stmt):
+                    raise StaticEvaluationError('Cannot resolve loop in line %d' % stmt.lineno)
+                return
+
+            for value in iterable:
+                self.assign(stmt.target, value, scope)
+                self.exec_body(stmt.body, scope)
+            self.exec_body(stmt.orelse, scope)
+
+        elif isinstance(stmt, ast.With):
+            for item in stmt.items:
+                if item.optional_vars is not None:
+                    self.assign(item.optional_vars, UNKNOWN, scope)
+            self.exec_body(stmt.body, scope)
+
+        elif isinstance(stmt, ast.Try):
+            self.exec_body(stmt.body, scope)
+            self.exec_body(stmt.orelse, scope)
+            self.exec_body(stmt.finalbody, scope)
+
+        elif isinstance(stmt, (ast.Pass, ast.Global, ast.Nonlocal, ast.Delete, ast.Assert, ast.Raise)):
+            pass
+
+        elif _contains_building_call(stmt):
+            raise StaticEvaluationError('Unsupported statement in line %d' % stmt.lineno)
+
+    def assign(self, target, value, scope):
+        # Assignments to attributes (except `_parser_attributes`) or subscripts are ignored
+        if isinstance(target, ast.Name):
+            scope[target.id] = value
+        elif isinstance(target, ast.Attribute) and target.attr in _parser_attributes:
+            try:
+                parser = self.eval(target.value, scope)
+            except _Unresolvable:
+                return
+            if isinstance(parser, argparse.ArgumentParser) and isinstance(value, str):
+                setattr(parser, target.attr, value)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            try:
+                values = list(value)
+                if len(values) != len(target.elts):
+                    raise _Unresolvable()
+            except (TypeError, _Unresolvable):
+                values = [UNKNOWN] * len(target.elts)
+            for t, v in zip(target.elts, values):
+                self.assign(t, v, scope)
+
+    # =========================================================================
+    # Expressions
+    # =========================================================================
+
+    def lookup(self, name, scope):
+        if name in scope:
+            return scope[name]
+        if name in self.globals:
+            return self.globals[name]
+        if name in _builtins:
+            return _builtins[name]
+        raise _Unresolvable()
+
+    def eval(self, node, scope):
+        value = self._eval(node, scope)
+        if value is UNKNOWN:
+            raise _Unresolvable()
+        return value
+
+    def _eval(self, node, scope):
+        if isinstance(node, ast.Constant):
+            return node.value
+
+        if isinstance(node, ast.Name):
+            return self.lookup(node.id, scope)
+
+        if isinstance(node, ast.Tuple):
+            return tuple(self.eval(e, scope) for e in node.elts)
+
+        if isinstance(node, ast.List):
+            return [self.eval(e, scope) for e in node.elts]
+
+        if isinstance(node, ast.Set):
+            return {self.eval(e, scope) for e in node.elts}
+
+        if isinstance(node, ast.Dict):
+            if None in node.keys:
+                raise _Unresolvable()
+            return {self.eval(k, scope): self.eval(v, scope) for k, v in zip(node.keys, node.values)}
+
+        if isinstance(node, ast.JoinedStr):
+            r = ''
+            for value in node.values:
+                if isinstance(value, ast.FormattedValue):
+                    if value.conversion != -1 or value.format_spec is not None:
+                        raise _Unresolvable()
+                    r += str(self.eval(value.value, scope))
+                else:
+                    r += self.eval(value, scope)
+            return r
+
+        if isinstance(node, ast.BinOp):
+            left, right = self.eval(node.left, scope), self.eval(node.right, scope)
+            if not all(isinstance(v, (str, int, float, tuple, list)) for v in (left, right)):
+                raise _Unresolvable()
+            if isinstance(node.op, ast.Add):  return left + right
+            if isinstance(node.op, ast.Sub):  return left - right
+            if isinstance(node.op, ast.Mult): return left * right
+            if isinstance(node.op, ast.Pow) and isinstance(right, int) and abs(right) <= 64: return left ** right
+            if isinstance(node.op, ast.FloorDiv): return left // right
+            if isinstance(node.op, ast.Mod) and isinstance(left, str): return left % right
+            raise _Unresolvable()
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.Not)):
+            operand = self.eval(node.operand, scope)
+            if isinstance(node.op, ast.Not):
+                return not operand
+            if not isinstance(operand, (int, float)):
+                raise _Unresolvable()
+            return -operand
+
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and isinstance(node.ops[0], (ast.Eq, ast.NotEq)):
+            left, right = self.eval(node.left, scope), self.eval(node.comparators[0], scope)
+            if not all(isinstance(v, (str, int, float, bool, type(None))) for v in (left, right)):
+                raise _Unresolvable()
+            return (left == right) == isinstance(node.ops[0], ast.Eq)
+
+        if isinstance(node, ast.Attribute):
+            value = self.eval(node.value, scope)
+            if value is argparse and hasattr(argparse, node.attr):
+                return getattr(argparse, node.attr)
+            raise _Unresolvable()
+
+        if isinstance(node, ast.Call):
+            return self.call(node, scope)
+
+        raise _Unresolvable()
+
+    def eval_arguments(self, node, scope, building):
+        args, kwargs = [], {}
+
+        for arg in node.args:
+            if isinstance(arg, ast.Starred):
+                args.extend(self.eval(arg.value, scope))
+            else:
+                args.append(self.eval(arg, scope))
+
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                kwargs.update(self.eval(keyword.value, scope))
+                continue
+
+            try:
+                kwargs[keyword.arg] = self.eval(keyword.value, scope)
+            except _Unresolvable:
+                if not building or keyword.arg not in _lenient_keywords:
+                    raise
+
+        return args, kwargs
+
+    def call(self, node, scope):
+        func = node.func
+
+        # Method calls on parser objects
+        if isinstance(func, ast.Attribute):
+            try:
+                obj = self.eval(func.value, scope)
+            except _Unresolvable:
+                if func.attr in _building_methods:
+                    raise StaticEvaluationError('Cannot resolve `%s` in line %d' % (ast.unparse(func.value), node.lineno))
+                raise
+
+            if obj is argparse:
+                return self.call_argparse(getattr(argparse, func.attr, None), node, scope)
+
+            if isinstance(obj, str) and func.attr in _str_methods:
+                args, kwargs = self.eval_arguments(node, scope, building=False)
+                return getattr(obj, func.attr)(*args, **kwargs)
+
+            if func.attr not in _building_methods or not isinstance(obj, (
+                argparse.ArgumentParser, argparse._ActionsContainer,
+                argparse._SubParsersAction, argparse.Action)):
+                raise _Unresolvable()
+
+            try:
+                args, kwargs = self.eval_arguments(node, scope, building=True)
+            except _Unresolvable:
+                raise StaticEvaluationError('Cannot resolve arguments of `%s` in line %d' % (func.attr, node.lineno))
+
+            r = getattr(obj, func.attr)(*args, **kwargs)
+            if func.attr == 'add_parser':
+                self.parsers.append(r)
+                self.subparsers.append(r)
+            return r
+
+        callee = self.eval(func, scope)
+
+        if isinstance(callee, _Function):
+            return self.call_function(callee, node, scope)
+
+        if any(callee is f for f in _builtins.values()):
+            args, kwargs = self.eval_arguments(node, scope, building=False)
+            return callee(*args, **kwargs)
+
+        return self.call_argparse(callee, node, scope)
+
+    def call_argparse(self, callee, node, scope):
+        if not (isinstance(callee, type) and callee.__module__ == 'argparse'):
+            raise _Unresolvable()
+
+        try:
+            args, kwargs = self.eval_arguments(node, scope, building=True)
+        except _Unresolvable:
+            raise StaticEvaluationError('Cannot resolve arguments of `%s` in line %d' % (callee.__name__, node.lineno))
+
+        r = callee(*args, **kwargs)
+        if isinstance(r, argparse.ArgumentParser):
+            self.parsers.append(r)
+        return r
+
+    def call_function(self, function, node, scope):
+        if self.depth >= _max_call_depth:
+            raise _Unresolvable()
+
+        fnode = function.node
+        local_scope = {}
+
+        # Bind positional and keyword arguments, unknown arguments stay unknown
+        params = [a.arg for a in fnode.args.posonlyargs + fnode.args.args]
+        defaults = fnode.args.defaults
+        for param, default in zip(params[len(params) - len(defaults):], defaults):
+            try:    local_scope[param] = self.eval(default, function.scope)
+            except _Unresolvable: local_scope[param] = UNKNOWN
+        for param in params:
+            local_scope.setdefault(param, UNKNOWN)
+        for param in fnode.args.kwonlyargs:
+            local_scope[param.arg] = UNKNOWN
+
+        for param, arg in zip(params, node.args):
+            try:    local_scope[param] = self._eval(arg, scope)
+            except _Unresolvable: local_scope[param] = UNKNOWN
+        for keyword in node.keywords:
+            if keyword.arg is not None:
+                try:    local_scope[keyword.arg] = self._eval(keyword.value, scope)
+                except _Unresolvable: local_scope[keyword.arg] = UNKNOWN
+
+        # Names not found in the local scope are looked up in the defining scope
+        class Scope(dict):
+            def __missing__(self, key):
+                return function.scope[key]
+            def __contains__(self, key):
+                return dict.__contains__(self, key) or key in function.scope
+
+        self.depth += 1
+        try:
+            self.exec_body(fnode.body, Scope(local_scope))
+        except _Return as r:
+            return r.value
+        finally:
+            self.depth -= 1
+
+        return None
+
+    # =========================================================================
+    # Result
+    # =========================================================================
+
+    def find_ArgumentParser(self, scope, parser_variable=None):
+        if parser_variable:
+            parser = scope.get(parser_variable)
+            if isinstance(parser, argparse.ArgumentParser):
+                return parser
+            raise StaticEvaluationError('Could not resolve parser variable `%s`' % parser_variable)
+
+        found_parsers = [p for p in self.parsers if not any(p is s for s in self.subparsers)]
+
+        if len(found_parsers) == 1:
+            return found_parsers[0]
+        elif len(found_parsers) > 1:
+            for parser in found_parsers:
+                if parser._subparsers is not None:
+                    return parser
+
+        raise StaticEvaluationError('No ArgumentParser found')
+
+def load_parser(file, parser_variable=None):
+    ''' Return the ArgumentParser defined in `file` without executing it '''
+
+    with open(file, 'r') as fh:
+        source = fh.read()
+
+    try:
+        tree = ast.parse(source, file)
+    except SyntaxError as e:
+        raise StaticEvaluationError(str(e))
+
+    evaluator = _Evaluator(file)
+    scope = evaluator.globals
+
+    try:
+        evaluator.exec_body(tree.body, scope)
+    except StaticEvaluationError:
+        raise
+    except (_Unresolvable, _Return):
+        raise StaticEvaluationError('Unexpected statement in module body')
+    except Exception as e:
+        # Calls to argparse may fail (e.g. conflicting option strings)
+        raise StaticEvaluationError('%s: %s' % (type(e).__name__, e))
+
+    return evaluator.find_ArgumentParser(scope, parser_variable)
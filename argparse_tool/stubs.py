@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+
+''' Replace modules by lazy placeholders while loading a program.
+
+Most of the time needed for importing a program is spent on importing
+libraries that are not needed for building its ArgumentParser. While
+`stub_modules()` is active, importing one of the given modules returns a
+placeholder module instead. Every use of a placeholder object (attribute
+access, call, indexing, iteration, arithmetic) is recorded, so parsers that
+really depend on a stubbed module can be spotted. Looking up a name in a
+placeholder module (e.g. `from numpy import x`) is not a use by itself.
+'''
+
+import sys, importlib.abc, importlib.machinery, types, contextlib
+
+# Modules stubbed by `auto`
+auto_modules = [
+    'numpy', 'pandas', 'scipy', 'matplotlib', 'sklearn', 'torch', 'tensorflow',
+    'keras', 'jax', 'transformers', 'dask', 'pyspark', 'cv2', 'PIL', 'boto3',
+    'botocore', 'sqlalchemy', 'psycopg2', 'pymysql', 'MySQLdb', 'pymongo', 'redis',
+]
+
+def parse_modules(s):
+    ''' Parse a comma separated list of modules, `auto` is replaced by `auto_modules` '''
+    modules = []
+    for module in s.split(','):
+        module = module.strip()
+        if module == 'auto':
+            modules.extend(auto_modules)
+        elif module:
+            modules.append(module)
+    return modules
+
+# Dunder attributes commonly read while importing (e.g. for version checks),
+# other dunders raise AttributeError as usual
+_dunder_placeholders = {
+    '__version__': '0.0.0',
+    '__file__':    '',
+    '__path__':    (),
+    '__all__':     (),
+}
+
+def _get_dunder(attr):
+    try:
+        return _dunder_placeholders[attr]
+    except KeyError:
+        raise AttributeError(attr) from None
+
+class Stub:
+    ''' Placeholder for any object of a stubbed module '''
+
+    def __init__(self, name, touched):
+        object.__setattr__(self, '_stub_name', name)
+        object.__setattr__(self, '_stub_touched', touched)
+
+    def _stub_use(self, name):
+        self._stub_touched.add(name)
+        return Stub(name, self._stub_touched)
+
+    def __getattr__(self, attr):
+        if attr.startswith('__') and attr.endswith('__'):
+            return _get_dunder(attr)
+        return self._stub_use('%s.%s' % (self._stub_name, attr))
+
+    def __setattr__(self, attr, value):
+        pass
+
+    def __call__(self, *a, **kw):
+        return self._stub_use(self._stub_name + '()')
+
+    def __getitem__(self, key):
+        return self._stub_use(self._stub_name + '[]')
+
+    def __iter__(self):
+        self._stub_touched.add(self._stub_name)
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+    def __bool__(self):
+        return True
+
+    def __mro_entries__(self, bases):
+        # Allows `class Foo(stubbed_module.Bar)`
+        return (object,)
+
+    def __repr__(self):
+        return '<stub %s>' % self._stub_name
+
+def _binary_operator(self, *a):
+    self._stub_touched.add(self._stub_name)
+    return self
+
+for _op in ('add', 'sub', 'mul', 'truediv', 'floordiv', 'mod', 'pow', 'and', 'or', 'xor', 'matmul'):
+    setattr(Stub, '__%s__' % _op, _binary_operator)
+    setattr(Stub, '__r%s__' % _op, _binary_operator)
+
+class StubModule(types.ModuleType):
+    def __init__(self, name, touched):
+        super().__init__(name)
+        self.__path__ = []
+        self._stub_touched = touched
+
+    def __getattr__(self, attr):
+        # Not recorded, `from module import name` ends up here
+        if attr.startswith('__') and attr.endswith('__'):
+            return _get_dunder(attr)
+        return Stub('%s.%s' % (self.__name__, attr), self._stub_touched)
+
+class _StubLoader(importlib.abc.Loader):
+    def __init__(self, touched):
+        self.touched = touched
+
+    def create_module(self, spec):
+        return StubModule(spec.name, self.touched)
+
+    def exec_module(self, module):
+        pass
+
+class StubFinder(importlib.abc.MetaPathFinder):
+    def __init__(self, modules, touched):
+        self.modules = modules
+        self.loader = _StubLoader(touched)
+
+    def find_spec(self, fullname, path=None, target=None):
+        for module in self.modules:
+            if fullname == module or fullname.startswith(module + '.'):
+                return importlib.machinery.ModuleSpec(fullname, self.loader, is_package=True)
+        return None
+
+@contextlib.contextmanager
+def stub_modules(modules):
+    ''' Stub `modules` (and their submodules) while the context is active.
+
+    Yields the set of touched names.
+    '''
+
+    touched = set()
+    finder = StubFinder(modules, touched)
+    sys.meta_path.insert(0, finder)
+
+    try:
+        yield touched
+    finally:
+        sys.meta_path.remove(finder)
+        for name, module in list(sys.modules.items()):
+            if isinstance(module, StubModule):
+                del sys.modules[name]
@@ -1,6 +1,6 @@
 #!/usr/bin/python3
 
-import sys, argparse
+import os, sys, time, argparse, itertools, collections
 
 # =============================================================================
 # Utility functions
@@ -11,3 +11,159 @@ def action_complete(self, action, *a):
     return self
 
 argparse.Action.complete = action_complete
+
+# =============================================================================
+# Choices
+#
+# Choices may be any iterable (including `range` objects and generators) or a
+# callable returning one. They are never copied as a whole.
+# =============================================================================
+
+# Maximum number of choices written to a completion script
+MAX_CHOICES = 10000
+
+# Choice sets larger than this are written to a sorted file next to the
+# completion script (see `ChoiceFiles`), which may hold up to MAX_FILE_CHOICES
+MAX_SCRIPT_CHOICES = 1000
+MAX_FILE_CHOICES   = 1000000
+
+def resolve_choices(choices):
+    ''' Return the choices, callables are called to get them '''
+    if callable(choices):
+        return choices()
+    return choices
+
+def is_iterator(choices):
+    ''' Return True if `choices` can be iterated only once '''
+    return not callable(choices) and iter(choices) is choices
+
+def take_choices(choices, max_choices=None):
+    ''' Iterate over the first `max_choices` (default: MAX_CHOICES) choices '''
+    if max_choices is None:
+        max_choices = MAX_CHOICES
+
+    it = iter(resolve_choices(choices))
+    yield from itertools.islice(it, max_choices)
+    for _ in it:
+        print('Warning: Only the first %d choices are used' % max_choices, file=sys.stderr)
+        break
+
+def take_range(r, max_choices=None):
+    ''' Return the first `max_choices` (default: MAX_CHOICES) numbers of the range `r` '''
+    if max_choices is None:
+        max_choices = MAX_CHOICES
+
+    if len(r) > max_choices:
+        print('Warning: Only the first %d choices are used' % max_choices, file=sys.stderr)
+    return r[:max_choices]
+
+def get_choice_items(choices, max_choices=None):
+    ''' Return the first `max_choices` choices as (value, description) pairs '''
+    choices = resolve_choices(choices)
+    if hasattr(choices, 'items'):
+        return [(str(v), d) for v, d in take_choices(choices.items(), max_choices)]
+    return [(str(c), None) for c in take_choices(choices, max_choices)]
+
+class ChoiceFiles:
+    ''' Large choice sets written to sorted files.
+
+    The files are written to `directory` (typically PROG.choices next to
+    the completion script) and named FORMAT-N. Equal sets are written once.
+    The lines are sorted by their bytes, as expected by `look(1)`.
+    '''
+    def __init__(self, directory, format):
+        self.directory = directory
+        self.format = format
+        self.files = {} # tuple of lines -> file name
+
+    def add(self, lines):
+        ''' Write `lines` to a file, return the file name relative to `directory` '''
+        lines = tuple(sorted(set(lines), key=lambda l: l.encode()))
+        try:
+            return self.files[lines]
+        except KeyError:
+            name = self.files[lines] = '%s-%d' % (self.format, len(self.files))
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, name), 'w') as fh:
+                fh.write(''.join(line + '\n' for line in lines))
+            return name
+
+def get_choice_files(fh, program_name, format, enabled=True):
+    ''' Return the ChoiceFiles of a script written to `fh`.
+
+    Returns None if `enabled` is False or `fh` is not a regular file (e.g.
+    stdout), the choices are written to the script then.
+    '''
+    if not enabled:
+        return None
+    name = getattr(fh, 'name', None)
+    if not isinstance(name, str) or not os.path.isfile(name):
+        return None
+    return ChoiceFiles(os.path.join(os.path.dirname(name), program_name + '.choices'), format)
+
+def limit_choices(choices, max_choices=16):
+    ''' Return a list of at most `max_choices` items, '...' marks omitted choices '''
+    choices = resolve_choices(choices)
+    half = max_choices // 2
+
+    if isinstance(choices, (range, list, tuple)):
+        if len(choices) > max_choices:
+            return list(choices[0:half]) + ['...'] + list(choices[-half:])
+        return list(choices)
+
+    it = iter(choices)
+    head = list(itertools.islice(it, max_choices + 1))
+    if len(head) <= max_choices:
+        return head
+
+    # Iterables of unknown size may be endless, only the head is shown
+    if not hasattr(choices, '__len__'):
+        return head[0:max_choices] + ['...']
+
+    # Other containers are consumed keeping only the head and the tail
+    tail = collections.deque(head[half:], maxlen=half)
+    tail.extend(it)
+    return head[0:half] + ['...'] + list(tail)
+
+# =============================================================================
+# Python completions
+#
+# `.complete('python', function, *args)` completes by `function(word, *args)`.
+# The function is given as function object or as string 'module:function'.
+# =============================================================================
+
+# Names of the modules that programs were loaded as (see loader.py). Importing
+# them again would run the program, or fail if it was loaded from a temporary copy.
+program_modules = set()
+
+def get_function_name(function):
+    ''' Return 'module:function' of a `python` completion, None if it cannot be imported by name '''
+    if isinstance(function, str):
+        module, _, qualname = function.partition(':')
+    else:
+        module, qualname = getattr(function, '__module__', None), getattr(function, '__qualname__', '')
+
+    # Functions of the program itself, lambdas and nested functions
+    if not module or module == '__main__' or module in program_modules or not qualname or '<' in qualname:
+        return None
+    return '%s:%s' % (module, qualname)
+
+class Timings:
+    ''' Measures the duration of named stages '''
+    def __init__(self):
+        self.stages = []
+
+    def measure(self, name, func, *a, **kw):
+        start = time.perf_counter()
+        try:
+            return func(*a, **kw)
+        finally:
+            self.stages.append((name, time.perf_counter() - start))
+
+    def total(self):
+        return sum(seconds for _, seconds in self.stages)
+
+    def report(self, file=sys.stderr):
+        for name, seconds in self.stages:
+            print('%-12s %8.3fs' % (name, seconds), file=file)
+        print('%-12s %8.3fs' % ('total', self.total()), file=file)
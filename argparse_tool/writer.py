@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+
+import contextlib
+
+class Writer:
+    ''' Output stream used by the backends.
+
+    Text is either written directly to the file object `fh` or collected in
+    a list, which is joined only once by `getvalue()`.
+    '''
+
+    def __init__(self, fh=None, indent='  '):
+        self.fh = fh
+        self.parts = []
+        self.indent_string = indent
+        self.level = 0
+
+        if fh is not None:
+            self.write = fh.write
+        else:
+            self.write = self.parts.append
+
+    def line(self, s=''):
+        ''' Write `s` as an indented line '''
+        if s:
+            self.write(self.indent_string * self.level + s + '\n')
+        else:
+            self.write('\n')
+
+    @contextlib.contextmanager
+    def indent(self, levels=1):
+        self.level += levels
+        try:
+            yield self
+        finally:
+            self.level -= levels
+
+    def getvalue(self):
+        ''' Return the collected output, None if the output was written to a file '''
+        if self.fh is not None:
+            return None
+        return ''.join(self.parts)
@@ -1,19 +1,184 @@
 #!/usr/bin/python3
 
-import argparse, sys
-from . import shell, utils
+import argparse, sys, os, subprocess
+from . import shell, utils, writer
+
+# Choice lists longer than this are stored in an array and completed by _describe
+MAX_INLINE_CHOICES = 16
+
+# Commands storing all candidates of a completion in $reply: completion -> (tag, code).
+# Used by `ZshCompleter.cached`.
+LISTS = {
+    'command':  ('commands',  'reply=(${(k)commands})'),
+    'group':    ('groups',    'reply=(${${(f)"$(_call_program groups getent group)"}%%:*})'),
+    'hostname': ('hosts',     'reply=(${=${${(f)"$(_call_program hosts getent hosts)"}#*[[:blank:]]}})'),
+    'pid':      ('pids',      'reply=(${=$(_call_program pids ps -A -o pid=)})'),
+    'process':  ('processes', 'reply=(${(f)"$(_call_program processes ps -A -o comm=)"})'),
+    'user':     ('users',     'reply=(${${(f)"$(_call_program users getent passwd)"}%%:*})'),
+}
+
+# Defined only once if multiple programs use it.
+# `_argparse_tool_cached_1 TAG TTL CODE` completes the words CODE stores in
+# $reply. They are kept in the file `argparse_tool_TAG` of the cache-path
+# (default ~/.zcompcache), which is valid for TTL seconds unless the
+# `cache-policy` style names another policy. Nothing is cached if the
+# `use-cache` style is set to false. The styles are only read, so the
+# cache works without `use-cache` being enabled.
+CACHE_RUNTIME = r"""(( $+functions[_argparse_tool_cached_1] )) || {
+_argparse_tool_cache_policy_1() {
+  local -a fresh
+  fresh=( $1(Nms-$_argparse_tool_ttl) )
+  (( ! $#fresh ))
+}
+
+_argparse_tool_cached_1() {
+  local tag=$1 _argparse_tool_ttl=$2 use policy dir file expl
+  local -a reply
+  zstyle -s ":completion:${curcontext}:" use-cache use || use=yes
+  zstyle -s ":completion:${curcontext}:" cache-policy policy || policy=_argparse_tool_cache_policy_1
+  zstyle -s ":completion:${curcontext}:" cache-path dir || dir=${ZDOTDIR:-$HOME}/.zcompcache
+  file=$dir/argparse_tool_$tag
+  if [[ $use != (yes|true|on|1) ]]; then
+    eval "$3"
+  elif [[ ! -f $file ]] || $policy $file || ! source $file; then
+    eval "$3"
+    mkdir -p $dir 2>/dev/null && print -r -- "reply=(${(@qq)reply})" >| $file
+  fi
+  _wanted $tag expl $tag compadd -a reply
+}
+}
+"""
+
+# Defined only once if multiple programs use it.
+# `_argparse_tool_lines_1 ARRAY FILE` completes the lines of FILE
+# ('value:description', as expected by _describe). The file is read into
+# the global ARRAY on the first use.
+LINES_RUNTIME = r"""(( $+functions[_argparse_tool_lines_1] )) || {
+_argparse_tool_lines_1() {
+  if (( ! $+parameters[$1] )); then
+    typeset -ga $1
+    set -A $1 "${(@f)$(<$2)}"
+  fi
+  _describe choice $1
+}
+}
+"""
+
+# Defined only once if multiple programs use it.
+# `_argparse_tool_python_1 FUNCTION ARGS` completes the candidates that the
+# completion daemon (see daemon.py) returns for $PREFIX, using zsh's own
+# socket module. If the daemon is not running it is started in the
+# background, nothing is completed then.
+PYTHON_RUNTIME = r"""(( $+functions[_argparse_tool_python_1] )) || {
+_argparse_tool_python_1() {
+  local socket=${ARGPARSE_TOOL_SOCKET:-${XDG_RUNTIME_DIR:-/tmp/argparse-tool-$UID}/argparse-tool.sock}
+  local fd line expl
+  local -a candidates
+  if [[ ! -S $socket ]]; then
+    (( $+commands[argparse-tool] )) && argparse-tool daemon --socket $socket </dev/null &>/dev/null &!
+    return 1
+  fi
+
+  zmodload -F zsh/net/socket b:zsocket 2>/dev/null && zsocket $socket 2>/dev/null || return 1
+  fd=$REPLY
+  print -r -u $fd -- "complete"$'\t'"$1"$'\t'"$2"$'\t'"$PREFIX"
+  while IFS= read -t 2 -r -u $fd line; do
+    candidates+=("$line")
+  done
+  exec {fd}>&-
+  _wanted values expl value compadd -a candidates
+}
+}
+"""
+
+class Arrays:
+    ''' Named arrays that are written once and used by multiple functions.
+
+    An array is identified by its elements, which are shell words as they
+    are written to the script. Equal arrays get the same name.
+    '''
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.arrays = {} # tuple of elements -> name
+
+    def get(self, elements):
+        ''' Return the name of the array holding `elements` '''
+        elements = tuple(elements)
+        try:
+            return self.arrays[elements]
+        except KeyError:
+            name = self.arrays[elements] = '%s_a%d' % (self.prefix, len(self.arrays))
+            return name
+
+    def write(self, out, indent=''):
+        for elements, name in self.arrays.items():
+            out.write(f'{indent}typeset -ga {name}\n')
+            out.write(f'{indent}{name}=(\n')
+            for element in elements:
+                out.write(f'{indent}  {element}\n')
+            out.write(f'{indent})\n')
+
+def describe(arrays, tag, items):
+    # Return the action completing `items` ((value, description) pairs) by _describe
+    elements = []
+    for value, desc in items:
+        if desc:
+            elements.append(shell.escape('%s:%s' % (escape_colon(str(value)), desc)))
+        else:
+            elements.append(shell.escape(escape_colon(str(value))))
+    return shell.escape('{_describe %s %s}' % (tag, arrays.get(elements)))
 
 class ZshCompleter(shell.ShellCompleter):
+    # If `arrays` is given, long choice lists are stored in arrays.
+    # If `files` (utils.ChoiceFiles) is given, large choice sets are written
+    # to files in the directory named by the shell variable `directory`.
+
+    def __init__(self, arrays=None, files=None, directory=None):
+        self.arrays = arrays
+        self.files = files
+        self.choices_dir = directory
+
     def none(self):
         return "'()'"
 
+    def cached(self, ttl, completion, *a):
+        if completion not in LISTS:
+            print("Warning: ZshCompleter: `%s` cannot be cached" % completion, file=sys.stderr)
+            return self.complete(completion, *a)
+        tag, code = LISTS[completion]
+        return shell.escape('{_argparse_tool_cached_1 %s %d %s}' % (tag, ttl, shell.escape(code)))
+
     def choices(self, choices):
+        choices = utils.resolve_choices(choices)
+        if self.files is not None:
+            items = utils.get_choice_items(choices, utils.MAX_FILE_CHOICES)
+            if len(items) > utils.MAX_SCRIPT_CHOICES:
+                return self.choices_file(items)
+        elif hasattr(choices, 'items'):
+            items = list(utils.take_choices(choices.items()))
+        else:
+            items = [(c, None) for c in utils.take_choices(choices)]
+
+        if self.arrays is not None and len(items) > MAX_INLINE_CHOICES:
+            return describe(self.arrays, 'choice', items)
+
         if hasattr(choices, 'items'):
             return shell.escape('((%s))' % ' '.join(
-                shell.escape('%s\\:%s' % (str(val), desc)) for val, desc in choices.items()
+                shell.escape('%s\\:%s' % (str(val), desc)) for val, desc in items
             ))
         else:
-            return shell.escape("(%s)" % (' '.join(shell.escape(str(c)) for c in choices)))
+            return shell.escape("(%s)" % (' '.join(shell.escape(str(c)) for c, _ in items)))
+
+    def choices_file(self, items):
+        lines = []
+        for value, desc in items:
+            if desc:
+                lines.append('%s:%s' % (escape_colon(value), ' '.join(str(desc).split())))
+            else:
+                lines.append(escape_colon(value))
+        name = self.files.add(lines)
+        array = shell.make_identifier('%s_%s' % (self.choices_dir, name))
+        return shell.escape('{_argparse_tool_lines_1 %s "$%s"/%s}' % (array, self.choices_dir, name))
 
     def command(self):
         return '_command_names'
@@ -43,10 +208,13 @@ class ZshCompleter(shell.ShellCompleter):
         return '_process_names'
 
     def range(self, range):
+        if not range:
+            return self.none()
+        range = utils.take_range(range)
         if range.step == 1:
-            return f"'({{{range.start}..{range.stop}}})'"
+            return f"'({{{range.start}..{range[-1]}}})'"
         else:
-            return f"'({{{range.start}..{range.stop}..{range.step}}})'"
+            return f"'({{{range.start}..{range[-1]}..{abs(range.step)}}})'"
 
     def user(self):
         return '_users'
@@ -54,6 +222,12 @@ class ZshCompleter(shell.ShellCompleter):
     def variable(self):
         return '_vars'
 
+    def python(self, function, *args):
+        request = shell.python_request(function, args)
+        if request is None:
+            return self.fallback('python', 'none')
+        return shell.escape('{_argparse_tool_python_1 %s %s}' % tuple(shell.escape(s) for s in request))
+
 
 complete = ZshCompleter().complete
 
@@ -71,7 +245,7 @@ def make_argument_option_spec(
     # '(--option -o)'{--option=,-o+}'[Option description]':Metavar:'action'
 
     # Any literal colon in an optname, message, or action must be preceded by a backslash, `\:'.
-    conflicting_arguments = [escape_colon(s) for s in sorted(conflicting_arguments + option_strings)]
+    conflicting_arguments = [escape_colon(s) for s in sorted(conflicting_arguments + list(option_strings))]
     option_strings        = [escape_colon(s) for s in sorted(option_strings)]
     description           = escape_colon('['+description+']') if description else ''
     metavar               = escape_colon(metavar)
@@ -95,7 +269,7 @@ def make_argument_option_spec(
 
     return f'{conflicting_arguments}{option_strings}{description}:{metavar}:{action}'
 
-def complete_option(option):
+def complete_option(option, complete=complete):
     return make_argument_option_spec(
         option.option_strings,
         conflicting_arguments = option.get_conflicting_options(),
@@ -104,61 +278,195 @@ def complete_option(option):
         metavar = option.metavar,
         action = complete(*option.complete))
 
-def complete_subparsers(option):
-    choices = {}
+def complete_subparsers(option, arrays):
+    items = []
     for name, subparser in option.subcommands.items():
-        choices[name] = subparser.help
-    return ":command:" + complete('choices', choices)
-    #return "':command:%s'" % shell.make_subparser_identifier(parser.prog)
+        for n in option.get_names(name):
+            items.append((n, subparser.help))
+    return ":command:" + describe(arrays, 'command', items)
 
-def complete_positional(option):
-    return ":%s:%s" % (
+def complete_positional(option, complete=complete):
+    spec = ":%s:%s" % (
         shell.escape(escape_colon(option.help)) if option.help else '',
         complete(*option.complete))
 
-def generate_completion_function(options, funcname):
-    args = []
-    trailing_functions = ''
-    r =  f'{funcname}() {{\n'
-
-    for option in options.get_options():
-        args.append(complete_option(option))
-
-    for option in options.get_positionals():
-        args.append(complete_positional(option))
-
-    if options.get_subparsers_option():
-        args.append(complete_subparsers(options.get_subparsers_option()))
-        args.append("'*::arg:->args'")
+    if option.nargs == '?':
+        return ':' + spec
+    if option.get_positional_count() is None:
+        # Quoted, with `nullglob` set an unquoted `*:...` would be removed
+        return "'*'" + spec
+    return ' '.join([spec] * option.get_positional_count())
+
+class Function:
+    ''' The completion function of a parser '''
+    def __init__(self, name):
+        self.name         = name
+        self.option_specs = []
+        self.other_specs  = [] # positionals and subcommands
+        self.dispatch     = [] # (case pattern, function name)
+
+def collect_functions(options, funcname, arrays, files=None):
+    ''' Return the completion functions of `options` and its subcommands.
+
+    Each parser gets one function, also if it is used by multiple subcommands.
+    Option specs that are shared by multiple functions are moved to arrays.
+    Large choice sets are written to `files` (utils.ChoiceFiles) if given,
+    their directory is stored in the variable FUNCNAME_choices.
+    '''
+    complete = ZshCompleter(arrays, files, funcname + '_choices').complete
+    functions = {} # id(Options) -> function name
+    result = []
+    todo = [(options, funcname)]
+
+    while todo:
+        parser, name = todo.pop(0)
+        function = Function(name)
+        result.append(function)
+
+        for option in parser.get_options():
+            function.option_specs.append(complete_option(option, complete))
+
+        for option in parser.get_positionals():
+            function.other_specs.append(complete_positional(option, complete))
+
+        subparsers = parser.get_subparsers_option()
+        if subparsers:
+            function.other_specs.append(complete_subparsers(subparsers, arrays))
+            function.other_specs.append("'*::arg:->args'")
+
+            for subname, subparser in subparsers.subcommands.items():
+                sub_funcname = functions.get(id(subparser))
+                if sub_funcname is None:
+                    sub_funcname = functions[id(subparser)] = shell.make_identifier(f'_{name}_{subname}')
+                    todo.append((subparser, sub_funcname))
+                function.dispatch.append(('|'.join(subparsers.get_names(subname)), sub_funcname))
+
+    # Specs used by multiple functions (typically options inherited from a parent parser)
+    # are stored in arrays, if the same set of them is used by multiple functions.
+    spec_count = {}
+    for function in result:
+        for spec in function.option_specs:
+            spec_count[spec] = spec_count.get(spec, 0) + 1
+
+    shared = {}
+    for function in result:
+        key = tuple(spec for spec in function.option_specs if spec_count[spec] > 1)
+        shared[key] = shared.get(key, 0) + 1
+
+    for function in result:
+        key = tuple(spec for spec in function.option_specs if spec_count[spec] > 1)
+        if key and shared[key] > 1:
+            own = [spec for spec in function.option_specs if spec_count[spec] == 1]
+            function.option_specs = ['"${%s[@]}"' % arrays.get(key)] + own
+
+    return result
+
+def write_function_body(function, out, autoload=False):
+    # If `autoload` is True, subcommand functions are autoloaded before they are called.
+    args = function.option_specs + function.other_specs
 
     if len(args):
-        r += '  _arguments \\\n    %s\n' % '\\\n    '.join(args)
-
-    if options.get_subparsers_option():
-        r += '  for w in $line; do\n'
-        r += '    case $w in\n'
-        for name, subparser in options.get_subparsers_option().subcommands.items():
-            sub_funcname = shell.make_identifier(f'_{funcname}_{name}')
-            trailing_functions += generate_completion_function(subparser, sub_funcname)
-            r += f'      ({name}) {sub_funcname}; break;;\n'
-        r += '    esac\n'
-        r += '  done\n'
-    r += '}\n\n'
-
-    return r + trailing_functions
-
-def generate_completion(options, program_name=None):
+        out.write('  _arguments \\\n    %s\n' % '\\\n    '.join(args))
+
+    if function.dispatch:
+        out.write('  for w in $line; do\n')
+        out.write('    case $w in\n')
+        for pattern, sub_funcname in function.dispatch:
+            if autoload:
+                out.write(f'      ({pattern}) autoload -Uz {sub_funcname}; {sub_funcname}; break;;\n')
+            else:
+                out.write(f'      ({pattern}) {sub_funcname}; break;;\n')
+        out.write('    esac\n')
+        out.write('  done\n')
+
+def write_choices_directory(out, funcname, program_name):
+    # The choice files are located relative to the file defining the function
+    out.write('typeset -g %s_choices=${${(%%):-%%x}:A:h}/%s\n' % (funcname, shell.escape(program_name + '.choices')))
+    out.write(LINES_RUNTIME + '\n')
+
+def generate_completion(options, program_name=None, fh=None, choice_files=False):
+    ''' Return the zsh completion script, write it to `fh` if given.
+
+    If `choice_files` is True, large choice sets are written to files next
+    to the script (see utils.get_choice_files).
+    '''
     if program_name is None:
         program_name = options.prog
 
+    out = writer.Writer(fh)
     completion_funcname = '_' + shell.make_identifier(program_name)
-    completion_functions = generate_completion_function(options, completion_funcname)
-
-    return f'''\
-#compdef {program_name}
-
-{completion_functions.rstrip()}
-
-{completion_funcname} "$@"
-'''
+    arrays = Arrays(completion_funcname)
+    files = utils.get_choice_files(fh, program_name, 'zsh', choice_files)
+    functions = collect_functions(options, completion_funcname, arrays, files)
+
+    out.write(f'#compdef {program_name}\n\n')
+    if files and files.files:
+        write_choices_directory(out, completion_funcname, program_name)
+    if shell.uses_completion(options, {'cached'}):
+        out.write(CACHE_RUNTIME + '\n')
+    if shell.uses_completion(options, {'python'}):
+        out.write(PYTHON_RUNTIME + '\n')
+    if arrays.arrays:
+        arrays.write(out)
+        out.write('\n')
+
+    for function in functions:
+        out.write(f'{function.name}() {{\n')
+        write_function_body(function, out)
+        out.write('}\n\n')
+
+    out.write(f'{completion_funcname} "$@"\n')
+    return out.getvalue()
+
+def generate_completion_files(options, program_name=None, outdir='.', zcompile=False, choice_files=False):
+    ''' Write the completion as one autoloadable function file per (sub)command.
+
+    `outdir` is meant to be a directory in $fpath. The file of the program
+    (`_prog`, tagged with #compdef) is found by compinit, the functions of
+    subcommands are autoloaded when they are reached. The shared arrays are
+    defined by `_prog` on its first call. If `zcompile` is True, the files
+    are compiled to wordcode (FILE.zwc). If `choice_files` is True, large
+    choice sets are written to files in `outdir/prog.choices`.
+    Returns the list of written files.
+    '''
+    if program_name is None:
+        program_name = options.prog
 
+    os.makedirs(outdir, exist_ok=True)
+    funcname = '_' + shell.make_identifier(program_name)
+    arrays = Arrays(funcname)
+    choices = utils.ChoiceFiles(os.path.join(outdir, program_name + '.choices'), 'zsh') if choice_files else None
+    files = []
+
+    for function in collect_functions(options, funcname, arrays, choices):
+        files.append(os.path.join(outdir, function.name))
+        with open(files[-1], 'w') as fh:
+            out = writer.Writer(fh)
+            if function.name == funcname:
+                out.write(f'#compdef {program_name}\n\n')
+                if choices and choices.files:
+                    write_choices_directory(out, funcname, program_name)
+                if shell.uses_completion(options, {'cached'}):
+                    out.write(CACHE_RUNTIME + '\n')
+                if shell.uses_completion(options, {'python'}):
+                    out.write(PYTHON_RUNTIME + '\n')
+                if arrays.arrays:
+                    out.write(f'if (( ! $+{funcname}_a0 )); then\n')
+                    arrays.write(out, '  ')
+                    out.write('fi\n\n')
+            write_function_body(function, out, autoload=True)
+
+    if zcompile:
+        compile_files(files)
+
+    return files
+
+def compile_files(files):
+    ''' Compile the function files `files` to wordcode using zsh's `zcompile` '''
+    script = 'for f in "$@"; do zcompile -Uz "$f" || exit 1; done'
+    try:
+        subprocess.run(['zsh', '-fc', script, 'zsh'] + list(files), check=True)
+    except FileNotFoundError:
+        raise Exception('Cannot compile the files, zsh is not installed') from None
+    except subprocess.CalledProcessError as e:
+        raise Exception('Cannot compile the files, zcompile failed (exit status %d)' % e.returncode) from None
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+''' Measure `argparse-tool complete` and enforce its startup budget.
+
+Writes the index of a program, then runs `argparse-tool complete INDEX`
+for a few command lines and reports the wall time and the number of
+imported modules. Exits with 1 if the median of a command line exceeds
+the budget or if argparse or the argparse_tool package got imported.
+'''
+
+import sys, os, re, time, argparse, tempfile, subprocess, statistics
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+p = argparse.ArgumentParser(description='Measure the completion runtime of argparse-tool')
+p.add_argument('lines', nargs='*', default=[
+    'argparse-tool-test --',
+    'argparse-tool-test --choices ',
+    'argparse-tool-test positionals first1 ',
+    'argparse-tool-test --signal ',
+])
+p.add_argument('--program', default=os.path.join(root, 'argparse-tool-test'), help='Program file to load')
+p.add_argument('--runs', default=20, type=int, help='Number of runs per command line')
+p.add_argument('--budget', default=30, type=float, help='Maximum median time in milliseconds [default: 30]')
+opts = p.parse_args()
+
+env = dict(os.environ, PYTHONPATH=root)
+tool = os.path.join(root, 'argparse-tool')
+
+def run(line, *python_args):
+    cmd = [sys.executable, *python_args, tool, 'complete', index]
+    e = dict(env, COMP_LINE=line, COMP_POINT=str(len(line)))
+    start = time.perf_counter()
+    r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, env=e)
+    wall = time.perf_counter() - start
+    if r.returncode:
+        sys.stderr.write(r.stderr)
+        raise Exception('%r failed' % line)
+    return wall, r
+
+with tempfile.TemporaryDirectory() as tmp:
+    index = os.path.join(tmp, 'prog.index')
+    subprocess.run([sys.executable, tool, 'index', opts.program, '-o', index], env=env, check=True)
+
+    failed = False
+    print('%-45s %10s %8s %11s' % ('command line', 'wall [ms]', 'modules', 'candidates'))
+    for line in opts.lines:
+        walls = [run(line)[0] * 1000 for i in range(opts.runs)]
+
+        _, r = run(line, '-X', 'importtime')
+        modules = [m.group(1) for m in re.finditer(r'^import time:.*\| *(\S+)$', r.stderr, re.M)]
+        heavy = [m for m in modules if m == 'argparse' or m == 'argparse_tool' or m.startswith('argparse_tool.')]
+
+        median = statistics.median(walls)
+        print('%-45s %10.1f %8d %11d' % (line, median, len(modules), len(r.stdout.splitlines())))
+        if median > opts.budget:
+            print('  exceeds the budget of %.0f ms' % opts.budget)
+            failed = True
+        if heavy:
+            print('  imports %s' % ' '.join(heavy))
+            failed = True
+
+sys.exit(1 if failed else 0)
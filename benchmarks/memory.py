@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+
+''' Measure the memory used by the Options model.
+
+Builds an ArgumentParser with many subcommands that inherit the options of
+a common parent parser, converts it to an Options tree and reports the
+memory allocated by the tree before and after `Options.freeze()`.
+'''
+
+import sys, os, gc, time, argparse, tracemalloc
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from argparse_tool import options
+
+p = argparse.ArgumentParser(description='Measure the memory used by the Options model')
+p.add_argument('--subcommands', default=2000, type=int, help='Number of subcommands')
+p.add_argument('--inherited',   default=7,    type=int, help='Number of options inherited by each subcommand')
+p.add_argument('--own',         default=3,    type=int, help='Number of own options of each subcommand')
+opts = p.parse_args()
+
+def make_parser():
+    parent = argparse.ArgumentParser(add_help=False)
+    for i in range(opts.inherited):
+        parent.add_argument('--common-%d' % i, help='Common option %d' % i, choices=('a', 'b', 'c'))
+
+    parser = argparse.ArgumentParser('prog')
+    subparsers = parser.add_subparsers()
+    for i in range(opts.subcommands):
+        sub = subparsers.add_parser('cmd-%d' % i, help='Command %d' % i, parents=[parent])
+        for j in range(opts.own):
+            sub.add_argument('--own-%d' % j, help='Own option %d of command %d' % (j, i))
+        sub.add_argument('file', help='Input file')
+    return parser
+
+def count(tree, seen):
+    for o in tree.options:
+        seen.add(id(o))
+    if tree.subparsers:
+        for sub in tree.subparsers.subcommands.values():
+            count(sub, seen)
+    return seen
+
+parser = make_parser()
+gc.collect()
+
+tracemalloc.start()
+start = time.perf_counter()
+tree = options.ArgumentParser_to_Options(parser).finalize()
+convert = time.perf_counter() - start
+gc.collect()
+unfrozen = tracemalloc.get_traced_memory()[0]
+unfrozen_objects = len(count(tree, set()))
+
+start = time.perf_counter()
+tree.freeze()
+freeze = time.perf_counter() - start
+gc.collect()
+frozen = tracemalloc.get_traced_memory()[0]
+frozen_objects = len(count(tree, set()))
+tracemalloc.stop()
+
+print('%-10s %12s %10s %10s' % ('model', 'memory [KiB]', 'options', 'time [ms]'))
+print('%-10s %12.0f %10d %10.1f' % ('unfrozen', unfrozen / 1024, unfrozen_objects, convert * 1000))
+print('%-10s %12.0f %10d %10.1f' % ('frozen',   frozen / 1024,   frozen_objects,   freeze * 1000))
+print('reduction: %.1f%%' % (100 - 100 * frozen / unfrozen))
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+
+''' Measure the startup cost of `argparse-tool` for each action.
+
+Runs `python -X importtime argparse-tool ACTION PROGRAM` and reports the
+wall time, the number of imported modules, the cumulative import time and
+the argparse_tool modules that got imported.
+'''
+
+import sys, os, re, time, argparse, subprocess, statistics
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+p = argparse.ArgumentParser(description='Measure the startup cost of argparse-tool')
+p.add_argument('actions', nargs='*', default=['bash', 'zsh', 'fish', 'printf', 'markdown', 'json'])
+p.add_argument('--program', default=os.path.join(root, 'argparse-tool-test'), help='Program file to load')
+p.add_argument('--runs', default=5, type=int, help='Number of runs per action')
+opts = p.parse_args()
+
+def run(action):
+    cmd = [sys.executable, '-X', 'importtime', os.path.join(root, 'argparse-tool'), action, opts.program, '-o', os.devnull]
+    env = dict(os.environ, PYTHONPATH=root)
+    start = time.perf_counter()
+    r = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, env=env)
+    wall = time.perf_counter() - start
+
+    modules, import_us = [], 0
+    for line in r.stderr.splitlines():
+        m = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)', line)
+        if m:
+            modules.append(m.group(4))
+            if len(m.group(3)) == 1: # top level import
+                import_us += int(m.group(2))
+
+    return wall, modules, import_us
+
+print('%-10s %10s %10s %8s  %s' % ('action', 'wall [ms]', 'imp [ms]', 'modules', 'argparse_tool modules'))
+for action in opts.actions:
+    walls, imports = [], []
+    for i in range(opts.runs):
+        wall, modules, import_us = run(action)
+        walls.append(wall * 1000)
+        imports.append(import_us / 1000)
+
+    own = sorted(m.split('.', 1)[1] for m in modules if m.startswith('argparse_tool.'))
+    print('%-10s %10.1f %10.1f %8d  %s' % (
+        action, statistics.median(walls), statistics.median(imports), len(modules), ' '.join(own)))
@@ -0,0 +1,4 @@
+import os, sys
+
+# The tests run against the package of this checkout
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
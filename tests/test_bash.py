@@ -0,0 +1,231 @@
+import io, os, sys, argparse, shutil, subprocess, textwrap, pytest
+from argparse_tool import bash
+from argparse_tool.options import ArgumentParser_to_Options
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Sources a completion script and prints the candidates for each command line
+# read from stdin, using a minimal `_init_completion` of bash-completion.
+# Words are separated by spaces only, `--opt=value` is one word as it is
+# after `_init_completion` joined the words split at COMP_WORDBREAKS.
+# A trailing space starts a new, empty word. Lines starting with '!' are
+# evaluated as shell code instead.
+HARNESS = r'''
+shopt -s extglob
+_init_completion() {
+  words=("${COMP_WORDS[@]}"); cword=$COMP_CWORD; cur=${words[cword]}; prev=${words[cword-1]}; split=false
+  if [[ $1 == -s && $cur == --?*=* ]]; then
+    prev=${cur%%=*}; cur=${cur#*=}; split=true
+  fi
+}
+complete() { :; }
+source "$1"
+while IFS= read -r line; do
+  if [[ $line == '!'* ]]; then
+    eval "${line:1}"
+    continue
+  fi
+  read -r -a COMP_WORDS <<< "$line"
+  [[ $line == *' ' ]] && COMP_WORDS+=("")
+  COMP_CWORD=$(( ${#COMP_WORDS[@]} - 1 )); COMPREPLY=()
+  "$2"
+  echo "${COMPREPLY[*]}"
+done
+'''
+
+def run_bash(tmp_path, script, lines, function='_prog'):
+    ''' Return the output of HARNESS for `lines`, `script` is the content or a Path of the script '''
+    if not shutil.which('bash'):
+        pytest.skip('bash is not installed')
+    if isinstance(script, str):
+        (tmp_path / 'script.bash').write_text(script)
+        script = tmp_path / 'script.bash'
+    (tmp_path / 'harness.bash').write_text(HARNESS)
+    p = subprocess.run(['bash', str(tmp_path / 'harness.bash'), str(script), function],
+        input=''.join(line + '\n' for line in lines), capture_output=True, text=True, check=True)
+    return p.stdout.split('\n')[:-1]
+
+def generate(parser, generator=bash.generate_completion):
+    out = io.StringIO()
+    generator(ArgumentParser_to_Options(parser).freeze(), 'prog', out)
+    return out.getvalue()
+
+def test_aliases_dispatch_to_one_function():
+    root = argparse.ArgumentParser('prog')
+    commands = root.add_subparsers()
+    commands.add_parser('run', aliases=['r']).add_argument('--fast', action='store_true')
+
+    out = io.StringIO()
+    bash.generate_completion(ArgumentParser_to_Options(root).freeze(), 'prog', out)
+    script = out.getvalue()
+    assert script.count('_prog_run() {') == 1
+    assert "['_prog run']=_prog_run" in script
+    assert "['_prog r']=_prog_run" in script
+
+def test_large_range_is_cut_off(tmp_path):
+    root = argparse.ArgumentParser('prog')
+    root.add_argument('--num', type=int, choices=range(0, 10**9), metavar='N')
+    root.add_argument('--even', type=int, choices=range(10**9, 0, -2), metavar='N')
+
+    for generator in (bash.generate_completion, bash.generate_table_completion):
+        script = generate(root, generator)
+        assert '{0..9999' in script
+        assert '{1000000000..999980002..2}' in script
+        assert '999999999' not in script
+
+    assert run_bash(tmp_path, generate(root), ['prog --num 999', 'prog --even 5', 'prog --even 1']) == [
+        '999 9990 9991 9992 9993 9994 9995 9996 9997 9998 9999', '', '1000000000']
+
+def test_split_files_are_sourced_lazily(tmp_path):
+    root = argparse.ArgumentParser('prog')
+    root.add_argument('--verbose', action='store_true')
+    commands = root.add_subparsers()
+    run = commands.add_parser('run', aliases=['r'])
+    run.add_argument('--fast', action='store_true')
+    run.add_subparsers().add_parser('now').add_argument('--force', action='store_true')
+    commands.add_parser('stop').add_argument('--kill', action='store_true')
+
+    outdir = tmp_path / 'out'
+    files = bash.generate_completion_files(ArgumentParser_to_Options(root).freeze(), 'prog', str(outdir))
+    assert [os.path.relpath(f, outdir) for f in files] == [
+        'prog.bash', 'prog.d/_prog_run.bash', 'prog.d/_prog_stop.bash', 'prog.d/_prog_run_now.bash']
+
+    loaded = "!declare -F | grep -o '_prog_[a-z_]*$' | tr '\\n' ' '; echo"
+    assert run_bash(tmp_path, outdir / 'prog.bash', [
+        loaded,
+        'prog --',
+        'prog ',
+        loaded,
+        'prog r --',
+        loaded,
+        'prog run now --',
+        loaded,
+    ]) == [
+        '',
+        '--help --verbose',
+        'run r stop',
+        '',
+        '--help --fast',
+        '_prog_run ',
+        '--help --force',
+        '_prog_run _prog_run_now ',
+    ]
+
+def test_table_completion_behaves_like_bash(tmp_path):
+    root = argparse.ArgumentParser('prog')
+    root.add_argument('-v', '--verbose', action='store_true')
+    root.add_argument('-o', '--output', choices=['json', 'yaml'])
+    root.add_argument('--level', type=int, choices=range(1, 12, 2))
+    commands = root.add_subparsers()
+    run = commands.add_parser('run', aliases=['r'])
+    run.add_argument('--fast', action='store_true')
+    run.add_subparsers().add_parser('now').add_argument('--force', action='store_true')
+    stop = commands.add_parser('stop')
+    stop.add_argument('files', nargs='*', choices=['a.txt', 'b.txt'])
+
+    expected = {
+        'prog -':                '--help -h -v --verbose -o --output --level',
+        'prog --output ':        'json yaml',
+        'prog --output=y':       'yaml',
+        'prog -vo ':             'json yaml',
+        'prog -vo j':            'json',
+        'prog -o json ':         'run r stop',
+        'prog --level ':         '1 3 5 7 9 11',
+        'prog --level 1':        '1 11',
+        'prog --level=3 r ':     'now',
+        'prog r':                'run r',
+        'prog r --':             '--help --fast',
+        'prog -v r --fast ':     'now',
+        'prog r now --':         '--help --force',
+        'prog run now ':         '',
+        'prog stop ':            'a.txt b.txt',
+        'prog stop a.txt b':     'b.txt',
+        'prog -vo json stop -':  '--help -h',
+    }
+    lines = list(expected)
+
+    assert run_bash(tmp_path, generate(root), lines) == list(expected.values())
+    assert run_bash(tmp_path, generate(root, bash.generate_table_completion), lines) == list(expected.values())
+
+def test_cached_is_refreshed_after_ttl(tmp_path):
+    root = argparse.ArgumentParser('prog')
+    root.add_argument('--var').complete('cached', 60, 'variable')
+
+    expire = '!_argparse_tool_cache_time_1[variable]=$(( _argparse_tool_cache_time_1[variable] - 60 ))'
+    for generator in (bash.generate_completion, bash.generate_table_completion):
+        assert run_bash(tmp_path, generate(root, generator), [
+            '!cached_test_a=1',
+            'prog --var cached_test_',
+            '!cached_test_b=1',
+            # The memo is used, filtered by the current word
+            'prog --var cached_test_',
+            'prog --var cached_test_b',
+            expire,
+            'prog --var cached_test_',
+        ]) == [
+            'cached_test_a',
+            'cached_test_a',
+            '',
+            'cached_test_a cached_test_b',
+        ]
+
+def test_choice_files_are_opt_in(tmp_path):
+    program = tmp_path / 'choice_files_prog.py'
+    program.write_text(textwrap.dedent('''
+        import argparse
+        p = argparse.ArgumentParser('prog')
+        p.add_argument('--item', choices=['item%04d' % i for i in range(2000)], metavar='ITEM')
+    '''))
+
+    def run(*args):
+        subprocess.run([sys.executable, os.path.join(ROOT, 'argparse-tool'), 'bash', str(program)] + list(args),
+            check=True)
+
+    run('-o', str(tmp_path / 'prog.bash'))
+    assert not (tmp_path / 'prog.choices').exists()
+    assert 'item1999' in (tmp_path / 'prog.bash').read_text()
+
+    run('-o', str(tmp_path / 'prog.bash'), '--choice-files')
+    assert os.listdir(tmp_path / 'prog.choices') == ['bash-0']
+    assert 'item1999' not in (tmp_path / 'prog.bash').read_text()
+
+LOOK = '''#!/bin/sh
+echo "$@" >> %(log)s
+shift
+exec %(awk)s -v p="$1" 'index($0, p) == 1' "$2"
+'''
+
+def test_choice_files_lookup(tmp_path):
+    # `look` is replaced by a script logging its arguments, the fallback
+    # is tested using a directory containing only awk
+    look_bin, awk_bin, log = tmp_path / 'look-bin', tmp_path / 'awk-bin', tmp_path / 'look.log'
+    look_bin.mkdir()
+    awk_bin.mkdir()
+    (look_bin / 'look').write_text(LOOK % {'log': log, 'awk': shutil.which('awk')})
+    (look_bin / 'look').chmod(0o755)
+    (awk_bin / 'awk').symlink_to(shutil.which('awk'))
+
+    root = argparse.ArgumentParser('prog')
+    root.add_argument('--item', choices=['item%04d' % i for i in range(2000)], metavar='ITEM')
+    expected = ' '.join('item%d' % i for i in range(1990, 2000))
+
+    for generator in (bash.generate_completion, bash.generate_table_completion):
+        script = tmp_path / 'out' / 'prog.bash'
+        script.parent.mkdir(exist_ok=True)
+        with open(script, 'w') as fh:
+            generator(ArgumentParser_to_Options(root).freeze(), 'prog', fh, choice_files=True)
+        choice_file = str(next((tmp_path / 'out' / 'prog.choices').iterdir()))
+
+        assert run_bash(tmp_path, script, [
+            '!PATH=%s' % look_bin,
+            'prog --item item199',
+            '!PATH=%s' % awk_bin,
+            'prog --item item199',
+            "!echo ${#COMPREPLY[@]}",
+            'prog --item ',
+            "!echo ${#COMPREPLY[@]}",
+        ]) == [expected, expected, '10', ' '.join(root._actions[1].choices), '2000']
+
+        assert log.read_text() == '-- item199 %s\n' % choice_file
+        log.unlink()
+        shutil.rmtree(tmp_path / 'out')
@@ -0,0 +1,120 @@
+import os, sys, textwrap, subprocess
+from argparse_tool import bulk
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+programs = {
+    'good': '''
+        import argparse
+        p = argparse.ArgumentParser('good')
+        p.add_argument('--flag', action='store_true')
+    ''',
+    'named': '''
+        import argparse
+        other = argparse.ArgumentParser('ignored')
+        p = argparse.ArgumentParser('ignored')
+        other.add_argument('--other')
+    ''',
+    'raises': '''
+        raise ValueError('broken program')
+    ''',
+    'exits': '''
+        import sys
+        sys.exit(3)
+    ''',
+    'hangs': '''
+        while True:
+            pass
+    ''',
+    # Patches a module at import time ...
+    'patcher': '''
+        import argparse, json
+        json.patched_by_patcher = True
+        p = argparse.ArgumentParser('patcher')
+    ''',
+    # ... which must not be seen by a program running after it
+    'victim': '''
+        import argparse, json
+        p = argparse.ArgumentParser('victim')
+        if hasattr(json, 'patched_by_patcher'):
+            p.add_argument('--leaked')
+    ''',
+}
+
+def write_manifest(tmp_path, lines):
+    for name, source in programs.items():
+        (tmp_path / (name + '.py')).write_text(textwrap.dedent(source))
+    manifest = tmp_path / 'manifest'
+    manifest.write_text('\n'.join(str(tmp_path / line) for line in lines) + '\n')
+    return manifest
+
+def test_parse_manifest(tmp_path):
+    manifest = tmp_path / 'manifest'
+    manifest.write_text('# comment\n\nprog.py\nprog.py:parser\nprog.py::name\nprog.py:parser:name\n')
+    jobs = bulk.parse_manifest(manifest)
+    assert [(j.program_file, j.parser_variable, j.program_name) for j in jobs] == [
+        ('prog.py', None, None),
+        ('prog.py', 'parser', None),
+        ('prog.py', None, 'name'),
+        ('prog.py', 'parser', 'name')]
+    assert repr(jobs[3]) == 'prog.py:parser:name'
+
+    manifest.write_text('a:b:c:d\n')
+    try:
+        bulk.parse_manifest(manifest)
+        assert False
+    except Exception as e:
+        assert 'Invalid manifest line' in str(e)
+
+def test_run(tmp_path):
+    manifest = write_manifest(tmp_path, ['good.py', 'raises.py', 'named.py:other:named', 'exits.py', 'hangs.py'])
+    outdir = tmp_path / 'out'
+
+    results = bulk.run(bulk.parse_manifest(manifest), ['bash', 'json'], str(outdir), max_workers=2, timeout=1)
+
+    # Results are returned in manifest order
+    assert [os.path.basename(r.job.program_file) for r in results] == [
+        'good.py', 'raises.py', 'named.py', 'exits.py', 'hangs.py']
+    assert [r.error for r in results] == [
+        None,
+        'ValueError: broken program',
+        None,
+        'SystemExit: 3',
+        'Timeout: Timeout exceeded']
+
+    assert sorted(os.listdir(outdir)) == ['good.bash', 'good.json', 'named.bash', 'named.json']
+    assert '--flag' in (outdir / 'good.bash').read_text()
+    assert '--other' in (outdir / 'named.bash').read_text()
+
+    stages = [stage for stage, _ in results[0].timings.stages]
+    assert stages[-2:] == ['bash', 'json']
+
+def test_isolation(tmp_path):
+    # With a single worker both programs run one after the other, each
+    # in a fresh process.
+    manifest = write_manifest(tmp_path, ['patcher.py', 'victim.py'])
+    outdir = tmp_path / 'out'
+
+    results = bulk.run(bulk.parse_manifest(manifest), ['bash'], str(outdir), max_workers=1)
+    assert [r.error for r in results] == [None, None]
+    assert '--leaked' not in (outdir / 'victim.bash').read_text()
+
+def test_worker_killed(tmp_path):
+    (tmp_path / 'killer.py').write_text('import os\nos._exit(1)\n')
+    manifest = write_manifest(tmp_path, ['killer.py', 'good.py'])
+    outdir = tmp_path / 'out'
+
+    results = bulk.run(bulk.parse_manifest(manifest), ['bash'], str(outdir), max_workers=2)
+    assert [r.error for r in results] == ['Worker process terminated abruptly', None]
+    assert os.listdir(outdir) == ['good.bash']
+
+def test_command_line(tmp_path):
+    manifest = write_manifest(tmp_path, ['good.py', 'raises.py'])
+    outdir = tmp_path / 'out'
+
+    p = subprocess.run([sys.executable, os.path.join(ROOT, 'argparse-tool'), 'bulk', str(manifest),
+        '--format=bash', '--outdir', str(outdir), '--timeout=5'], capture_output=True, text=True)
+    assert p.returncode == 1
+    assert '2 programs, 1 failed' in p.stderr
+    assert 'raises.py: ValueError: broken program' in p.stderr
+    assert os.listdir(outdir) == ['good.bash']
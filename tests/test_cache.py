@@ -0,0 +1,77 @@
+import os, textwrap
+from argparse_tool import cache, loader, serialize, utils
+
+def write(path, source):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(textwrap.dedent(source))
+    return str(path)
+
+def load(program, cache_dir, **kw):
+    ''' Return the tree and the names of the stages that were run '''
+    timings = utils.Timings()
+    tree = loader.load_options(program, cache_dir=str(cache_dir), timings=timings, **kw)
+    return tree, [name for name, _ in timings.stages]
+
+def make_program(tmp_path, name):
+    # Imported programs stay in sys.modules, their names must be unique
+    write(tmp_path / 'pkg' / '__init__.py', '')
+    write(tmp_path / 'pkg' / 'common.py', 'from . import helper\n')
+    write(tmp_path / 'pkg' / 'helper.py', 'X = 1\n')
+    return write(tmp_path / (name + '.py'), '''
+        import argparse
+        from pkg import common
+        p = argparse.ArgumentParser('prog')
+        p.add_argument('--a', choices=['x', 'y'])
+    ''')
+
+def test_local_imports(tmp_path):
+    program = make_program(tmp_path, 'imports_prog')
+    assert cache.local_imports(program) == sorted(
+        str(tmp_path / 'pkg' / name) for name in ('__init__.py', 'common.py', 'helper.py'))
+
+def test_lookup(tmp_path):
+    program = make_program(tmp_path, 'lookup_prog')
+    cache_dir = tmp_path / 'cache'
+
+    tree, stages = load(program, cache_dir)
+    assert stages == ['cache', 'load', 'convert']
+    cached, stages = load(program, cache_dir)
+    assert stages == ['cache']
+    assert serialize.to_dict(cached) == serialize.to_dict(tree)
+
+    # Changing a transitively imported local module invalidates the entry
+    write(tmp_path / 'pkg' / 'helper.py', 'X = 2\n')
+    assert load(program, cache_dir)[1] == ['cache', 'load', 'convert']
+    assert load(program, cache_dir)[1] == ['cache']
+
+def test_key_includes_options(tmp_path):
+    program = make_program(tmp_path, 'key_prog')
+    cache_dir = tmp_path / 'cache'
+    load(program, cache_dir)
+
+    # Static extraction and importing the program may give different trees
+    assert load(program, cache_dir, use_static=True)[1] == ['cache', 'load', 'convert']
+    assert load(program, cache_dir, use_static=True)[1] == ['cache']
+    assert load(program, cache_dir, help_text=True)[1] == ['cache', 'load', 'convert']
+    assert load(program, cache_dir, parser_variable='p')[1] == ['cache', 'load', 'convert']
+    assert len(os.listdir(cache_dir)) == 4
+
+def test_broken_entry(tmp_path):
+    program = make_program(tmp_path, 'broken_prog')
+    cache_dir = tmp_path / 'cache'
+    load(program, cache_dir)
+    for name in os.listdir(cache_dir):
+        (cache_dir / name).write_bytes(b'garbage')
+    assert cache.get(str(cache_dir), 'missing') is None
+    assert load(program, cache_dir)[1] == ['cache', 'load', 'convert']
+
+def test_callable_choices_are_not_cached(tmp_path):
+    program = write(tmp_path / 'callable_choices.py', '''
+        import argparse
+        p = argparse.ArgumentParser('prog')
+        p.add_argument('--a').complete('choices', lambda: ['x'])
+    ''')
+    cache_dir = tmp_path / 'cache'
+    assert load(program, cache_dir)[1] == ['cache', 'load', 'convert']
+    assert load(program, cache_dir)[1] == ['cache', 'load', 'convert']
+    assert not cache_dir.exists() or not os.listdir(cache_dir)
@@ -0,0 +1,73 @@
+import os, time, socket, marshal, textwrap, threading, pytest
+from argparse_tool import daemon, loader, index, shell
+
+def keys(word, *extra):
+    return ['alpha', 'beta', 'gamma'] + list(extra)
+
+def fail(word):
+    raise ValueError(word)
+
+def test_handle_request():
+    assert daemon.handle_request('complete\t%s:keys\t()\tb' % __name__) == ['beta']
+    assert daemon.handle_request("complete\t%s:keys\t('bx',)\tb" % __name__) == ['beta', 'bx']
+    assert daemon.handle_request('complete\t%s:fail\t()\tb' % __name__) == []
+    assert daemon.handle_request('complete\tno_such_module:keys\t()\t') == []
+    with pytest.raises(Exception):
+        daemon.handle_request('complete\tmodule:keys')
+
+def query(path, request):
+    s = socket.socket(socket.AF_UNIX)
+    s.connect(path)
+    s.sendall(request.encode())
+    s.shutdown(socket.SHUT_WR)
+    response = b''
+    while True:
+        data = s.recv(4096)
+        if not data:
+            break
+        response += data
+    s.close()
+    return response.decode()
+
+def test_serve(tmp_path):
+    path = str(tmp_path / 'run' / 'argparse-tool.sock')
+    umask = os.umask(0o022)
+    try:
+        thread = threading.Thread(target=daemon.serve, args=(path, 0.5))
+        thread.start()
+        while not os.path.exists(path):
+            time.sleep(0.01)
+
+        assert query(path, 'complete\t%s:keys\t()\ta\n' % __name__) == 'alpha\n'
+        assert query(path, 'invalid\n') == ''
+
+        # Another daemon for the same socket exits at once
+        assert daemon.serve(path) is False
+        thread.join()
+    finally:
+        os.umask(umask)
+    assert not os.path.exists(path)
+
+def test_program_local_function(tmp_path, capsys):
+    (tmp_path / 'local_helpers.py').write_text('def keys(word):\n    return []\n')
+    for name in ('local_prog.py', 'local_prog_noext'):
+        (tmp_path / name).write_text(textwrap.dedent('''
+            import argparse, local_helpers
+            def keys(word):
+                return []
+            p = argparse.ArgumentParser('prog')
+            p.add_argument('--local').complete('python', keys)
+            p.add_argument('--helper').complete('python', local_helpers.keys)
+        '''))
+
+        tree = loader.load_options(str(tmp_path / name))
+        local, helper = tree.get_option('--local'), tree.get_option('--helper')
+
+        # Importing the program's module would run the program again
+        assert shell.python_request(*local.complete[1:2], ()) is None
+        assert shell.python_request(*helper.complete[1:2], ()) == ('local_helpers:keys', '()')
+
+        completions = marshal.loads(index.generate_index(tree))[2]
+        assert ('none',) in completions
+        assert ('python', 'local_helpers', 'keys', ()) in completions
+        assert all(c[0] != 'python' or c[1] == 'local_helpers' for c in completions)
@@ -0,0 +1,153 @@
+import io, os, re, argparse, shutil, subprocess, pytest
+from argparse_tool import fish
+from argparse_tool.options import ArgumentParser_to_Options
+from test_bash import LOOK
+
+def generate(parser, generator=fish.generate_completion):
+    out = io.StringIO()
+    generator(ArgumentParser_to_Options(parser).freeze(), 'prog', out)
+    return out.getvalue()
+
+def make_parser():
+    root = argparse.ArgumentParser('prog')
+    root.add_argument('-v', '--verbose', action='store_true', help='Be verbose')
+    root.add_argument('-o', '--output', choices=['json', 'yaml'])
+    commands = root.add_subparsers()
+    run = commands.add_parser('run', aliases=['r'], help='Run it')
+    run.add_argument('--fast', action='store_true')
+    run.add_subparsers().add_parser('now').add_argument('--force', action='store_true')
+    stop = commands.add_parser('stop')
+    stop.add_argument('files', nargs='*', choices=['a.txt', 'b.txt'])
+    return root
+
+def get_switch(script, function):
+    ''' Return the `case` lines of `function` and their code as a dict '''
+    body = script.split('function %s\n' % function)[1].split('\nend\n')[0]
+    cases, key = {}, ''
+    for line in body.split('\n'):
+        if line.startswith('        case ') or key.endswith('\\'):
+            key = (key[:-1] + line.strip()) if key.endswith('\\') else line[13:]
+            if not key.endswith('\\'):
+                cases[key] = []
+        elif line.startswith('            '):
+            cases[key].append(line.strip())
+    return cases
+
+def test_dispatch_shape():
+    script = generate(make_parser(), fish.generate_dispatch_completion)
+
+    assert re.findall('^function (\\S+)', script, re.M) == [
+        '__prog_takes_arg', '__prog_optarg', '__prog_opts', '__prog_sub', '__prog_pos', '__prog_complete']
+    assert script.endswith("complete -c prog -e\ncomplete -c prog -f -a '(__prog_complete)'\n")
+
+    assert get_switch(script, '__prog_takes_arg') == {"'0 -o' '0 --output'": ['return 0']}
+    assert get_switch(script, '__prog_optarg') == {"'0 -o' '0 --output'": ["printf '%s\\n' json yaml"]}
+    assert get_switch(script, '__prog_sub') == {
+        "'1 2 now'":             ['echo 2'],
+        "'0 1 run' '0 1 r'":     ['echo 1'],
+        "'0 1 stop'":            ['echo 3'],
+    }
+    assert get_switch(script, '__prog_pos') == {
+        "'1 2'": ["printf '%s\\n' now", 'return'],
+        "'0 1'": ["printf '%s\\t%s\\n' run 'Run it' r 'Run it' stop ''", 'return'],
+        '3':     ["test $argv[2] -ge 2 && printf '%s\\n' 'a.txt' 'b.txt'"],
+    }
+
+    opts = get_switch(script, '__prog_opts')
+    assert list(opts) == ['0', '1', '2', '3']
+    assert "-v 'Be verbose' --verbose 'Be verbose'" in opts['0'][0]
+
+def test_dispatch_case_patterns():
+    root = argparse.ArgumentParser('prog')
+    commands = root.add_subparsers()
+    shared = commands.add_parser('a*', aliases=['b?'] + ['c%d' % i for i in range(10)])
+    shared.add_argument('--x', action='store_true')
+
+    script = generate(root, fish.generate_dispatch_completion)
+    sub = get_switch(script, '__prog_sub')
+    # All aliases share one case, which is wrapped after 8 patterns
+    assert sub == {' '.join("'0 1 %s'" % p for p in ['a\\\\*', 'b\\\\?'] + ['c%d' % i for i in range(10)]): ['echo 1']}
+    assert "'0 1 c5' \\\n             '0 1 c6'" in script
+
+def run_fish(tmp_path, script, lines, path=None):
+    ''' Return the candidates of `script` (the content or a Path) for each command line in `lines` '''
+    fish = shutil.which('fish')
+    if not fish:
+        pytest.skip('fish is not installed')
+    if isinstance(script, str):
+        (tmp_path / 'script.fish').write_text(script)
+        script = tmp_path / 'script.fish'
+    env = dict(os.environ, PATH=str(path or os.environ['PATH']))
+    out = []
+    for line in lines:
+        p = subprocess.run([fish, '--no-config', '-c', 'source $argv[1]; complete -C $argv[2]',
+            str(script), line], capture_output=True, text=True, check=True, env=env)
+        out.append(' '.join(l.split('\t')[0] for l in p.stdout.split('\n') if l))
+    return out
+
+def test_dispatch_under_fish(tmp_path):
+    expected = {
+        'prog --output ':       'json yaml',
+        'prog --output=y':      '--output=yaml',
+        'prog -vo ':            'json yaml',
+        'prog ':                'run r stop',
+        'prog r --':            '--help --fast',
+        'prog run now --f':     '--force',
+        'prog stop a.txt ':     'a.txt b.txt',
+    }
+    assert run_fish(tmp_path, generate(make_parser(), fish.generate_dispatch_completion), list(expected)) == \
+        list(expected.values())
+
+def test_ranges():
+    root = argparse.ArgumentParser('prog')
+    root.add_argument('--small', type=int, choices=range(0, 20, 5))
+    root.add_argument('--num', type=int, choices=range(0, 10**9), metavar='N')
+    root.add_argument('--even', type=int, choices=range(10**9, 0, -2), metavar='N')
+
+    script = generate(root)
+    assert "-l small -a '0 5 10 15'" in script
+    assert "'(seq 0 9999)'" in script
+    assert "'(seq 1000000000 -2 999980002)'" in script
+
+    script = generate(root, fish.generate_dispatch_completion)
+    assert 'seq 0 9999\n' in script
+    assert 'seq 1000000000 -2 999980002\n' in script
+    assert '999999999' not in script
+
+def test_choice_files(tmp_path):
+    root = argparse.ArgumentParser('prog')
+    root.add_argument('--item', choices=['item%04d' % i for i in range(2000)], metavar='ITEM')
+    options = ArgumentParser_to_Options(root).freeze()
+
+    scripts = []
+    for i, generator in enumerate((fish.generate_completion, fish.generate_dispatch_completion)):
+        outdir = tmp_path / ('out%d' % i)
+        outdir.mkdir()
+        with open(outdir / 'prog.fish', 'w') as fh:
+            generator(options, 'prog', fh)
+        assert not (outdir / 'prog.choices').exists()
+
+        with open(outdir / 'prog.fish', 'w') as fh:
+            generator(options, 'prog', fh, choice_files=True)
+        assert os.listdir(outdir / 'prog.choices') == ['fish-0']
+        script = (outdir / 'prog.fish').read_text()
+        assert '__argparse_tool_look_1 $__prog_choices/fish-0' in script
+        assert 'item1999' not in script
+        scripts.append(outdir / 'prog.fish')
+
+    # `look` is replaced by a script logging its arguments, without it
+    # `string match` is used
+    look_bin, empty_bin, log = tmp_path / 'look-bin', tmp_path / 'empty-bin', tmp_path / 'look.log'
+    look_bin.mkdir()
+    empty_bin.mkdir()
+    (look_bin / 'look').write_text(LOOK % {'log': log, 'awk': shutil.which('awk')})
+    (look_bin / 'look').chmod(0o755)
+    (look_bin / 'env').symlink_to(shutil.which('env'))
+    expected = [' '.join('item%d' % i for i in range(1990, 2000))]
+
+    for script in scripts:
+        assert run_fish(tmp_path, script, ['prog --item item199'], path=look_bin) == expected
+        assert log.read_text() == '-- item199 %s\n' % (script.parent / 'prog.choices' / 'fish-0')
+        log.unlink()
+        assert run_fish(tmp_path, script, ['prog --item item199'], path=empty_bin) == expected
+        assert not log.exists()
@@ -0,0 +1,65 @@
+import os, sys, subprocess
+from argparse_tool import bulk, forkserver
+from test_bulk import ROOT, write_manifest
+
+def read_dir(directory):
+    return {name: (directory / name).read_text() for name in os.listdir(directory)}
+
+def test_same_as_bulk(tmp_path):
+    manifest = write_manifest(tmp_path, [
+        'good.py', 'raises.py', 'named.py:other:named', 'exits.py', 'hangs.py', 'patcher.py', 'victim.py'])
+    jobs = bulk.parse_manifest(manifest)
+    formats = ['bash', 'zsh', 'fish', 'json']
+
+    pool = bulk.run(jobs, formats, str(tmp_path / 'pool'), max_workers=2, timeout=1)
+    forked = forkserver.run(jobs, formats, str(tmp_path / 'forked'), max_workers=2, timeout=1)
+
+    assert [r.job for r in forked] == jobs
+    assert [r.error for r in forked] == [r.error for r in pool]
+    assert forked[4].error == 'Timeout: Timeout exceeded'
+    assert read_dir(tmp_path / 'forked') == read_dir(tmp_path / 'pool')
+    assert '--leaked' not in (tmp_path / 'forked' / 'victim.bash').read_text()
+
+def test_killed_child(tmp_path):
+    (tmp_path / 'killer.py').write_text('import os\nos._exit(1)\n')
+    manifest = write_manifest(tmp_path, ['killer.py', 'good.py'])
+
+    results = forkserver.run(bulk.parse_manifest(manifest), ['bash'], str(tmp_path / 'out'))
+    assert [r.error for r in results] == ['Child process terminated abruptly', None]
+
+def test_warm_modules(tmp_path, monkeypatch, capsys):
+    # The module records each import, it must be imported once by the
+    # server and not again by the children.
+    log = tmp_path / 'imports'
+    (tmp_path / 'forkserver_warm.py').write_text('open(%r, "a").write("x")\n' % str(log))
+    (tmp_path / 'user1.py').write_text(
+        'import argparse, forkserver_warm\np = argparse.ArgumentParser("user1")\n')
+    (tmp_path / 'user2.py').write_text(
+        'import argparse, forkserver_warm\np = argparse.ArgumentParser("user2")\n')
+    manifest = write_manifest(tmp_path, ['user1.py', 'user2.py'])
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    try:
+        results = forkserver.run(bulk.parse_manifest(manifest), ['bash'], str(tmp_path / 'out'),
+            warm_modules=['forkserver_warm', 'forkserver_missing'])
+    finally:
+        sys.modules.pop('forkserver_warm', None)
+
+    assert [r.error for r in results] == [None, None]
+    assert log.read_text() == 'x'
+    assert "could not preload `forkserver_missing`" in capsys.readouterr().err
+
+def test_command_line(tmp_path):
+    manifest = write_manifest(tmp_path, ['good.py', 'raises.py'])
+
+    def run(outdir, *args):
+        return subprocess.run([sys.executable, os.path.join(ROOT, 'argparse-tool'), 'bulk', str(manifest),
+            '--format=bash', '--format=man', '--outdir', str(tmp_path / outdir)] + list(args),
+            capture_output=True, text=True)
+
+    pool = run('pool')
+    forked = run('forked', '--fork-server', '--warm-modules=json,textwrap')
+    assert pool.returncode == forked.returncode == 1
+    assert 'raises.py: ValueError: broken program' in forked.stderr
+    assert read_dir(tmp_path / 'forked') == read_dir(tmp_path / 'pool')
+    assert sorted(os.listdir(tmp_path / 'forked')) == ['good.1', 'good.bash']
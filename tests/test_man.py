@@ -0,0 +1,84 @@
+import os, sys, argparse, warnings, subprocess, textwrap, concurrent.futures
+from argparse_tool import man
+from argparse_tool.options import ArgumentParser_to_Options
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def make_parser(n_commands=1):
+    root = argparse.ArgumentParser('prog', description='Root program')
+    root.add_argument('--verbose', action='store_true', help='Be verbose')
+    commands = root.add_subparsers()
+    run = commands.add_parser('run', aliases=['r'], help='Run it')
+    run.add_argument('--fast', action='store_true', help='Run fast')
+    run.add_subparsers().add_parser('now', help='Run now').add_argument('--force', action='store_true')
+    for i in range(n_commands - 1):
+        commands.add_parser('cmd%d' % i, help='Command %d' % i).add_argument('--opt%d' % i)
+    return root
+
+def test_source_date_epoch(monkeypatch):
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', '86399')
+    monkeypatch.setenv('TZ', 'Asia/Tokyo')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert man.ManPage.get_date() == '1970-01-01'
+
+def test_single_page_lists_subcommands():
+    page = man.generate_man(ArgumentParser_to_Options(make_parser()).freeze(), 'prog')
+    assert '.TH "PROG" 1' in page
+    assert '.IP "run, r"\nRun it' in page
+    assert '\\-\\-verbose' in page
+    # Options of subcommands are not part of the page
+    assert '\\-\\-fast' not in page
+    assert 'See \\fB' not in page
+
+def test_split(tmp_path):
+    program = tmp_path / 'split_prog.py'
+    program.write_text(textwrap.dedent('''
+        import argparse
+        p = argparse.ArgumentParser('prog')
+        commands = p.add_subparsers()
+        run = commands.add_parser('run', help='Run it')
+        run.add_argument('--fast', action='store_true')
+        run.add_subparsers().add_parser('now', help='Run now')
+        commands.add_parser('stop', help='Stop it')
+    '''))
+    outdir = tmp_path / 'out'
+
+    subprocess.run([sys.executable, os.path.join(ROOT, 'argparse-tool'), 'man', str(program),
+        '--split', '--outdir', str(outdir)], check=True)
+
+    assert sorted(os.listdir(outdir)) == ['prog-run-now.1', 'prog-run.1', 'prog-stop.1', 'prog.1']
+
+    root = (outdir / 'prog.1').read_text()
+    assert 'See \\fBprog\\-run\\fR(1).' in root
+    assert '.BR prog\\-run (1),\n.BR prog\\-stop (1)' in root
+
+    run = (outdir / 'prog-run.1').read_text()
+    assert '.TH "PROG-RUN" 1' in run
+    assert '.B prog run\n.I [OPTIONS]' in run
+    assert '\\-\\-fast' in run
+    assert '.BR prog (1),\n.BR prog\\-run\\-now (1)' in run
+
+    now = (outdir / 'prog-run-now.1').read_text()
+    assert '.BR prog\\-run (1)\n' in now
+
+def test_split_process_pool(tmp_path, monkeypatch):
+    tree = ArgumentParser_to_Options(make_parser(80)).freeze()
+
+    serial = man.generate_man_pages(tree, 'prog', str(tmp_path / 'serial'), jobs=1)
+    assert len(serial) >= 64
+
+    executors = []
+    class Executor(concurrent.futures.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            executors.append(args)
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', Executor)
+
+    pooled = man.generate_man_pages(tree, 'prog', str(tmp_path / 'pool'), jobs=2)
+    assert executors == [(2,)]
+    assert man._tree is None
+
+    assert [os.path.basename(f) for f in pooled] == [os.path.basename(f) for f in serial]
+    for a, b in zip(serial, pooled):
+        assert open(a).read() == open(b).read()
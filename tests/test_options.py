@@ -0,0 +1,112 @@
+import argparse, pytest
+from argparse_tool.options import Options, ArgumentParser_to_Options
+
+def positional_nums(options):
+    return [(o.option_strings[0], o.get_positional_num(), o.get_positional_count()) for o in options.positionals]
+
+def test_finalize_numbers():
+    options = Options('prog')
+    options.add(['src'])
+    options.add(['pair'], nargs=2)
+    options.add(['rest'], nargs='*')
+    options.finalize()
+    assert positional_nums(options) == [('src', 1, 1), ('pair', 2, 2), ('rest', 4, None)]
+
+def test_finalize_subcommands():
+    root = argparse.ArgumentParser('prog')
+    root.add_argument('file')
+    commands = root.add_subparsers()
+    commands.add_parser('run', help='Run').add_argument('target', nargs='+')
+
+    options = ArgumentParser_to_Options(root).finalize()
+    assert positional_nums(options) == [('file', 1, 1)]
+    assert (options.subparsers.get_positional_num(), options.subparsers.get_positional_count()) == (2, 1)
+    assert positional_nums(options.subparsers.subcommands['run']) == [('target', 3, None)]
+
+def test_finalize_subparser_reused_at_two_depths():
+    shared = argparse.ArgumentParser('shared', add_help=False)
+    shared.add_argument('target')
+
+    root = argparse.ArgumentParser('prog')
+    root.add_argument('file')
+    commands = root.add_subparsers()
+    group = commands.add_parser('group')
+    subcommands = group.add_subparsers()
+
+    # The same parser object is used by `prog FILE shared` and `prog FILE group shared`
+    commands.choices['shared'] = shared
+    subcommands.choices['shared'] = shared
+
+    options = ArgumentParser_to_Options(root).finalize()
+    top = options.subparsers.subcommands['shared']
+    nested = options.subparsers.subcommands['group'].subparsers.subcommands['shared']
+
+    assert top is not nested
+    assert positional_nums(top) == [('target', 3, 1)]
+    assert positional_nums(nested) == [('target', 4, 1)]
+    assert nested.parent is options.subparsers.subcommands['group']
+
+    # Finalizing again (as done by freeze()) keeps the numbers
+    options.freeze()
+    assert positional_nums(top) == [('target', 3, 1)]
+    assert positional_nums(nested) == [('target', 4, 1)]
+
+def test_finalize_subparser_shared_at_same_depth():
+    shared = argparse.ArgumentParser('shared', add_help=False)
+    shared.add_argument('target')
+
+    root = argparse.ArgumentParser('prog')
+    commands = root.add_subparsers()
+    for name in ('a', 'b'):
+        commands.add_parser(name).add_subparsers().choices['shared'] = shared
+
+    options = ArgumentParser_to_Options(root).finalize()
+    a, b = (options.subparsers.subcommands[name].subparsers.subcommands['shared'] for name in ('a', 'b'))
+    assert a is b
+    assert positional_nums(a) == [('target', 3, 1)]
+
+def make_aliased_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--verbose', action='store_true', help='Verbose')
+    root = argparse.ArgumentParser('prog', parents=[common])
+    commands = root.add_subparsers()
+    run = commands.add_parser('run', aliases=['r', 'x'], parents=[common], help='Run')
+    run.add_argument('--fast', action='store_true')
+    return root
+
+def test_aliases_share_one_parser():
+    options = ArgumentParser_to_Options(make_aliased_parser())
+    subparsers = options.get_subparsers_option()
+    assert list(subparsers.subcommands) == ['run']
+    assert list(subparsers.get_names('run')) == ['run', 'r', 'x']
+    assert subparsers.subcommands['run'].help == 'Run'
+
+def test_freeze():
+    options = ArgumentParser_to_Options(make_aliased_parser()).freeze()
+    run = options.subparsers.subcommands['run']
+
+    assert isinstance(options.options, tuple) and isinstance(run.positionals, tuple)
+    with pytest.raises(AttributeError):
+        options.prog = 'other'
+    with pytest.raises(AttributeError):
+        run.get_option('--fast').help = 'other'
+
+    # Equal options (here inherited through `parents=`) are shared, the
+    # option index points to the shared object
+    verbose = options.get_option('--verbose')
+    assert run.options[1] is verbose
+    assert run.get_option('--verbose') is verbose
+    assert verbose.parent is options
+
+    # Calling freeze() again does nothing
+    assert options.freeze() is options
+
+def test_exclusive_options_are_not_shared():
+    root = argparse.ArgumentParser('prog')
+    root.add_mutually_exclusive_group().add_argument('--a', action='store_true')
+    commands = root.add_subparsers()
+    sub = commands.add_parser('sub')
+    sub.add_mutually_exclusive_group().add_argument('--a', action='store_true')
+
+    options = ArgumentParser_to_Options(root).freeze()
+    assert options.get_option('--a') is not options.subparsers.subcommands['sub'].get_option('--a')
@@ -0,0 +1,130 @@
+import marshal, pytest
+from argparse_tool import runtime, index
+from argparse_tool.options import Options
+
+@pytest.mark.parametrize('line, words', [
+    ('prog',                 ['prog']),
+    ('prog ',                ['prog', '']),
+    ('prog  -a  --b',        ['prog', '-a', '--b']),
+    ('prog "a b" c',         ['prog', 'a b', 'c']),
+    ("prog 'a\\ b' \"c\\\"", ['prog', 'a\\ b', 'c"']),
+    ('prog a\\ b',           ['prog', 'a b']),
+    ("prog '",               ['prog', '']),
+    ('prog ""',              ['prog', '']),
+])
+def test_split_line(line, words):
+    assert runtime.split_line(line) == words
+
+def make_index():
+    options = Options('prog')
+    group = options.add_mutually_exclusive_group()
+    group.add_option(options.add(['-q', '--quiet'], takes_args=False))
+    group.add_option(options.add(['-v', '--verbose'], takes_args=False))
+    options.add(['-o', '--output'], complete=('choices', ['out1', 'out2']))
+    options.add(['src'], complete=('choices', ['s1', 's2']))
+
+    run = Options('run', parent=options)
+    run.add(['--level'], complete=('range', range(1, 4)))
+    run.add(['args'], nargs='*', complete=('choices', ['x1', 'x2']))
+    options.add_subparsers().add_options_object(run, 'run', ['r'])
+    options.finalize()
+    return marshal.loads(index.generate_index(options))
+
+def test_index_format():
+    magic, version, completions, parsers = make_index()
+    assert (magic, version) == (runtime.MAGIC, runtime.VERSION)
+    assert len(parsers) == 2
+
+    optargs, options, positionals, rest, subcommands, subpos = parsers[0]
+    assert completions[optargs['--output']] == completions[optargs['-o']] == ('choices', ('out1', 'out2'))
+    assert ('-q', ('-v', '--verbose')) in options
+    assert completions[positionals[1]] == ('choices', ('s1', 's2'))
+    assert completions[positionals[2]] == ('choices', ('run', 'r'))
+    assert (rest, subcommands, subpos) == (None, {'run': 1, 'r': 1}, 2)
+
+    optargs, options, positionals, rest, subcommands, subpos = parsers[1]
+    assert completions[optargs['--level']] == ('range', 1, 4, 1)
+    assert completions[rest[1]] == ('choices', ('x1', 'x2'))
+    # Arguments are numbered from the root on
+    assert rest[0] == 3 and subpos == 0
+
+def test_parse():
+    parsers = make_index()[3]
+    assert runtime.parse(parsers, ['prog', '']) == (0, 1, set(), None, False)
+    assert runtime.parse(parsers, ['prog', '-o', '']) == (0, 1, {'-o'}, '-o', False)
+    assert runtime.parse(parsers, ['prog', '--output=x', 's1', '']) == (0, 2, {'--output'}, None, False)
+    assert runtime.parse(parsers, ['prog', 's1', 'r', '--level', '2', 'a', '']) == (1, 4, {'--level'}, None, False)
+
+def test_parse_clusters():
+    parsers = make_index()[3]
+    assert runtime.parse(parsers, ['prog', '-qo', '']) == (0, 1, {'-q', '-o'}, '-o', False)
+    # The rest of the cluster is the argument of -o
+    assert runtime.parse(parsers, ['prog', '-ofoo', '']) == (0, 1, {'-o'}, None, False)
+    assert runtime.parse(parsers, ['prog', '-qoq', 's1', '']) == (0, 2, {'-q', '-o'}, None, False)
+    assert runtime.parse(parsers, ['prog', '-o=x', 's1', '']) == (0, 2, {'-o'}, None, False)
+    assert runtime.parse(parsers, ['prog', '-qv', 's1', '']) == (0, 2, {'-q', '-v'}, None, False)
+
+def test_parse_double_dash():
+    parsers = make_index()[3]
+    assert runtime.parse(parsers, ['prog', '--', '']) == (0, 1, set(), None, True)
+    assert runtime.parse(parsers, ['prog', '-q', '--', '-o', '--', '']) == (0, 3, {'-q'}, None, True)
+    assert runtime.parse(parsers, ['prog', '--', 's1', 'r', '']) == (1, 3, set(), None, True)
+
+@pytest.mark.parametrize('line, candidates', [
+    ('prog ',                    ['s1', 's2']),
+    ('prog --v',                 ['--verbose']),
+    ('prog -q --',               ['--quiet', '--output']),
+    ('prog --output ',           ['out1', 'out2']),
+    ('prog --output=o',          ['out1', 'out2']),
+    ('prog s1 ',                 ['run', 'r']),
+    ('prog s1 run --level ',     ['1', '2', '3']),
+    ('prog s1 r a x',            ['x1', 'x2']),
+    ('prog -qo ',                ['out1', 'out2']),
+    ('prog -ofoo ',              ['s1', 's2']),
+    ('prog -qo out1 --',         ['--quiet', '--output']),
+    ('prog -- ',                 ['s1', 's2']),
+    ('prog -- --o',              []),
+    ('prog -- --output=o',       []),
+    ('prog -- s1 ',              ['run', 'r']),
+])
+def test_get_candidates(line, candidates):
+    assert runtime.get_candidates(make_index(), runtime.split_line(line)) == candidates
+
+def test_complete_main(tmp_path, monkeypatch, capsys):
+    options = Options('prog')
+    options.add(['--key'], complete=('python', 'no_such_module:keys'))
+    options.add(['--name'], complete=('python', 'marshal:loads'))
+    options.finalize()
+    file = tmp_path / 'prog.index'
+    file.write_bytes(index.generate_index(options))
+
+    def complete(line, file=str(file)):
+        monkeypatch.setenv('COMP_LINE', line)
+        status = runtime.complete_main([file])
+        return status, capsys.readouterr()
+
+    assert complete('prog --k') == (0, ('--key\n', ''))
+
+    # Failing python completions and broken indexes print nothing
+    assert complete('prog --key ') == (0, ('', ''))
+    assert complete('prog --name ') == (0, ('', ''))
+    assert complete('prog ', str(tmp_path / 'missing.index')) == (1, ('', ''))
+    (tmp_path / 'bad.index').write_bytes(b'garbage')
+    assert complete('prog ', str(tmp_path / 'bad.index')) == (1, ('', ''))
+
+def test_comp_point(tmp_path, monkeypatch, capsys):
+    file = tmp_path / 'prog.index'
+    file.write_bytes(marshal.dumps(make_index()))
+
+    # Only the line up to the cursor is completed
+    line = 'prog --output o s1'
+    monkeypatch.setenv('COMP_LINE', line)
+    for point, output in [
+        (len('prog --output o'),   'out1\nout2\n'),
+        (len('prog --outp'),       '--output\n'),
+        (len('prog '),             's1\ns2\n'),
+        (len(line),                's1\n'),
+    ]:
+        monkeypatch.setenv('COMP_POINT', str(point))
+        assert runtime.complete_main([str(file)]) == 0
+        assert capsys.readouterr().out == output
@@ -0,0 +1,58 @@
+import os, runpy, pytest
+from argparse_tool import serialize
+from argparse_tool.options import Options, ArgumentParser_to_Options
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROGRAM = os.path.join(ROOT, 'argparse-tool-test')
+
+def keys(word):
+    return ['alpha', 'beta']
+
+def load_tree():
+    parser = runpy.run_path(PROGRAM, run_name='argparse_tool_test')['argp']
+    parser.usage = 'usage'
+    parser.markdown_epilog = 'EPILOG'
+    return ArgumentParser_to_Options(parser)
+
+def make_options(complete):
+    options = Options('prog', 'Help')
+    options.add(['--key'], complete=complete)
+    sub = Options('sub', 'Sub')
+    sub.add(['-x'], takes_args=False)
+    subparsers = options.add_subparsers(name='command', help='Commands')
+    subparsers.add_options_object(sub, 'one', ['1'])
+    subparsers.add_options_object(sub, 'two', [])
+    options.finalize()
+    return options
+
+@pytest.mark.parametrize('dumps, loads', [
+    (serialize.dumps_json,   serialize.loads_json),
+    (serialize.dumps_binary, serialize.loads_binary),
+])
+def test_round_trip(dumps, loads):
+    tree = load_tree()
+    restored = loads(dumps(tree))
+    assert serialize.to_dict(restored) == serialize.to_dict(tree)
+    assert (restored.usage, restored.markdown_epilog) == ('usage', 'EPILOG')
+    assert dumps(restored) == dumps(tree)
+
+def test_shared_subcommand_is_stored_once():
+    d = serialize.to_dict(make_options(('choices', ['a', 'b'])))
+    one, two = d['subparsers']['subcommands']
+    assert one['names'] == ['one', '1'] and 'options' in one
+    assert two == {'names': ['two'], 'ref': 1}
+
+    restored = serialize.from_dict(d)
+    subcommands = restored.get_subparsers_option().subcommands
+    assert subcommands['one'] is subcommands['two']
+
+def test_python_completion_is_stored_by_name():
+    tree = make_options(('cached', 60, 'python', keys, 'x'))
+    restored = serialize.loads_json(serialize.dumps_json(tree))
+    assert restored.get_option('--key').complete == ('cached', 60, 'python', __name__ + ':keys', 'x')
+    assert serialize.is_cacheable(tree)
+
+def test_not_cacheable():
+    assert not serialize.is_cacheable(make_options(('choices', lambda: ['a'])))
+    assert not serialize.is_cacheable(make_options(('python', lambda word: [])))
+    assert serialize.is_cacheable(make_options(('choices', range(3))))
@@ -0,0 +1,101 @@
+import os, runpy, argparse, textwrap, pytest
+from argparse_tool import static, loader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def write(tmp_path, source, name='prog.py'):
+    # Imported programs stay in sys.modules, their names must be unique
+    path = tmp_path / name
+    path.write_text(textwrap.dedent(source))
+    return str(path)
+
+def describe(parser):
+    ''' Return the parts of `parser` that are used for generating the output '''
+    r = [parser.prog, parser.description, parser.usage, parser.epilog]
+    for a in parser._actions:
+        r.append((type(a).__name__, a.option_strings, a.dest, a.help, a.metavar, a.nargs,
+                  a.choices if not isinstance(a, argparse._SubParsersAction) else None,
+                  getattr(a, 'completion', None)))
+        if isinstance(a, argparse._SubParsersAction):
+            r.append([(name, describe(sub)) for name, sub in a.choices.items()])
+    return r
+
+def test_same_parser_as_import():
+    program = os.path.join(ROOT, 'argparse-tool-test')
+    imported = runpy.run_path(program, run_name='argparse_tool_test')['argp']
+    assert describe(static.load_parser(program)) == describe(imported)
+
+def test_program_code_is_not_executed(tmp_path):
+    marker = tmp_path / 'executed'
+    program = write(tmp_path, f'''
+        import argparse, sys
+        open({str(marker)!r}, 'w').close()
+        p = argparse.ArgumentParser('prog')
+        p.add_argument('--name')
+        sys.exit(1)
+    ''')
+    parser = static.load_parser(program)
+    assert not marker.exists()
+    assert [a.option_strings for a in parser._actions] == [['-h', '--help'], ['--name']]
+
+def test_loops_functions_and_subparsers(tmp_path):
+    program = write(tmp_path, '''
+        import argparse
+        from argparse import ArgumentParser
+
+        def add_common(parser, names):
+            for name in names:
+                parser.add_argument('--' + name, help=name.upper())
+            return parser
+
+        p = ArgumentParser('prog')
+        add_common(p, ['alpha', 'beta'])
+        sub = p.add_subparsers()
+        run = sub.add_parser('run', aliases=['r'], help='Run it')
+        run.add_argument('target').complete('range', range(3))
+    ''')
+    parser = static.load_parser(program)
+    assert parser._actions[2].help == 'BETA'
+    subparsers = parser._actions[-1]
+    assert list(subparsers.choices) == ['run', 'r']
+    assert subparsers.choices['run'] is subparsers.choices['r']
+    assert subparsers.choices['run']._actions[-1].completion == ('range', range(3))
+
+def test_parser_attributes(tmp_path):
+    program = write(tmp_path, '''
+        import argparse
+        p = argparse.ArgumentParser('prog', epilog='EPILOG')
+        p.markdown_prolog = 'PROLOG'
+        p.unrelated = object()
+    ''')
+    parser = static.load_parser(program)
+    assert (parser.epilog, parser.markdown_prolog) == ('EPILOG', 'PROLOG')
+
+def test_unresolvable_building_call(tmp_path):
+    program = write(tmp_path, '''
+        import argparse, config
+        p = argparse.ArgumentParser('prog')
+        p.add_argument('--mode', choices=config.modes())
+    ''')
+    with pytest.raises(static.StaticEvaluationError):
+        static.load_parser(program)
+
+def test_unrelated_unresolvable_code_is_skipped(tmp_path):
+    program = write(tmp_path, '''
+        import argparse, config
+        settings = config.load()
+        p = argparse.ArgumentParser('prog')
+        p.add_argument('--mode', default=settings.mode)
+    ''')
+    parser = static.load_parser(program)
+    assert parser._actions[-1].option_strings == ['--mode']
+
+def test_loader_falls_back_to_import(tmp_path, capsys):
+    program = write(tmp_path, '''
+        import argparse
+        p = argparse.ArgumentParser('prog')
+        p.add_argument('--mode', choices=sorted(__import__('string').ascii_lowercase[:2]))
+    ''', 'fallback.py')
+    parser = loader.load_parser(program, use_static=True)
+    assert parser._actions[-1].choices == ['a', 'b']
+    assert 'falling back to import' in capsys.readouterr().err
@@ -0,0 +1,25 @@
+import textwrap
+from argparse_tool import loader
+
+def test_stubs(tmp_path, capsys):
+    program = tmp_path / 'stubbed.py'
+    program.write_text(textwrap.dedent('''
+        import argparse
+        import numpy as np
+        from numpy import unused, linalg
+        from pandas import DataFrame
+
+        if tuple(int(v) for v in np.__version__.split('.')) < (1, 0):
+            pass
+        assert not hasattr(np, '__array__')
+
+        p = argparse.ArgumentParser('prog')
+        p.add_argument('--dtype', choices=['float32', 'float64'], default=np.zeros(3))
+        p.add_argument('--order', default=linalg.norm)
+    '''))
+
+    parser = loader.load_parser(str(program), stub_modules=['numpy', 'pandas'])
+    assert [a.dest for a in parser._actions] == ['help', 'dtype', 'order']
+
+    err = capsys.readouterr().err
+    assert 'used stubbed modules: numpy.linalg.norm, numpy.zeros()' in err
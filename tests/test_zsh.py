@@ -0,0 +1,93 @@
+import io, os, re, sys, shutil, subprocess, textwrap, pytest
+from argparse_tool import zsh
+from argparse_tool.options import Options
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_rest_positional_is_quoted():
+    options = Options('prog')
+    options.add(['files'], help='Files', nargs='*', complete=('file',))
+    options.finalize()
+    out = io.StringIO()
+    zsh.generate_completion(options, 'prog', out)
+    assert "'*':Files:" in out.getvalue()
+
+def test_large_range_is_cut_off():
+    options = Options('prog')
+    options.add(['--num'], help='Number', metavar='N', complete=('range', range(0, 10**9)))
+    options.finalize()
+    out = io.StringIO()
+    zsh.generate_completion(options, 'prog', out)
+    assert "'({0..9999})'" in out.getvalue()
+    assert '999999999' not in out.getvalue()
+
+def test_fpath_dir(tmp_path):
+    program = tmp_path / 'fpath_prog.py'
+    program.write_text(textwrap.dedent('''
+        import argparse
+        p = argparse.ArgumentParser('prog')
+        commands = p.add_subparsers()
+        run = commands.add_parser('run', aliases=['r'])
+        run.add_argument('--fast', action='store_true')
+        run.add_subparsers().add_parser('now')
+        commands.add_parser('stop').add_argument('--kill', choices=['now', 'later'])
+    '''))
+    outdir = tmp_path / 'functions'
+
+    subprocess.run([sys.executable, os.path.join(ROOT, 'argparse-tool'), 'zsh', str(program),
+        '--fpath-dir', str(outdir)], check=True)
+
+    assert sorted(os.listdir(outdir)) == ['_prog', '_prog_run', '_prog_run_now', '_prog_stop']
+
+    # Only the file of the program is found by compinit, the others are
+    # autoloaded function bodies
+    root = (outdir / '_prog').read_text()
+    assert root.startswith('#compdef prog\n')
+    assert '(run|r) autoload -Uz _prog_run; _prog_run; break;;' in root
+    assert '(stop) autoload -Uz _prog_stop; _prog_stop; break;;' in root
+    assert '(now) autoload -Uz _prog_run_now; _prog_run_now; break;;' in (outdir / '_prog_run').read_text()
+
+    for name in ('_prog_run', '_prog_run_now', '_prog_stop'):
+        body = (outdir / name).read_text()
+        assert body.startswith('  _arguments')
+        assert '#compdef' not in body
+        assert '%s() {' % name not in body
+
+def test_compile_files_without_zsh(tmp_path, monkeypatch):
+    (tmp_path / '_prog').write_text('_arguments\n')
+    monkeypatch.setenv('PATH', str(tmp_path))
+    with pytest.raises(Exception, match='zsh is not installed'):
+        zsh.compile_files([str(tmp_path / '_prog')])
+
+def test_cached_does_not_change_styles():
+    options = Options('prog')
+    options.add(['--user'], help='User', metavar='USER', complete=('cached', 300, 'user'))
+    options.finalize()
+    out = io.StringIO()
+    zsh.generate_completion(options, 'prog', out)
+    script = out.getvalue()
+    assert '_argparse_tool_cached_1 users 300' in script
+    # Styles are only read
+    assert re.findall(r'zstyle (\S+)', script) == ['-s', '-s', '-s']
+
+CACHE_TEST = r"""
+_wanted() { shift 3; "$@" }
+compadd() { print -rl -- "${(@P)2}" }
+curcontext=:complete:prog:
+eval "$1"
+_argparse_tool_cached_1 users 60 'reply=(alpha "b c")'
+_argparse_tool_cached_1 users 60 'reply=(changed)'
+_argparse_tool_cached_1 users 0 'reply=(changed)'
+zstyle ':completion:*' use-cache no
+_argparse_tool_cached_1 users 60 'reply=(uncached)'
+zstyle -d ':completion:*' use-cache
+zstyle -L
+"""
+
+def test_cached_under_zsh(tmp_path):
+    if not shutil.which('zsh'):
+        pytest.skip('zsh is not installed')
+    p = subprocess.run(['zsh', '-f', '-c', CACHE_TEST, 'zsh', zsh.CACHE_RUNTIME],
+        env={'HOME': str(tmp_path), 'PATH': os.environ['PATH']}, capture_output=True, text=True, check=True)
+    assert p.stdout.split('\n') == ['alpha', 'b c', 'alpha', 'b c', 'changed', 'uncached', '']
+    assert (tmp_path / '.zcompcache' / 'argparse_tool_users').read_text() == "reply=('changed')\n"